@@ -0,0 +1,135 @@
+"""
+Acknowledgement processing for a QoS 1 backlog (clean_session=False after a
+broker outage).
+
+The client connects to a local broker stand-in that answers CONNECT with
+CONNACK and every PUBLISH with PUBACK, but holds the PUBACKs back while N
+messages are published: the inflight window fills and the rest of the
+backlog is queued. Then the acknowledgements are released and the time until
+the whole backlog is acknowledged is measured, with the queued-mid FIFO and
+with the previous scan of _out_messages, for several inflight windows.
+
+    python3 benchmarks/bench_mqtt_inflight.py [--messages 10000]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'custom_components', 'bisecur2mqtt'))
+import libs.mqtt.client as paho
+
+
+class ScanClient(paho.Client):
+    """_update_inflight() as it was: scan _out_messages from the start"""
+
+    def _update_inflight(self):
+        for m in self._out_messages.values():
+            if self._inflight_messages < self._max_inflight_messages:
+                if m.qos > 0 and m.state == paho.mqtt_ms_queued:
+                    self._inflight_messages += 1
+                    m.state = paho.mqtt_ms_wait_for_puback if m.qos == 1 else paho.mqtt_ms_wait_for_pubrec
+                    rc = self._send_publish(m.mid, m.topic.encode('utf-8'), m.payload, m.qos, m.retain, m.dup,
+                                            properties=m.properties)
+                    if rc != 0:
+                        return rc
+            else:
+                return paho.MQTT_ERR_SUCCESS
+        return paho.MQTT_ERR_SUCCESS
+
+
+class BrokerStandIn:
+    """CONNACK for CONNECT, PUBACK for QoS 1 PUBLISH once release is set"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.srv = socket.socket()
+        self.srv.bind(('127.0.0.1', 0))
+        self.srv.listen(1)
+        self.port = self.srv.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        conn, _ = self.srv.accept()
+        buf = b''
+        while True:
+            data = conn.recv(1 << 16)
+            if not data:
+                return
+            buf += data
+            out = bytearray()
+            while len(buf) >= 2:
+                length, mult, pos = 0, 1, 1
+                while True:
+                    if pos >= len(buf):
+                        break
+                    byte = buf[pos]
+                    pos += 1
+                    length += (byte & 127) * mult
+                    mult *= 128
+                    if not byte & 128:
+                        break
+                if pos + length > len(buf) or buf[pos - 1] & 128:
+                    break
+                command = buf[0] & 0xF0
+                if command == 0x10:
+                    out += b'\x20\x02\x01\x00'
+                elif command == 0x30 and buf[0] & 0x06:
+                    topic_len = int.from_bytes(buf[pos:pos + 2], 'big')
+                    out += b'\x40\x02' + buf[pos + 2 + topic_len:pos + 4 + topic_len]
+                buf = buf[pos + length:]
+            if out:
+                if out[0] != 0x20:
+                    self.release.wait()
+                conn.sendall(out)
+
+
+def run(cls, messages, window):
+    broker = BrokerStandIn()
+    client = cls('bench', clean_session=False)
+    client.max_inflight_messages_set(window)
+    client.max_queued_messages_set(0)
+    connected = threading.Event()
+    client.on_connect = lambda *args: connected.set()
+    client.connect('127.0.0.1', broker.port)
+    client.loop_start()
+    connected.wait(10)
+    for i in range(messages):
+        client.publish('bisecur2mqtt/command/status', b'{"door": 0, "status": "ok"}', qos=1)
+    assert len(client._out_messages) == messages and client._inflight_messages == window
+    done = threading.Event()
+    acked = [0]
+
+    def on_publish(c, userdata, mid):
+        acked[0] += 1
+        if acked[0] == messages:
+            done.set()
+    client.on_publish = on_publish
+
+    start = time.perf_counter()
+    broker.release.set()
+    if not done.wait(120):
+        raise RuntimeError('backlog not acknowledged, %d left' % (messages - acked[0]))
+    elapsed = time.perf_counter() - start
+    client.loop_stop()
+    client._sock_close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=10000)
+    opts = parser.parse_args()
+
+    print('%d QoS 1 messages backlog' % opts.messages)
+    print('%-8s %16s %16s' % ('window', 'scan s', 'FIFO s'))
+    for window in (20, 200, 1000):
+        scan = run(ScanClient, opts.messages, window)
+        fifo = run(paho.Client, opts.messages, window)
+        print('%-8d %16.3f %16.3f' % (window, scan, fifo))
+
+
+if __name__ == '__main__':
+    main()
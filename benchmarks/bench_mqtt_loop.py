@@ -0,0 +1,112 @@
+"""
+Network loop engines of the vendored paho client: select() vs selectors.
+
+The client runs loop_start() against a local socket sink, the main thread
+publishes like the bridge's tracker threads do.
+
+ - wake-up: one publish at a time, time until the sink receives it
+ - burst: N publishes back to back, CPU time per message until all arrived
+
+    python3 benchmarks/bench_mqtt_loop.py [--wakeups 2000] [--messages 50000]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'custom_components', 'bisecur2mqtt'))
+import libs.mqtt.client as paho
+
+PAYLOAD = b'x' * 32
+TOPIC = 'bisecur2mqtt/0/garage_door/position'
+
+
+class Sink:
+    def __init__(self, sock):
+        self.sock = sock
+        self.received = 0
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            data = self.sock.recv(1 << 16)
+            if not data:
+                return
+            with self.cond:
+                self.received += len(data)
+                self.cond.notify_all()
+
+    def wait_for(self, nbytes):
+        with self.cond:
+            self.cond.wait_for(lambda: self.received >= nbytes)
+
+
+def started_client(engine):
+    a, b = socket.socketpair()
+    a.setblocking(False)
+    client = paho.Client('bench')
+    client.set_loop_engine(engine)
+    client._sock = a
+    client._state = paho.mqtt_cs_connected
+    client.loop_start()
+    return client, Sink(b)
+
+
+def stop(client, sink):
+    client.loop_stop()
+    client._sock_close()
+    sink.thread.join()
+
+
+def bench_wakeup(engine, count):
+    client, sink = started_client(engine)
+    client.publish(TOPIC, PAYLOAD)
+    sink.wait_for(1)
+    size = sink.received
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        client.publish(TOPIC, PAYLOAD)
+        sink.wait_for(size * (i + 2))
+        latencies.append(time.perf_counter() - start)
+    stop(client, sink)
+    latencies.sort()
+    return sum(latencies) / count, latencies[int(count * 0.99)]
+
+
+def bench_burst(engine, count):
+    client, sink = started_client(engine)
+    client.publish(TOPIC, PAYLOAD)
+    sink.wait_for(1)
+    size = sink.received
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    for _ in range(count):
+        client.publish(TOPIC, PAYLOAD)
+    sink.wait_for(size * (count + 1))
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    stop(client, sink)
+    return wall, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--wakeups', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=50000)
+    opts = parser.parse_args()
+
+    print('%-10s %14s %14s %12s %14s' % ('engine', 'wake avg us', 'wake p99 us', 'burst s', 'cpu us/msg'))
+    for engine in (paho.LOOP_ENGINE_SELECT, paho.LOOP_ENGINE_SELECTOR):
+        avg, p99 = bench_wakeup(engine, opts.wakeups)
+        wall, cpu = bench_burst(engine, opts.messages)
+        print('%-10s %14.1f %14.1f %12.3f %14.2f' % (
+            engine, avg * 1e6, p99 * 1e6, wall, cpu / opts.messages * 1e6))
+
+
+if __name__ == '__main__':
+    main()
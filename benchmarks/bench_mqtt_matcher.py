@@ -0,0 +1,96 @@
+"""
+Topic matching for per-topic message callbacks (message_callback_add).
+
+Thousands of filters, one per door command topic plus some wildcards, are
+matched against a stream of inbound topics. Compares the previous recursive
+generator, the iterative walk (cache miss path) and the LRU dispatch cache
+used by Client, and checks that all three agree.
+
+    python3 benchmarks/bench_mqtt_matcher.py [--doors 500] [--messages 200000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'custom_components', 'bisecur2mqtt'))
+from libs.mqtt.matcher import MQTTMatcher
+
+COMMANDS = ('up', 'down', 'stop', 'impulse', 'partial', 'light', 'get_door_state', 'get_door_position')
+
+
+def recursive_iter_match(matcher, topic):
+    """iter_match() as it was before the iterative walk"""
+    lst = topic.split('/')
+    normal = not topic.startswith('$')
+
+    def rec(node, i=0):
+        if i == len(lst):
+            if node._content is not None:
+                yield node._content
+        else:
+            part = lst[i]
+            if part in node._children:
+                for content in rec(node._children[part], i + 1):
+                    yield content
+            if '+' in node._children and (normal or i > 0):
+                for content in rec(node._children['+'], i + 1):
+                    yield content
+        if '#' in node._children and (normal or i > 0):
+            content = node._children['#']._content
+            if content is not None:
+                yield content
+    return rec(matcher._root)
+
+
+def build(doors, cache_size):
+    matcher = MQTTMatcher(cache_size=cache_size)
+    for door in range(doors):
+        for cmd in COMMANDS:
+            matcher['bisecur2mqtt/%d/send_command/%s' % (door, cmd)] = ('cmd', door, cmd)
+        matcher['bisecur2mqtt/%d/+/position' % door] = ('position', door)
+    matcher['bisecur2mqtt/+/send_command/#'] = ('any command',)
+    matcher['bisecur2mqtt/#'] = ('all',)
+    matcher['homeassistant/status'] = ('ha',)
+    return matcher
+
+
+def timed(func, topics):
+    start = time.perf_counter()
+    for topic in topics:
+        func(topic)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--doors', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=200000)
+    opts = parser.parse_args()
+
+    plain = build(opts.doors, 0)
+    cached = build(opts.doors, 1024)
+    rnd = random.Random(1)
+    # Inbound traffic concentrates on a few hundred hot topics
+    hot = ['bisecur2mqtt/%d/send_command/%s' % (rnd.randrange(opts.doors), rnd.choice(COMMANDS)) for _ in range(200)]
+    hot += ['bisecur2mqtt/%d/garage_door/position' % d for d in range(min(opts.doors, 100))]
+    topics = [rnd.choice(hot) for _ in range(opts.messages)]
+
+    for topic in hot:
+        expected = list(recursive_iter_match(plain, topic))
+        assert list(plain.match(topic)) == expected, topic
+        assert list(cached.match(topic)) == expected, topic
+
+    filters = opts.doors * (len(COMMANDS) + 1) + 3
+    print('%d filters, %d messages over %d distinct topics' % (filters, opts.messages, len(hot)))
+    print('%-22s %10s %12s' % ('matcher', 'seconds', 'us/message'))
+    for name, func in (('recursive generator', lambda t: list(recursive_iter_match(plain, t))),
+                       ('iterative walk', plain.match),
+                       ('LRU dispatch cache', cached.match)):
+        elapsed = timed(func, topics)
+        print('%-22s %10.3f %12.2f' % (name, elapsed, elapsed / opts.messages * 1e6))
+
+
+if __name__ == '__main__':
+    main()
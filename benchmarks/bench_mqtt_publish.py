@@ -0,0 +1,85 @@
+"""
+Publish throughput of the vendored paho client against a local socket sink.
+
+Simulates the startup burst of the bridge (HA discovery, `_ts` twins,
+availability): N QoS 0 publishes are queued, then flushed with loop_write().
+Compares one packet per send() (_write_batch = 1, the old behaviour) with
+batched sendmsg() writes and counts the socket calls.
+
+    python3 benchmarks/bench_mqtt_publish.py [--messages 20000] [--payload 64]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'custom_components', 'bisecur2mqtt'))
+import libs.mqtt.client as paho
+
+
+class CountingSocket(socket.socket):
+    """Socket that counts write system calls"""
+    calls = 0
+
+    def send(self, *args):
+        CountingSocket.calls += 1
+        return socket.socket.send(self, *args)
+
+    def sendmsg(self, *args):
+        CountingSocket.calls += 1
+        return socket.socket.sendmsg(self, *args)
+
+
+def sink(sock, total):
+    while True:
+        data = sock.recv(1 << 16)
+        if not data:
+            return
+        total[0] += len(data)
+
+
+def run(messages, payload, batch):
+    a, b = socket.socketpair()
+    a.setblocking(False)
+    received = [0]
+    reader = threading.Thread(target=sink, args=(b, received), daemon=True)
+    reader.start()
+
+    client = paho.Client('bench')
+    client._sock = CountingSocket(fileno=a.detach())
+    client._state = paho.mqtt_cs_connected
+    client._write_batch = batch
+    client.on_socket_register_write = lambda *args: None  # only queue, flush below
+    CountingSocket.calls = 0
+
+    body = b'x' * payload
+    start = time.perf_counter()
+    for i in range(messages):
+        client.publish('bisecur2mqtt/%d/garage_door/state' % (i % 8), body)
+    while client.want_write():
+        client.loop_write()
+    elapsed = time.perf_counter() - start
+
+    sent_calls = CountingSocket.calls
+    client._sock.close()
+    client._sock = None
+    reader.join()
+    return elapsed, sent_calls, received[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--payload', type=int, default=64)
+    opts = parser.parse_args()
+
+    print('%-22s %10s %12s %10s %12s' % ('mode', 'seconds', 'msg/s', 'syscalls', 'bytes'))
+    for name, batch in (('per-packet send()', 1), ('batched sendmsg()', 64)):
+        elapsed, calls, nbytes = run(opts.messages, opts.payload, batch)
+        print('%-22s %10.3f %12.0f %10d %12d' % (name, elapsed, opts.messages / elapsed, calls, nbytes))
+
+
+if __name__ == '__main__':
+    main()
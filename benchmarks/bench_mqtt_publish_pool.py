@@ -0,0 +1,125 @@
+"""
+Bulk republishing with publish.multiple() vs PublishPool.multiple().
+
+Republishes the door state topics in B batches of M messages against a local
+broker stand-in (CONNACK, PUBACK, PUBREC/PUBCOMP, DISCONNECT), optionally over
+a link with an added round trip delay. publish.multiple() connects and
+disconnects for every batch and publishes one message per acknowledgement;
+the pool keeps the connection and pipelines the whole batch.
+
+    python3 benchmarks/bench_mqtt_publish_pool.py [--batches 50] [--messages 20] [--qos 1] [--rtt-ms 0]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'custom_components', 'bisecur2mqtt'))
+from libs.mqtt import publish
+
+
+class BrokerStandIn:
+    """Acknowledges everything, replies are delayed by rtt seconds"""
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.connects = 0
+        self.publishes = 0
+        self.srv = socket.socket()
+        self.srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.srv.bind(('127.0.0.1', 0))
+        self.srv.listen(16)
+        self.port = self.srv.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            conn, _ = self.srv.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        buf = b''
+        with conn:
+            while True:
+                try:
+                    data = conn.recv(1 << 16)
+                except OSError:
+                    return
+                if not data:
+                    return
+                buf += data
+                out = bytearray()
+                while len(buf) >= 2:
+                    length, mult, pos = 0, 1, 1
+                    while pos < len(buf):
+                        byte = buf[pos]
+                        pos += 1
+                        length += (byte & 127) * mult
+                        mult *= 128
+                        if not byte & 128:
+                            break
+                    if buf[pos - 1] & 128 or pos + length > len(buf):
+                        break
+                    command = buf[0] & 0xF0
+                    if command == 0x10:
+                        self.connects += 1
+                        out += b'\x20\x02\x00\x00'
+                    elif command == 0x30:
+                        self.publishes += 1
+                        qos = (buf[0] >> 1) & 3
+                        if qos:
+                            topic_len = int.from_bytes(buf[pos:pos + 2], 'big')
+                            mid = buf[pos + 2 + topic_len:pos + 4 + topic_len]
+                            out += (b'\x40\x02' if qos == 1 else b'\x50\x02') + mid
+                    elif command == 0x60:
+                        out += b'\x70\x02' + buf[pos:pos + 2]
+                    elif command == 0xC0:
+                        out += b'\xd0\x00'
+                    elif command == 0xE0:
+                        return
+                    buf = buf[pos + length:]
+                if out:
+                    if self.rtt:
+                        time.sleep(self.rtt)
+                    conn.sendall(out)
+
+
+def batches(count, messages, qos):
+    for b in range(count):
+        yield [('bisecur2mqtt/%d/garage_door/state' % (m % 8), 'open' if (b + m) % 2 else 'closed', qos, True)
+               for m in range(messages)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batches', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--qos', type=int, default=1, choices=(0, 1, 2))
+    parser.add_argument('--rtt-ms', type=float, default=0.0)
+    opts = parser.parse_args()
+
+    broker = BrokerStandIn(opts.rtt_ms / 1000.0)
+    total = opts.batches * opts.messages
+
+    start = time.perf_counter()
+    for msgs in batches(opts.batches, opts.messages, opts.qos):
+        publish.multiple(msgs, port=broker.port)
+    oneshot = time.perf_counter() - start
+    connects = broker.connects
+
+    with publish.PublishPool() as pool:
+        start = time.perf_counter()
+        for msgs in batches(opts.batches, opts.messages, opts.qos):
+            pool.multiple(msgs, port=broker.port)
+        pooled = time.perf_counter() - start
+
+    print('%d batches x %d messages, QoS %d, rtt %.1f ms' % (opts.batches, opts.messages, opts.qos, opts.rtt_ms))
+    print('publish.multiple  %8.3f s  %8.0f msg/s  %4d connects' % (oneshot, total / oneshot, connects))
+    print('PublishPool       %8.3f s  %8.0f msg/s  %4d connects' % (pooled, total / pooled, broker.connects - connects))
+
+
+if __name__ == '__main__':
+    main()
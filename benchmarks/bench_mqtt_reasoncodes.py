@@ -0,0 +1,246 @@
+"""
+ReasonCodes cost in ack-heavy MQTT v5 QoS 1 traffic.
+
+N QoS 1 messages are published (MQTT v5), then the client reads N PUBACKs
+that carry a reason code (16, "No matching subscribers", as sent for a
+topic nobody subscribed to), so every acknowledgement creates a ReasonCodes
+object. Runs once with the table-backed ReasonCodes and once with the
+previous implementation, kept below as LegacyReasonCodes, patched into the
+client. Also times plain construction/str() of both.
+
+    python3 benchmarks/bench_mqtt_reasoncodes.py [--messages 20000]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'custom_components', 'bisecur2mqtt'))
+import libs.mqtt.client as paho
+from libs.mqtt.packettypes import PacketTypes
+from libs.mqtt.reasoncodes import ReasonCodes
+
+
+class LegacyReasonCodes:
+    """ReasonCodes as shipped with paho 1.6.1"""
+
+    def __init__(self, packetType, aName="Success", identifier=-1):
+        """
+        packetType: the type of the packet, such as PacketTypes.CONNECT that
+            this reason code will be used with.  Some reason codes have different
+            names for the same identifier when used a different packet type.
+
+        aName: the String name of the reason code to be created.  Ignored
+            if the identifier is set.
+
+        identifier: an integer value of the reason code to be created.
+
+        """
+
+        self.packetType = packetType
+        self.names = {
+            0: {"Success": [PacketTypes.CONNACK, PacketTypes.PUBACK,
+                            PacketTypes.PUBREC, PacketTypes.PUBREL, PacketTypes.PUBCOMP,
+                            PacketTypes.UNSUBACK, PacketTypes.AUTH],
+                "Normal disconnection": [PacketTypes.DISCONNECT],
+                "Granted QoS 0": [PacketTypes.SUBACK]},
+            1: {"Granted QoS 1": [PacketTypes.SUBACK]},
+            2: {"Granted QoS 2": [PacketTypes.SUBACK]},
+            4: {"Disconnect with will message": [PacketTypes.DISCONNECT]},
+            16: {"No matching subscribers":
+                 [PacketTypes.PUBACK, PacketTypes.PUBREC]},
+            17: {"No subscription found": [PacketTypes.UNSUBACK]},
+            24: {"Continue authentication": [PacketTypes.AUTH]},
+            25: {"Re-authenticate": [PacketTypes.AUTH]},
+            128: {"Unspecified error": [PacketTypes.CONNACK, PacketTypes.PUBACK,
+                                        PacketTypes.PUBREC, PacketTypes.SUBACK, PacketTypes.UNSUBACK,
+                                        PacketTypes.DISCONNECT], },
+            129: {"Malformed packet":
+                  [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+            130: {"Protocol error":
+                  [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+            131: {"Implementation specific error": [PacketTypes.CONNACK,
+                                                    PacketTypes.PUBACK, PacketTypes.PUBREC, PacketTypes.SUBACK,
+                                                    PacketTypes.UNSUBACK, PacketTypes.DISCONNECT], },
+            132: {"Unsupported protocol version": [PacketTypes.CONNACK]},
+            133: {"Client identifier not valid": [PacketTypes.CONNACK]},
+            134: {"Bad user name or password": [PacketTypes.CONNACK]},
+            135: {"Not authorized": [PacketTypes.CONNACK, PacketTypes.PUBACK,
+                                     PacketTypes.PUBREC, PacketTypes.SUBACK, PacketTypes.UNSUBACK,
+                                     PacketTypes.DISCONNECT], },
+            136: {"Server unavailable": [PacketTypes.CONNACK]},
+            137: {"Server busy": [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+            138: {"Banned": [PacketTypes.CONNACK]},
+            139: {"Server shutting down": [PacketTypes.DISCONNECT]},
+            140: {"Bad authentication method":
+                  [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+            141: {"Keep alive timeout": [PacketTypes.DISCONNECT]},
+            142: {"Session taken over": [PacketTypes.DISCONNECT]},
+            143: {"Topic filter invalid":
+                  [PacketTypes.SUBACK, PacketTypes.UNSUBACK, PacketTypes.DISCONNECT]},
+            144: {"Topic name invalid":
+                  [PacketTypes.CONNACK, PacketTypes.PUBACK,
+                   PacketTypes.PUBREC, PacketTypes.DISCONNECT]},
+            145: {"Packet identifier in use":
+                  [PacketTypes.PUBACK, PacketTypes.PUBREC,
+                   PacketTypes.SUBACK, PacketTypes.UNSUBACK]},
+            146: {"Packet identifier not found":
+                  [PacketTypes.PUBREL, PacketTypes.PUBCOMP]},
+            147: {"Receive maximum exceeded": [PacketTypes.DISCONNECT]},
+            148: {"Topic alias invalid": [PacketTypes.DISCONNECT]},
+            149: {"Packet too large": [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+            150: {"Message rate too high": [PacketTypes.DISCONNECT]},
+            151: {"Quota exceeded": [PacketTypes.CONNACK, PacketTypes.PUBACK,
+                                     PacketTypes.PUBREC, PacketTypes.SUBACK, PacketTypes.DISCONNECT], },
+            152: {"Administrative action": [PacketTypes.DISCONNECT]},
+            153: {"Payload format invalid":
+                  [PacketTypes.PUBACK, PacketTypes.PUBREC, PacketTypes.DISCONNECT]},
+            154: {"Retain not supported":
+                  [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+            155: {"QoS not supported":
+                  [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+            156: {"Use another server":
+                  [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+            157: {"Server moved":
+                  [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+            158: {"Shared subscription not supported":
+                  [PacketTypes.SUBACK, PacketTypes.DISCONNECT]},
+            159: {"Connection rate exceeded":
+                  [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+            160: {"Maximum connect time":
+                  [PacketTypes.DISCONNECT]},
+            161: {"Subscription identifiers not supported":
+                  [PacketTypes.SUBACK, PacketTypes.DISCONNECT]},
+            162: {"Wildcard subscription not supported":
+                  [PacketTypes.SUBACK, PacketTypes.DISCONNECT]},
+        }
+        if identifier == -1:
+            if packetType == PacketTypes.DISCONNECT and aName == "Success":
+                aName = "Normal disconnection"
+            self.set(aName)
+        else:
+            self.value = identifier
+            self.getName()  # check it's good
+
+    def __getName__(self, packetType, identifier):
+        """
+        Get the reason code string name for a specific identifier.
+        The name can vary by packet type for the same identifier, which
+        is why the packet type is also required.
+
+        Used when displaying the reason code.
+        """
+        assert identifier in self.names.keys(), identifier
+        names = self.names[identifier]
+        namelist = [name for name in names.keys() if packetType in names[name]]
+        assert len(namelist) == 1
+        return namelist[0]
+
+    def getId(self, name):
+        """
+        Get the numeric id corresponding to a reason code name.
+
+        Used when setting the reason code for a packetType
+        check that only valid codes for the packet are set.
+        """
+        identifier = None
+        for code in self.names.keys():
+            if name in self.names[code].keys():
+                if self.packetType in self.names[code][name]:
+                    identifier = code
+                break
+        assert identifier is not None, name
+        return identifier
+
+    def set(self, name):
+        self.value = self.getId(name)
+
+    def unpack(self, buffer):
+        c = buffer[0]
+        if sys.version_info[0] < 3:
+            c = ord(c)
+        name = self.__getName__(self.packetType, c)
+        self.value = self.getId(name)
+        return 1
+
+    def getName(self):
+        """Returns the reason code name corresponding to the numeric value which is set.
+        """
+        return self.__getName__(self.packetType, self.value)
+
+    def __eq__(self, other):
+        if isinstance(other, int):
+            return self.value == other
+        if isinstance(other, str):
+            return self.value == str(self)
+        if isinstance(other, LegacyReasonCodes):
+            return self.value == other.value
+        return False
+
+    def __str__(self):
+        return self.getName()
+
+    def json(self):
+        return self.getName()
+
+    def pack(self):
+        return bytearray([self.value])
+
+
+def ack_run(messages):
+    a, b = socket.socketpair()
+    a.setblocking(False)
+    client = paho.Client('bench', protocol=paho.MQTTv5)
+    client._sock = a
+    client._state = paho.mqtt_cs_connected
+    client.max_inflight_messages_set(0)
+    client.on_socket_register_write = lambda *args: None  # nothing is written, only acks are read
+    acked = [0]
+    client.on_publish = lambda *args: acked.__setitem__(0, acked[0] + 1)
+
+    for i in range(messages):
+        client.publish('bisecur2mqtt/%d/garage_door/state' % (i % 8), 'open', qos=1)
+    mids = list(client._out_messages)
+
+    acks = b''.join(b'\x40\x03' + mid.to_bytes(2, 'big') + b'\x10' for mid in mids)
+    start = time.perf_counter()
+    pos = 0
+    while acked[0] < messages:
+        if pos < len(acks):
+            pos += b.send(acks[pos:pos + 65536])
+        client.loop_read()
+    elapsed = time.perf_counter() - start
+    a.close()
+    b.close()
+    return elapsed
+
+
+def construct(cls, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        str(cls(PacketTypes.PUBACK, identifier=16))
+        cls(PacketTypes.SUBACK, identifier=1)
+        cls(PacketTypes.DISCONNECT)
+    return (time.perf_counter() - start) / (3 * count) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=20000)
+    opts = parser.parse_args()
+
+    new_acks = ack_run(opts.messages)
+    paho.ReasonCodes = LegacyReasonCodes
+    try:
+        old_acks = ack_run(opts.messages)
+    finally:
+        paho.ReasonCodes = ReasonCodes
+
+    print('%-8s  %14s  %16s' % ('', 'construct us', '%d PUBACKs' % opts.messages))
+    print('%-8s  %14.2f  %12.3f s' % ('legacy', construct(LegacyReasonCodes, opts.messages), old_acks))
+    print('%-8s  %14.2f  %12.3f s' % ('tables', construct(ReasonCodes, opts.messages), new_acks))
+
+
+if __name__ == '__main__':
+    main()
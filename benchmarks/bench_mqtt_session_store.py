@@ -0,0 +1,82 @@
+"""
+Cost of the MQTTFileSessionStore for QoS > 0 publishes and of restoring a backlog.
+
+Per message: publish() at QoS 1 on a client that is not connected (the
+message only goes into _out_messages) followed by the PUBACK handling
+(_do_on_publish), without a store, with the append-only log and with the
+log plus fsync. Then a backlog of N unacknowledged messages is left in the
+log and restored into a new client with session_store_set(), the way the
+bridge does after a restart.
+
+    python3 benchmarks/bench_mqtt_session_store.py [--messages 20000] [--backlog 100000] [--payload 64]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'custom_components', 'bisecur2mqtt'))
+import libs.mqtt.client as paho
+
+
+def publish_acked(store, messages, payload):
+    client = paho.Client('bench', clean_session=False)
+    client.max_inflight_messages_set(0)
+    if store is not None:
+        client.session_store_set(store)
+    start = time.perf_counter()
+    for i in range(messages):
+        mid = client.publish('bisecur2mqtt/command/status', payload, qos=1).mid
+        with client._out_message_mutex:
+            client._do_on_publish(mid)
+    elapsed = time.perf_counter() - start
+    if store is not None:
+        store.close()
+    return elapsed / messages
+
+
+def restore(path, backlog, payload):
+    client = paho.Client('bench', clean_session=False)
+    client.max_inflight_messages_set(0)
+    client.session_store_set(paho.MQTTFileSessionStore(path))
+    start = time.perf_counter()
+    for i in range(backlog):
+        client.publish('bisecur2mqtt/%d/garage_door/position' % (i % 8), payload, qos=1 + i % 2)
+    write = time.perf_counter() - start
+    client._session_store.close()
+    size = os.path.getsize(path)
+
+    start = time.perf_counter()
+    restored = paho.Client('bench', clean_session=False).session_store_set(paho.MQTTFileSessionStore(path))
+    return write, size, restored, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--backlog', type=int, default=100000)
+    parser.add_argument('--payload', type=int, default=64)
+    opts = parser.parse_args()
+    payload = b'x' * opts.payload
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'session.log')
+        plain = publish_acked(None, opts.messages, payload)
+        logged = publish_acked(paho.MQTTFileSessionStore(path), opts.messages, payload)
+        synced = publish_acked(paho.MQTTFileSessionStore(path, fsync=True), max(opts.messages // 20, 100), payload)
+        print('QoS 1 publish + PUBACK, %d B payload' % opts.payload)
+        print('  no store        %8.2f us/msg' % (plain * 1e6))
+        print('  append-only log %8.2f us/msg  (+%.2f us)' % (logged * 1e6, (logged - plain) * 1e6))
+        print('  log + fsync     %8.2f us/msg  (+%.2f us)' % (synced * 1e6, (synced - plain) * 1e6))
+
+        # mids are 16 bit: a backlog above 65535 reuses them, the newer message wins
+        backlog = min(opts.backlog, 65535)
+        os.remove(path)
+        write, size, restored, elapsed = restore(path, backlog, payload)
+        print('backlog of %d unacknowledged messages (%.1f MB log, written in %.2f s)' % (backlog, size / 1e6, write))
+        print('  restore         %8.3f s  (%d messages, %.2f us/msg)' % (elapsed, restored, elapsed / max(restored, 1) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+MQTT reconnect latency over TLS, with and without session resumption.
+
+A local TLS broker stand-in (self-signed certificate for localhost, made
+with the openssl command line tool) answers CONNECT with CONNACK. The
+client connects once, then disconnects and reconnects N times; the time
+from reconnect() to the CONNACK is measured. A second client sharing the
+SSLContext shows that its first connection already resumes the session of
+the first client.
+
+    python3 benchmarks/bench_mqtt_tls_reconnect.py [--reconnects 200] [--tls 1.2|1.3]
+"""
+import os
+import ssl
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'custom_components', 'bisecur2mqtt'))
+import libs.mqtt.client as paho
+
+
+def make_certificate(directory):
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost',
+                    '-keyout', key, '-out', cert], check=True, capture_output=True)
+    return cert, key
+
+
+class TLSBrokerStandIn:
+    """CONNACK for CONNECT, closes the connection on DISCONNECT"""
+
+    def __init__(self, cert, key, tls_version):
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(cert, key)
+        self.context.minimum_version = self.context.maximum_version = tls_version
+        self.srv = socket.socket()
+        self.srv.bind(('127.0.0.1', 0))
+        self.srv.listen(16)
+        self.port = self.srv.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            conn, _ = self.srv.accept()
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            with self.context.wrap_socket(conn, server_side=True) as tls:
+                while True:
+                    header = tls.recv(2)
+                    if len(header) < 2:
+                        return
+                    length, mult, byte = header[1] & 127, 128, header[1]
+                    while byte & 128:
+                        byte = tls.recv(1)[0]
+                        length += (byte & 127) * mult
+                        mult *= 128
+                    while length:
+                        length -= len(tls.recv(length))
+                    if header[0] & 0xF0 == 0x10:
+                        tls.sendall(b'\x20\x02\x00\x00')
+                    elif header[0] & 0xF0 == 0xE0:
+                        return
+        except (OSError, ssl.SSLError):
+            return
+
+
+def connect(client, first=False):
+    start = time.perf_counter()
+    if first:
+        client.connect('localhost', client.bench_port, 60)
+    else:
+        client.reconnect()
+    while not client.is_connected():
+        client.loop(timeout=1.0)
+    elapsed = time.perf_counter() - start
+    client.disconnect()
+    client.loop(timeout=0.01)
+    return elapsed
+
+
+def run(port, cafile, reconnects, resumption):
+    context = ssl.create_default_context(cafile=cafile)
+    client = paho.Client('bench_sub')
+    client.bench_port = port
+    client.tls_set_context(context)
+    client.tls_resumption_set(resumption)
+    connect(client, first=True)
+
+    times, reused = [], 0
+    for _ in range(reconnects):
+        times.append(connect(client))
+        reused += client.tls_session_reused()
+
+    peer = paho.Client('bench_pub')
+    peer.bench_port = port
+    peer.tls_set_context(context)
+    peer.tls_resumption_set(resumption)
+    peer_time = connect(peer, first=True)
+    return statistics.median(times), max(times), reused, peer_time, peer.tls_session_reused()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reconnects', type=int, default=200)
+    parser.add_argument('--tls', choices=('1.2', '1.3'), default='1.3')
+    opts = parser.parse_args()
+    version = ssl.TLSVersion.TLSv1_3 if opts.tls == '1.3' else ssl.TLSVersion.TLSv1_2
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = make_certificate(directory)
+        broker = TLSBrokerStandIn(cert, key, version)
+        print('TLS %s, %d reconnects' % (opts.tls, opts.reconnects))
+        print('%-12s  %10s  %10s  %8s  %16s' % ('', 'median ms', 'max ms', 'resumed', 'peer first conn'))
+        for resumption in (False, True):
+            median, worst, reused, peer_time, peer_reused = run(broker.port, cert, opts.reconnects, resumption)
+            print('%-12s  %10.2f  %10.2f  %8d  %10.2f ms %s' % (
+                'resumption' if resumption else 'full', median * 1e3, worst * 1e3, reused,
+                peer_time * 1e3, '(resumed)' if peer_reused else ''))
+
+
+if __name__ == '__main__':
+    main()
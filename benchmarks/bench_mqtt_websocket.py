@@ -0,0 +1,181 @@
+"""
+Websocket framing throughput of the vendored paho client.
+
+Masks outgoing frames with WebsocketWrapper._create_frame() and parses
+incoming masked frames through recv()/recv_into(), for payload sizes from
+16 B to 256 KB. The previous implementation (per-byte XOR loops, header and
+payload sliced out of the read buffer piece by piece) is kept below as
+LegacyWrapper for comparison.
+
+    python3 benchmarks/bench_mqtt_websocket.py [--bytes 8000000]
+"""
+import os
+import sys
+import time
+import struct
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'custom_components', 'bisecur2mqtt'))
+import libs.mqtt.client as paho
+
+SIZES = (16, 256, 4096, 65536, 262144)
+
+
+class FeedSocket(object):
+    """Non-blocking socket stand-in returning prepared wire data"""
+
+    def __init__(self, wire):
+        self.wire = memoryview(wire)
+        self.pos = 0
+
+    def recv(self, n):
+        if self.pos >= len(self.wire):
+            raise BlockingIOError
+        data = bytes(self.wire[self.pos:self.pos + n])
+        self.pos += len(data)
+        return data
+
+    def send(self, data):
+        return len(data)
+
+
+def make_wrapper(cls, sock):
+    ws = cls.__new__(cls)
+    ws.connected = True
+    ws._ssl = False
+    ws._host = 'localhost'
+    ws._port = 80
+    ws._socket = sock
+    ws._path = '/mqtt'
+    ws._sendbuffer = bytearray()
+    ws._readbuffer = bytearray()
+    ws._requested_size = 0
+    ws._payload_head = 0
+    ws._readbuffer_head = 0
+    ws._frame_unmasked = False
+    return ws
+
+
+class LegacyWrapper(paho.WebsocketWrapper):
+    """Masking and receive path as shipped with paho 1.6.1"""
+
+    def _create_frame(self, opcode, data, do_masking=1):
+        header = bytearray()
+        length = len(data)
+
+        mask_key = bytearray(os.urandom(4))
+        mask_flag = do_masking
+
+        header.append(0x80 | opcode)
+
+        if length < 126:
+            header.append(mask_flag << 7 | length)
+        elif length < 65536:
+            header.append(mask_flag << 7 | 126)
+            header += struct.pack("!H", length)
+        else:
+            header.append(mask_flag << 7 | 127)
+            header += struct.pack("!Q", length)
+
+        if mask_flag == 1:
+            for index in range(length):
+                data[index] ^= mask_key[index % 4]
+            data = mask_key + data
+
+        return header + data
+
+    def _buffered_read(self, length):
+        wanted_bytes = length - (len(self._readbuffer) - self._readbuffer_head)
+        if wanted_bytes > 0:
+            data = self._socket.recv(wanted_bytes)
+            if not data:
+                raise ConnectionAbortedError
+            self._readbuffer.extend(data)
+            if len(data) < wanted_bytes:
+                raise BlockingIOError
+
+        self._readbuffer_head += length
+        return self._readbuffer[self._readbuffer_head - length:self._readbuffer_head]
+
+    def _recv_impl(self, length):
+        self._readbuffer_head = 0
+        chunk_startindex = self._payload_head
+        chunk_endindex = self._payload_head + length
+
+        header1 = self._buffered_read(1)
+        header2 = self._buffered_read(1)
+        maskbit = (header2[0] & 0x80) == 0x80
+        payload_length = header2[0] & 0x7f
+        if payload_length == 0x7e:
+            payload_length, = struct.unpack("!H", self._buffered_read(2))
+        elif payload_length == 0x7f:
+            payload_length, = struct.unpack("!Q", self._buffered_read(8))
+        mask_key = self._buffered_read(4) if maskbit else None
+
+        readindex = min(chunk_endindex, payload_length)
+        payload = self._buffered_read(readindex)
+        if maskbit:
+            for index in range(chunk_startindex, readindex):
+                payload[index] ^= mask_key[index % 4]
+        result = payload[chunk_startindex:readindex]
+        self._payload_head = readindex
+
+        if readindex == payload_length:
+            self._readbuffer = bytearray()
+            self._payload_head = 0
+        return result
+
+    recv_into = None
+
+
+def bench_send(cls, size, total):
+    ws = make_wrapper(cls, FeedSocket(b''))
+    payload = os.urandom(size)
+    count = max(total // size, 4)
+    start = time.perf_counter()
+    for _ in range(count):
+        ws._create_frame(paho.WebsocketWrapper.OPCODE_BINARY, bytearray(payload))
+    return count * size / (time.perf_counter() - start)
+
+
+def bench_recv(cls, size, total):
+    # Masked frames, as a server would never send them but a proxy may
+    frame = make_wrapper(paho.WebsocketWrapper, None)._create_frame(
+        paho.WebsocketWrapper.OPCODE_BINARY, bytearray(os.urandom(size)))
+    count = max(total // size, 4)
+    ws = make_wrapper(cls, FeedSocket(frame * count))
+    into = bytearray(paho._IN_BUFFER_SIZE)
+    got = 0
+    start = time.perf_counter()
+    # Read like the client loop does: as much as fits in its read-ahead buffer
+    while got < count * size:
+        try:
+            if ws.recv_into is not None:
+                got += ws.recv_into(into)
+            else:
+                got += len(ws.recv(len(into)))
+        except BlockingIOError:
+            pass
+    return got / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bytes', type=int, default=8000000, help='payload bytes per measurement')
+    opts = parser.parse_args()
+
+    print('%8s  %12s  %12s  %12s  %12s' % ('payload', 'mask old', 'mask new', 'recv old', 'recv new'))
+    for size in SIZES:
+        # The per-byte loops are slow, give them a smaller budget
+        legacy = opts.bytes // 8
+        print('%8d  %9.1f MB/s %9.1f MB/s %9.1f MB/s %9.1f MB/s' % (
+            size,
+            bench_send(LegacyWrapper, size, legacy) / 1e6,
+            bench_send(paho.WebsocketWrapper, size, opts.bytes) / 1e6,
+            bench_recv(LegacyWrapper, size, legacy) / 1e6,
+            bench_recv(paho.WebsocketWrapper, size, opts.bytes) / 1e6,
+        ))
+
+
+if __name__ == '__main__':
+    main()
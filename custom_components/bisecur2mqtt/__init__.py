@@ -1,3 +1,4 @@
+import json
 import logging
 import subprocess
 import os
@@ -27,10 +28,25 @@ def start_bisecur_service(config):
                    "--mqtt_username", str(config.get("mqtt_username", "bisecur")),
                    "--mqtt_password", str(config.get("mqtt_password", "bisecur")),
                    "--mqtt_tls", "true" if config.get("mqtt_tls", False) else "false",
+                   "--mqtt_asyncio", "true" if config.get("mqtt_asyncio", False) else "false",
+                   "--mqtt_v5", "true" if config.get("mqtt_v5", False) else "false",
                    "--mqtt_topic_base", str(config.get("mqtt_topic_base", "bisecur2mqtt")),
                    "--mqtt_topic_HA_discovery", str(config.get("mqtt_topic_HA_discovery", "homeassistant")),
                    "--logfile", str(config.get("logfile", "/config/custom_components/bisecur2mqtt/bisecur2mqtt.log")),
                    "--logs", "true" if config.get("logs", False) else "false",
+                   "--position_interpolation_hz", str(config.get("position_interpolation_hz", 0)),
+                   "--prewarm_window", str(config.get("prewarm_window", 60)),
+                   "--prewarm_usage", "true" if config.get("prewarm_usage", False) else "false",
+                   "--command_deadline", str(config.get("command_deadline", 30)),
+                   "--log_jsonfile", str(config.get("log_jsonfile", "")),
+                   "--mcp_capture", str(config.get("mcp_capture", "")),
+                   "--discovery_cache", str(config.get("discovery_cache",
+                                                       "/config/custom_components/bisecur2mqtt/gateway_cache.json")),
+                   "--mqtt_session_store", str(config.get("mqtt_session_store",
+                                                          "/config/custom_components/bisecur2mqtt/mqtt_session")),
+                   "--door_groups", json.dumps(config.get("door_groups", {})),
+                   "--position_history", str(config.get("position_history",
+                                                        "/config/custom_components/bisecur2mqtt/position_history")),
                    "--doors_port"
                ] + list(map(str, config.get("doors_port", [0])))
         process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -1,11 +1,13 @@
 import argparse
 import ast
+import asyncio
 import json
 import logging as log
 import os
 import queue
 import re
 import socket
+import ssl
 import sys
 import threading
 import time
@@ -15,27 +17,43 @@ from datetime import datetime
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from libs.pysecur3.client import MCPClient
 from libs.pysecur3.MCP import MCPSetState
+from libs.pysecur3.errors import MCPException, MCPTransportError, MCPDeviceError, MCPBusyError, MCPAuthError, \
+    MCPPermissionDenied, MCPDeadlineExceeded, MCPGatewayBusy
+from libs.pysecur3.retry import RetryPolicy, RetryRule, RetryAction
+from libs.pysecur3.rtt import RTTEstimator
+from libs.pysecur3.capture import CaptureWriter
+from libs.pysecur3.discovery import DiscoveryCache
 import libs.mqtt.client as paho
-
+from libs.mqtt.properties import Properties
+from libs.mqtt.packettypes import PacketTypes
+from libs.mqtt.aio import AsyncClient
+from libs.logpipe import setup_logging, stop_logging
+from libs.statejournal import StateJournal
+from libs.doormotion import DoorMotionEstimator
+from libs.doorhistory import DoorHistory, SOURCE_GATEWAY, SOURCE_COMMAND, SOURCE_ERROR
+from libs.prewarm import PrewarmWindow, usage_due
+
+# Each handler gets (door, deadline[, extra args]); deadline is a time.monotonic() value taken on MQTT arrival
 COMMANDS = {
-    "get_door_state": lambda d: get_door_status(d),
-    "get_door_position": lambda d: get_door_status(d),
-    "up": lambda d: do_door_action("up", d),
-    "down": lambda d: do_door_action("down", d),
-    "open": lambda d: smart_open(d),        # Smart: checks position first
-    "close": lambda d: smart_close(d),      # Smart: checks position first
-    "force_open": lambda d: do_door_action("up", d),    # Force: sends impulse regardless
-    "force_close": lambda d: do_door_action("down", d), # Force: sends impulse regardless
-    "stop": lambda d: do_door_action("stop", d),
-    "impulse": lambda d: do_door_action("impulse", d),
-    "partial": lambda d: do_door_action("partial", d),
-    "light": lambda d: do_door_action("light", d),
-    "get_ports": lambda _: get_ports(),
-    "get_version": lambda _: get_gw_version(),
-    "get_gw_version": lambda _: get_gw_version(),
-    "login": lambda _: do_gw_login(),
-    "sys_restart": lambda _: init_bisecur_gw(True),
-    "init_bisecur_gw": lambda _: init_bisecur_gw(True),
+    "get_door_state": lambda d, dl: get_door_status(d, deadline=dl),
+    "get_door_position": lambda d, dl: get_door_status(d, deadline=dl),
+    "up": lambda d, dl: do_door_action("up", d, deadline=dl),
+    "down": lambda d, dl: do_door_action("down", d, deadline=dl),
+    "open": lambda d, dl: smart_open(d, dl),        # Smart: checks position first
+    "close": lambda d, dl: smart_close(d, dl),      # Smart: checks position first
+    "force_open": lambda d, dl: do_door_action("up", d, deadline=dl),    # Force: sends impulse regardless
+    "force_close": lambda d, dl: do_door_action("down", d, deadline=dl), # Force: sends impulse regardless
+    "stop": lambda d, dl: do_door_action("stop", d, deadline=dl),
+    "impulse": lambda d, dl: do_door_action("impulse", d, deadline=dl),
+    "partial": lambda d, dl: do_door_action("partial", d, deadline=dl),
+    "light": lambda d, dl: do_door_action("light", d, deadline=dl),
+    "history": lambda d, dl, *n: door_history_report(d, *n),  # history_X или history_X_N
+    "get_ports": lambda _, dl: get_ports(dl),
+    "get_version": lambda _, dl: get_gw_version(),
+    "get_gw_version": lambda _, dl: get_gw_version(),
+    "login": lambda _, dl: do_gw_login(),
+    "sys_restart": lambda _, dl: init_bisecur_gw(True),
+    "init_bisecur_gw": lambda _, dl: init_bisecur_gw(True),
 }
 
 # Command queue for handling gateway busy situations
@@ -49,6 +67,18 @@ parser.add_argument("--bisecur_user", default="")
 parser.add_argument("--bisecur_pw", default="")
 parser.add_argument("--bisecur_ip", default="")
 parser.add_argument("--bisecur_mac", default="FF:FF:FF:FF:FF:FF")
+parser.add_argument("--discovery_cache",
+                    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "gateway_cache.json"),
+                    help="MAC -> IP cache used when --bisecur_ip is empty or the gateway moved (DHCP)")
+parser.add_argument("--mqtt_session_store",
+                    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "mqtt_session"),
+                    help="Unacknowledged QoS>0 MQTT messages are kept in <path>_sub.log "
+                         "across restarts (empty: memory only)")
+parser.add_argument("--position_history",
+                    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "position_history"),
+                    help="Per-door position history is flushed to <path>_<door>.bin (empty: memory only)")
+parser.add_argument("--position_history_size", type=int, default=4096,
+                    help="Position history records kept per door, 12 bytes each (default: 4096)")
 parser.add_argument("--src_mac", default="FF:FF:FF:FF:FF:FF")
 parser.add_argument("--mqtt_broker", default="localhost")
 parser.add_argument("--mqtt_port", type=int, default=1883)
@@ -56,13 +86,32 @@ parser.add_argument("--mqtt_clientid", default="mqtt2bisecur")
 parser.add_argument("--mqtt_username", default="")
 parser.add_argument("--mqtt_password", default="")
 parser.add_argument("--mqtt_tls", type=lambda x: x.lower() == 'true', default=False)
+parser.add_argument("--mqtt_asyncio", type=lambda x: x.lower() == 'true', default=False,
+                    help="Drive the MQTT client from an asyncio loop instead of loop_forever() (default: false)")
+parser.add_argument("--mqtt_v5", type=lambda x: x.lower() == 'true', default=False,
+                    help="Use MQTT v5 (topic aliases for the repeated state topics, needs a v5 broker)")
 parser.add_argument("--mqtt_topic_base", default="bisecur2mqtt")
 parser.add_argument("--mqtt_topic_HA_discovery", default="homeassistant")
 parser.add_argument("--logfile", default="mqtt2bisecur.log")
 parser.add_argument("--logs", type=lambda x: x.lower() == 'true', default=False)
+parser.add_argument("--mcp_capture", default="",
+                    help="Append every gateway frame to this binary capture file (see libs/pysecur3/replay.py)")
+parser.add_argument("--log_jsonfile", default="", help="Also write JSON lines to this file (default: off)")
+parser.add_argument("--log_max_bytes", type=int, default=1024 * 1024, help="Rotate log files at this size (default: 1 MB)")
+parser.add_argument("--log_backups", type=int, default=3, help="Rotated log files to keep (default: 3)")
 parser.add_argument("--doors_port", nargs='+', type=int, default=[0])
+parser.add_argument("--door_groups", default="",
+                    help='Named door groups as JSON, e.g. \'{"garage": [0, 1]}\' ("all" is always defined)')
 parser.add_argument("--poll_interval", type=int, default=30, help="Интервал опроса статуса в секундах (по умолчанию: 30)")
+parser.add_argument("--position_interpolation_hz", type=float, default=0,
+                    help="Publish estimated positions of moving doors this many times per second (default: 0 = off)")
+parser.add_argument("--prewarm_window", type=float, default=60,
+                    help="Seconds a 'warm' signal keeps an authenticated gateway session ready (default: 60)")
+parser.add_argument("--prewarm_usage", type=lambda x: x.lower() == 'true', default=False,
+                    help="Also pre-warm at times of day when doors were used on several recent days")
 parser.add_argument("--poll_max_retries", type=int, default=2, help="Max retries for periodic polling (default: 2)")
+parser.add_argument("--command_deadline", type=float, default=30,
+                    help="Seconds after MQTT arrival after which a command is abandoned (default: 30)")
 args = parser.parse_args()
 
 GATEWAY_VERSION = None
@@ -74,17 +123,53 @@ VERSION = "1.0.0"
 DEBUG = False
 gateway_lock = threading.Lock()
 CHECK_STATUS_START = True
-MQTT_CLIENT_SUB = None
-MQTT_CLIENT_PUB = None
+MQTT_CLIENT = None
+MQTT_QUEUE = None
+MQTT_QUEUE_SIZE = 1000
+# Полосы очереди публикаций: меньший номер уходит раньше
+MQTT_LANE_AVAILABILITY = 0
+MQTT_LANE_DISCOVERY = 1
+MQTT_LANE_TELEMETRY = 2
+MQTT_LANE_REPLY = MQTT_LANE_AVAILABILITY  # ответы инициатору команды ждать не должны
+# Инициатор команды этого потока (ResponseTopic/CorrelationData MQTT v5 или JSON id), см. parse_command()
+COMMAND_REPLY = threading.local()
+COMMAND_ID_RE = re.compile(r"^[\w.:-]{1,64}$")
+# Групповая команда: close_all, open_garage, force_close_0,1
+GROUP_COMMAND_RE = re.compile(r"^(?P<action>[a-z]+(?:_[a-z]+)*)_(?P<target>all|\d+(?:,\d+)+|[a-z][a-z0-9-]*)$")
+GROUP_ACTIONS = ("open", "close", "force_open", "force_close", "stop", "get_door_state")
+DOOR_GROUPS = {}               # {name: [door_id, ...]} из --door_groups
 IS_ACTIVE_TASK = threading.Event()
 last_request_time = {}
 CLI = None
 LAST_DOOR_STATE = {}       # Per-door state: {door_id: state}
 POS_TRACKING_THREAD = {}   # Per-door tracking: {door_id: thread}
 DO_EXIT_THREAD = {}        # Per-door exit flag: {door_id: bool}
+GROUP_TRACKING_MAX_CYCLES = 100  # Общий трекер групповой команды: не дольше ~5 минут
+POSITION_INTERPOLATION_HZ = args.position_interpolation_hz
+DOOR_MOTION = {door: DoorMotionEstimator() for door in args.doors_port}  # модель движения по реальным позициям
+ESTIMATED_POSITION = {}    # {door_id: последняя опубликованная оценка}, пока дверь идёт по оценкам
+# Реальная позиция и оценка публикуются под одним замком двери: оценка, посчитанная до нового
+# ответа шлюза, не может уйти в очередь после него
+DOOR_POSITION_LOCK = {door: threading.Lock() for door in args.doors_port}
 MAX_RETRIES = 10
 CHECK_INTERVAL = args.poll_interval
 POLL_MAX_RETRIES = args.poll_max_retries
+COMMAND_DEADLINE = args.command_deadline
+GW_RTT = RTTEstimator()        # Общая статистика RTT по командам, переживает пересоздание CLI
+GW_CAPTURE = CaptureWriter(args.mcp_capture) if args.mcp_capture else None
+GW_DISCOVERY = DiscoveryCache(args.discovery_cache)
+LAST_REDISCOVERY = 0
+REDISCOVERY_INTERVAL = 60      # Не чаще раза в минуту — broadcast не должен идти на каждый retry
+# Публикации без связи с брокером: последнее значение на топик + события команд по порядку
+STATE_JOURNAL = StateJournal(event_topics=(f"{MQTT_TOPIC_BASE}/command/status",
+                                           f"{MQTT_TOPIC_BASE}/send_command/response",
+                                           f"{MQTT_TOPIC_BASE}/send_command/error"),
+                             max_events=50)
+# Пока установлен, телеметрия идёт в журнал, даже если is_connected() уже True: CONNACK обработан
+# раньше on_connect, и свежие значения не должны уйти в очередь раньше старых из журнала
+MQTT_JOURNALING = threading.Event()
+MQTT_JOURNALING.set()
+MQTT_JOURNAL_LOCK = threading.Lock()  # проверка флага + запись против drain + снятия флага
 GATEWAY_OFFLINE = False
 GATEWAY_OFFLINE_COUNT = 0
 GATEWAY_OFFLINE_THRESHOLD = 3  # After 3 consecutive failures, consider gateway offline
@@ -97,6 +182,11 @@ ACTIVE_POLL_DURATION = 120     # Сколько секунд "активный"
 LAST_COMMAND_TIME = 0          # Время последней команды пользователя
 LAST_GW_ACTIVITY = 0           # Время последней успешной связи со шлюзом
 GW_STALE_TIMEOUT = 8           # Шлюз сбрасывает TCP непредсказуемо (5-15с), reconnect заранее
+PREWARM = PrewarmWindow(default_window=args.prewarm_window)  # окна прогрева сессии и их метрики
+PREWARM_THREAD = None
+PREWARM_HANDSHAKE = threading.Lock()  # держит прогрев на время connect+login — команда ждёт его, а не делает свой
+PREWARM_KEEPALIVE = 4          # Запрос раз в 4с — меньше минимального таймаута простоя шлюза
+PREWARM_USAGE_CHECK = 30       # Как часто сверяться с привычным временем команд
 
 # Per-door failure tracking (НЕ блокировать весь шлюз из-за одной двери)
 DOOR_FAILURE_COUNT = {}        # {door_id: count} - счётчик ошибок для каждой двери
@@ -105,36 +195,109 @@ DOOR_FAILURE_THRESHOLD = 3     # После скольких ошибок под
 DOOR_COOLDOWN_BASE = 120       # Базовый кулдаун в секундах (2 минуты)
 DOOR_COOLDOWN_MAX = 600        # Максимальный кулдаун (10 минут)
 
-for handler in log.root.handlers[:]:
-    log.root.removeHandler(handler)
-
-if DEBUG:
-    log.basicConfig(filename=LOGFILE, level=log.DEBUG, format=LOGFORMAT)
-else:
-    if LOG_TXT_ENABLED:
-        log.basicConfig(filename=LOGFILE, level=log.INFO, format=LOGFORMAT)
-    else:
-        log.basicConfig(level=log.INFO, format=LOGFORMAT)
-
-if not any(isinstance(h, log.StreamHandler) for h in log.getLogger().handlers):
-    stderrLogger = log.StreamHandler()
-    stderrLogger.setFormatter(log.Formatter(LOGFORMAT))
-    log.getLogger().addHandler(stderrLogger)
+# Политики повторов по типу ошибки (вместо поиска подстрок в тексте исключения).
+# Правило ищется по MRO исключения, всё что не описано — GIVE_UP.
+GW_QUERY_POLICY = RetryPolicy({
+    MCPDeadlineExceeded: RetryRule(RetryAction.GIVE_UP),                             # запрос устарел
+    MCPBusyError: RetryRule(RetryAction.WAIT, base_delay=2, max_delay=6),            # PORT_ERROR, GATEWAY_BUSY
+    MCPAuthError: RetryRule(RetryAction.RELOGIN, base_delay=1, max_attempts=2),      # INVALID_TOKEN, PERMISSION_DENIED
+    MCPTransportError: RetryRule(RetryAction.RECONNECT, base_delay=1, max_delay=4, max_attempts=3),
+    MCPDeviceError: RetryRule(RetryAction.GIVE_UP),                                  # LOGIN_FAILED, PORT_NOT_FOUND, ...
+    MCPException: RetryRule(RetryAction.WAIT, base_delay=1),                         # битый ответ шлюза
+}, max_attempts=MAX_RETRIES, budget=60)
+GW_COMMAND_POLICY = RetryPolicy({
+    MCPDeadlineExceeded: RetryRule(RetryAction.GIVE_UP),
+    MCPBusyError: RetryRule(RetryAction.WAIT, base_delay=0.3, max_delay=2.0),        # Быстрый backoff для команд
+    MCPAuthError: RetryRule(RetryAction.RELOGIN, base_delay=0.3, max_attempts=2),
+    MCPTransportError: RetryRule(RetryAction.RECONNECT, base_delay=0.3, max_delay=2.0),
+    MCPDeviceError: RetryRule(RetryAction.GIVE_UP),
+}, max_attempts=5, budget=30)
+
+# Логи пишет отдельный поток (QueueListener): поток шлюза под gateway_lock только кладёт запись в очередь
+LOG_LISTENER = setup_logging(
+    level=log.DEBUG if DEBUG else log.INFO,
+    fmt=LOGFORMAT,
+    logfile=LOGFILE if DEBUG or LOG_TXT_ENABLED else None,
+    jsonfile=args.log_jsonfile or None,
+    max_bytes=args.log_max_bytes,
+    backups=args.log_backups,
+)
 
 log.info("🚀 Run bisecur2mqtt...")
 log.debug("🚀 DEBUG MODE")
 
 
-def do_command(cmd, set_door=None):
+def load_door_groups(text):
+    """--door_groups → {name: [door_id, ...]}; неверные группы пропускаются с предупреждением."""
+    if not text:
+        return {}
+    try:
+        groups = json.loads(text)
+    except ValueError as ex:
+        log.error(f"❌ Invalid --door_groups JSON, groups disabled: {ex}")
+        return {}
+    if not isinstance(groups, dict):
+        log.error("❌ --door_groups must be a JSON object, groups disabled")
+        return {}
+    result = {}
+    for name, doors in groups.items():
+        name = str(name).lower()
+        if name == "all" or not re.match(r"^[a-z][a-z0-9-]*$", name):
+            log.warning(f"⚠️ Ignoring door group {name!r}: invalid name")
+            continue
+        if not isinstance(doors, list) or not doors or not all(isinstance(d, int) and d in args.doors_port for d in doors):
+            log.warning(f"⚠️ Ignoring door group {name!r}: doors must be a list of ports from {args.doors_port}")
+            continue
+        result[name] = sorted(set(doors))
+    if result:
+        log.info(f"🚪 Door groups: {result}")
+    return result
+
+
+DOOR_GROUPS = load_door_groups(args.door_groups)
+
+
+def open_door_history(set_door):
+    """История позиций двери; битый/чужой файл не мешает старту — история начнётся заново."""
+    path = f"{args.position_history}_{set_door}.bin" if args.position_history else None
+    try:
+        history = DoorHistory(args.position_history_size, path)
+    except (OSError, ValueError, IndexError) as ex:
+        log.error(f"❌ Position history {path} unreadable, starting empty: {ex}")
+        history = DoorHistory(args.position_history_size)
+        history.path = path
+    if len(history):
+        log.info(f"📦 Door {set_door}: {len(history)} position history records loaded")
+    return history
+
+
+DOOR_HISTORY = {door: open_door_history(door) for door in args.doors_port}
+
+
+def command_expired(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def gateway_lock_timeout(deadline):
+    """Ожидание gateway_lock для команды: не дольше 5с и не дольше её срока."""
+    return 5 if deadline is None else max(0.0, min(5, deadline - time.monotonic()))
+
+
+def do_command(cmd, set_door=None, deadline=None, *extra):
     global IS_ACTIVE_TASK, LAST_COMMAND_TIME
+    cmd = cmd.lower().strip()
+    if command_expired(deadline):
+        log.warning(f"⌛ Command '{cmd}' for door {set_door} expired before execution, dropped")
+        publish_command_status(cmd, set_door, "expired", "Deadline passed before execution")
+        return
     IS_ACTIVE_TASK.set()
     LAST_COMMAND_TIME = time.time()
-    cmd = cmd.lower().strip()
     resp = None
     try:
-        resp = COMMANDS.get(cmd, lambda _: f"Command '{cmd}' is not recognised")(set_door)
+        resp = COMMANDS.get(cmd, lambda *_: f"Command '{cmd}' is not recognised")(set_door, deadline, *extra)
         check_mcp_error(resp)
-        publish_to_mqtt(f"send_command/response", resp)
+        if not publish_reply("response", {"command": cmd, "door": set_door, "response": str(resp)}):
+            publish_to_mqtt(f"send_command/response", resp, qos=1)
     except Exception as ex:
         log.error(ex)
         traceback.print_exc()
@@ -143,32 +306,83 @@ def do_command(cmd, set_door=None):
         IS_ACTIVE_TASK.clear()
 
 
-def publish_to_mqtt(topic, payload, topic_base=args.mqtt_topic_base, qos=0, retain=False, ts_only=False):
-    if MQTT_CLIENT_SUB:
+def publish_or_journal(topic, payload, qos=0, retain=False, lane=MQTT_LANE_TELEMETRY, properties=None):
+    """Ставит в очередь публикаций (её отправляет сетевой цикл), а без связи с брокером
+    откладывает в STATE_JOURNAL (отправится в on_connect).
+
+    QoS>0 (результаты команд) без связи уходит в сессию paho: она переживает обрыв, а с
+    --mqtt_session_store и перезапуск скрипта.
+    """
+    if qos > 0 and not MQTT_CLIENT.is_connected():
+        # MQTT_ERR_NO_CONN: сообщение ждёт в сессии
+        MQTT_CLIENT.publish(topic, payload, qos=qos, retain=retain, properties=properties)
+        return
+    with MQTT_JOURNAL_LOCK:
+        if not MQTT_JOURNALING.is_set() or qos > 0:
+            if not MQTT_CLIENT.publish_queued(topic, payload, qos=qos, retain=retain, properties=properties,
+                                              lane=lane):
+                log.warning(f"⚠️ MQTT publish queue full, dropped {topic}")
+            return
+        STATE_JOURNAL.record(topic, payload, qos, retain)
+
+
+def journal_publish_queue(client):
+    """Неотправленное из очереди публикаций при обрыве — в журнал/сессию, до следующего on_connect."""
+    with MQTT_JOURNAL_LOCK:
+        MQTT_JOURNALING.set()
+    for topic, payload, qos, retain, properties in client.publish_queue_take():
+        if qos > 0:
+            client.publish(topic, payload, qos=qos, retain=retain, properties=properties)
+        else:
+            STATE_JOURNAL.record(topic, payload, qos, retain)
+
+
+def flush_state_journal(client):
+    """Всё накопленное за время обрыва — одной пачкой в очередь публикаций (вызывается из сетевого потока).
+
+    Под MQTT_JOURNAL_LOCK: публикации других потоков встанут в очередь только после журнала.
+    """
+    dropped = 0
+    with MQTT_JOURNAL_LOCK:
+        messages = STATE_JOURNAL.drain()
+        for topic, payload, qos, retain in messages:
+            if not client.publish_queued(topic, payload, qos=qos, retain=retain, lane=MQTT_LANE_TELEMETRY):
+                dropped += 1
+        MQTT_JOURNALING.clear()
+    if messages:
+        log.info(f"📬 Flushed {len(messages)} journaled MQTT messages: {STATE_JOURNAL.stats()}")
+    if dropped:
+        log.warning(f"⚠️ MQTT publish queue full, dropped {dropped} of {len(messages)} journaled messages")
+
+
+def publish_to_mqtt(topic, payload, topic_base=args.mqtt_topic_base, qos=0, retain=False, ts_only=False,
+                    lane=MQTT_LANE_TELEMETRY):
+    if MQTT_CLIENT:
         if not isinstance(payload, str):
             payload = str(payload)
         try:
             if not ts_only:
-                log.debug(f"---> MQTT pub: {topic_base}/{topic} {payload}")
-                MQTT_CLIENT_SUB.publish(f"{topic_base}/{topic}", payload, qos=qos, retain=retain)
-            log.debug(f"---> MQTT pub: {topic_base}/{topic}_ts {datetime.now().strftime('%Y-%m-%dT%H:%M:%S')}")
-            MQTT_CLIENT_SUB.publish(f"{topic_base}/{topic}_ts", datetime.now().strftime("%Y-%m-%dT%H:%M:%S"), qos=qos,retain=retain)
+                log.debug("---> MQTT pub: %s/%s %s", topic_base, topic, payload)
+                publish_or_journal(f"{topic_base}/{topic}", payload, qos=qos, retain=retain, lane=lane)
+            ts = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+            log.debug("---> MQTT pub: %s/%s_ts %s", topic_base, topic, ts)
+            publish_or_journal(f"{topic_base}/{topic}_ts", ts, qos=qos, retain=retain, lane=lane)
         except Exception as ex:
-            log.error(f"Error in topic: {topic}, payload: {payload}")
+            log.error("Error in topic: %s, payload: %s", topic, payload)
             log.error(ex)
     else:
-        log.warning(f"Ignoring publish to broker as 'MQTT_CLIENT_PUB' not initialised ({topic} {payload})")
+        log.warning("Ignoring publish to broker as 'MQTT_CLIENT' not initialised (%s %s)", topic, payload)
 
 
 def get_gw_version():
     global GATEWAY_VERSION
     global GATEWAY_VERSION_RESP
-    retries = 0
 
     if GATEWAY_VERSION is not None:
         return GATEWAY_VERSION_RESP, GATEWAY_VERSION
 
-    while retries < MAX_RETRIES:
+    session = GW_QUERY_POLICY.begin()
+    while True:
         try:
             with gateway_lock:
                 if CLI is None:
@@ -188,23 +402,19 @@ def get_gw_version():
             return GATEWAY_VERSION_RESP, GATEWAY_VERSION
 
         except Exception as e:
-            error_msg = str(e)
-            if "PORT_ERROR" in error_msg or "Code: 10" in error_msg:
-                retries += 1
-                wait_time = 2 * retries
-                log.warning(f"🔄Gateway busy (Retries {retries}/{MAX_RETRIES}) - wait {wait_time} sec...")
-                time.sleep(wait_time)
-                continue
-
-            log.error(f"❌ Unknown error in get_gw_version(): {e}")
-            traceback.print_exc()
-            return None, None
+            decision = session.next(e)
+            if decision.action == RetryAction.GIVE_UP:
+                log.error(f"❌ get_gw_version() failed after {decision.attempt} attempts ({type(e).__name__}): {e}")
+                if not isinstance(e, MCPException):
+                    traceback.print_exc()
+                return None, None
 
-    log.error("❌ Retry limit reached for `get_gw_version()`")
-    return None, None
+            log.warning(f"🔄 {type(e).__name__}: {decision.action.value} (Retries {decision.attempt}/{MAX_RETRIES}) "
+                        f"- wait {decision.delay:.1f} sec...")
+            recover_gateway(decision)
 
 
-def get_ports():
+def get_ports(deadline=None):
     """Get available ports/groups from the gateway."""
     if CLI is None:
         log.error("⚠️ Cannot get ports: CLI not initialized")
@@ -212,7 +422,7 @@ def get_ports():
 
     cmd_mcp = {"CMD": "GET_GROUPS", "FORUSER": 0}
     try:
-        resp = CLI.jcmp(cmd_mcp)
+        resp = CLI.jcmp(cmd_mcp, deadline=deadline)
         ports = resp.payload.payload
         ports = ast.literal_eval(ports.decode("utf-8"))
 
@@ -226,52 +436,104 @@ def get_ports():
         return None, None
 
 
-def check_broken_pipe(err_msg):
-    if "errno 32" in err_msg or "broken pipe" in err_msg:
-        log.error("ERROR: Restarting due to broken pipe")
-        init_bisecur_gw(True)
-        time.sleep(2)  # Пауза после reconnect - шлюз нужно время
-        return True
+def recover_gateway(decision):
+    """Perform the recovery step chosen by a retry policy, then back off."""
+    try:
+        if decision.action == RetryAction.RELOGIN:
+            log.warning("🔄 Session rejected, logging in again...")
+            do_gw_login()
+        elif decision.action == RetryAction.RECONNECT:
+            log.warning("🔄 Connection lost, reconnecting...")
+            if CLI is None:
+                init_bisecur_gw(True)
+            else:
+                CLI.reconnect()
+                do_gw_login()
+    except MCPTransportError as ex:
+        log.error(f"Reconnect failed: {ex}")
+        try:
+            rediscover_gateway()  # следующая попытка пойдёт уже на новый IP
+        except Exception as ex:
+            log.error(f"🔎 Gateway rediscovery failed: {type(ex).__name__}: {ex}")
+    except Exception as ex:
+        log.error(f"Reconnect failed: {ex}")
+    time.sleep(decision.delay)
+
+
+def resolve_gateway_ip(refresh=False):
+    """IP шлюза по --bisecur_mac: из кеша на диске, иначе UDP discovery. None если не найден."""
+    bisecur_mac = args.bisecur_mac.replace(':', '').upper() if args.bisecur_mac else ""
+    if not bisecur_mac or bisecur_mac == "FFFFFFFFFFFF":
+        return None
+    try:
+        ip = GW_DISCOVERY.resolve(bisecur_mac, refresh=refresh)
+    except Exception as ex:
+        log.error(f"🔎 Gateway discovery failed: {type(ex).__name__}: {ex}")
+        return None
+    if ip:
+        log.info(f"🔎 Gateway {bisecur_mac} resolved to {ip}")
     else:
+        log.warning(f"🔎 Gateway {bisecur_mac} did not answer discovery")
+    return ip
+
+
+def rediscover_gateway():
+    """После ошибки соединения проверить, не сменил ли шлюз IP (DHCP). True если IP изменился."""
+    global LAST_REDISCOVERY
+    if time.time() - LAST_REDISCOVERY < REDISCOVERY_INTERVAL:
+        return False
+    LAST_REDISCOVERY = time.time()
+    ip = resolve_gateway_ip(refresh=True)
+    if not ip or ip == args.bisecur_ip:
         return False
+    log.warning(f"🔎 Gateway moved: {args.bisecur_ip} -> {ip}")
+    args.bisecur_ip = ip  # init_bisecur_gw / init_ha_discovery читают IP отсюда
+    if CLI:
+        CLI.gw_ip = ip
+    publish_to_mqtt("attributes/gw_ip_address", ip)
+    return True
 
 
-def get_door_status(set_door, max_retries=None, allow_reconnect=True):
+def get_door_status(set_door, max_retries=None, allow_reconnect=True, deadline=None):
     """Get door status from gateway.
 
     Args:
         set_door: door port ID
         max_retries: limit retry attempts (None = MAX_RETRIES)
         allow_reconnect: if False, don't reconnect on error (for periodic polling)
+        deadline: time.monotonic() after which the request is abandoned (None = no limit)
     """
     set_door = int(set_door)
-    retries = 0
     global last_request_time, LAST_GW_ACTIVITY
     if set_door not in last_request_time:
         last_request_time[set_door] = 0
 
     effective_max_retries = max_retries if max_retries is not None else MAX_RETRIES
-    while retries < effective_max_retries:
+    session = GW_QUERY_POLICY.begin(max_attempts=effective_max_retries - 1, deadline=deadline)
+    while True:
+        if command_expired(deadline):
+            log.warning("⌛ Get door status(%s) abandoned: deadline passed", set_door)
+            return None, -1, None
         now = time.time()
         if now - last_request_time[set_door] < 3:
-            log.debug(f"⏳ Flood protection ({set_door}), wait...")
+            log.debug("⏳ Flood protection (%s), wait...", set_door)
             time.sleep(1)
             continue
 
         lock_acquired = gateway_lock.acquire(blocking=False)
         if not lock_acquired:
-            log.warning(f"🚧 Get door status({set_door}) skipped because lock is busy!")
+            log.warning("🚧 Get door status(%s) skipped because lock is busy!", set_door)
             return None, -1, None
         try:
             last_request_time[set_door] = time.time()
             if CLI is None:
                 log.error("⚠️ Error: CLI not initialized")
                 return None, -1, None
-            log.info(f"📡 Sending a get transition request({set_door})...")
-            resp = CLI.get_transition(set_door)
+            log.debug("📡 Sending a get transition request(%s)...", set_door)
+            resp = CLI.get_transition(set_door, deadline=deadline)
 
             if resp is None:
-                log.warning(f"⚠️ resp=None for door {set_door}")
+                log.warning("⚠️ resp=None for door %s", set_door)
                 return None, -1, None
 
             state = None
@@ -280,68 +542,237 @@ def get_door_status(set_door, max_retries=None, allow_reconnect=True):
                 position = resp.payload.command.percent_open
                 if position == 0:
                     state = "closed"
-                    log.info(f"🚪Door -> {set_door} is closed")
                 elif position == 100:
                     state = "open"
-                    log.info(f"🚪Door -> {set_door} is open")
-                else:
-                    log.info(f"🚪Door -> {set_door} is {resp.payload.command.percent_open}% OPEN")
-                log.info(f"🚪Door -> {set_door} position: {position} and state {state} to MQTT....")
-                publish_to_mqtt(f"garage_door/{set_door}/position", position, retain=True)
+                log.info("🚪Door -> %s position: %s and state %s to MQTT....", set_door, position, state,
+                         extra={"door": set_door, "position": position})
+                publish_door_position(set_door, position, state)
                 if state:
                     publish_to_mqtt(f"garage_door/{set_door}/state", state, retain=True)
                 return resp, position, state
             else:
-                log.warning(f"get_transition response has no 'percent_open' (resp: {resp})")
+                log.warning("get_transition response has no 'percent_open' (resp: %s)", resp)
                 if not allow_reconnect:
                     # Для polling: сессия повреждена, пусть poll_door_status сделает reconnect
                     return None, -1, None
-                retries += 1
-                time.sleep(1)
-                continue
+                raise MCPException("get_transition response has no 'percent_open'")
 
         except Exception as ex:
-            retries += 1
-            err_str = str(ex)
-            log.error(f"❌ get_door_status error ({retries}/{effective_max_retries}): {err_str}")
+            record_door_history(set_door, -1, source=SOURCE_ERROR)
+            decision = session.next(ex)
+            log.error("❌ get_door_status error (%d/%d): %s: %s", decision.attempt, effective_max_retries,
+                      type(ex).__name__, ex, extra={"door": set_door, "error": type(ex).__name__})
+            if decision.action == RetryAction.GIVE_UP:
+                return None, -1, None
 
-            if "PORT_ERROR" in err_str or "Code: 10" in err_str:
-                log.warning(f"🔄 Gateway busy, wait 3 sec...")
-                time.sleep(3)
-                continue
+            if not allow_reconnect and decision.action in (RetryAction.RELOGIN, RetryAction.RECONNECT):
+                # Periodic polling: don't reconnect, just return failure
+                log.warning("⚠️ Door %s poll failed: %.80s", set_door, ex)
+                return None, -1, None
 
-            if allow_reconnect:
-                if "PERMISSION_DENIED" in err_str or "Code: 12" in err_str:
-                    log.warning(f"🔄 Permission denied, reconnecting...")
-                    reconnect_to_bisecur()
-                    time.sleep(2)
-                    continue
-                if "reset" in err_str.lower() or "broken" in err_str.lower() or "errno 32" in err_str.lower():
-                    log.warning(f"🔄 Connection lost, reconnecting...")
-                    reconnect_to_bisecur()
-                    time.sleep(2)
+            log.warning("🔄 %s: %s, wait %.1f sec...", type(ex).__name__, decision.action.value, decision.delay)
+        finally:
+            gateway_lock.release()
+        # Reconnect/rediscovery и пауза — уже без gateway_lock, трекеры и опрос не ждут
+        recover_gateway(decision)
+
+
+def publish_door_position(set_door, position, state=None):
+    """Реальная позиция от шлюза: retained в position, запись в историю и новая опорная точка интерполяции."""
+    record_door_history(set_door, position, state)
+    if POSITION_INTERPOLATION_HZ <= 0 or set_door not in DOOR_MOTION or not 0 <= position <= 100:
+        publish_to_mqtt(f"garage_door/{set_door}/position", position, retain=True)
+        return
+    with DOOR_POSITION_LOCK[set_door]:
+        publish_to_mqtt(f"garage_door/{set_door}/position", position, retain=True)
+        DOOR_MOTION[set_door].observe(position)
+        if ESTIMATED_POSITION.pop(set_door, None) is not None:
+            publish_to_mqtt(f"garage_door/{set_door}/position_source", "gateway", retain=True)
+
+
+def record_door_history(set_door, position, state=None, source=SOURCE_GATEWAY):
+    if set_door in DOOR_HISTORY:
+        DOOR_HISTORY[set_door].record(position, state, source)
+
+
+def record_door_command(set_door, action):
+    """Импульс двери — в историю, с направлением, если оно известно."""
+    state = {"up": "opening", "open": "opening", "force_open": "opening",
+             "down": "closing", "close": "closing", "force_close": "closing"}.get(action, "unknown")
+    record_door_history(set_door, -1, state, SOURCE_COMMAND)
+
+
+def door_history_report(set_door, limit=10):
+    """Ответ на history_X[_N]: последние N движений, среднее время хода, доля ошибок чтения (JSON)."""
+    set_door = int(set_door)
+    history = DOOR_HISTORY.get(set_door)
+    if history is None:
+        return json.dumps({"door": set_door, "error": "No history for this door"})
+    limit = max(1, min(int(limit), history.capacity))
+    return json.dumps({"door": set_door, "movements": history.movements(limit), **history.stats()})
+
+
+def prewarm_gateway(reason, seconds=None):
+    """Открыть (продлить) окно прогрева: сессия со шлюзом держится готовой, пока оно открыто."""
+    global PREWARM_THREAD
+    remaining = PREWARM.open(reason, seconds)
+    log.info("🔥 Gateway pre-warm (%s) for %.0fs", reason, remaining)
+    if PREWARM_THREAD is None or not PREWARM_THREAD.is_alive():
+        PREWARM_THREAD = threading.Thread(target=keep_gateway_warm, name="gateway_prewarm", daemon=True)
+        PREWARM_THREAD.start()
+    return remaining
+
+
+def keep_gateway_warm():
+    """Пока открыто окно PREWARM: соединение и логин заранее, затем keep-alive запросом позиций."""
+    global LAST_GW_ACTIVITY
+    while PREWARM.active():
+        idle = time.time() - LAST_GW_ACTIVITY
+        if IS_ACTIVE_TASK.is_set() or idle < PREWARM_KEEPALIVE:
+            time.sleep(1)  # шлюзом сейчас и так пользуются
+            continue
+        if not gateway_lock.acquire(blocking=False):
+            time.sleep(1)
+            continue
+        try:
+            if CLI is None or not CLI.is_connected() or CLI.last_error or idle > GW_STALE_TIMEOUT:
+                with PREWARM_HANDSHAKE:
+                    log.info("🔥 Pre-warm: opening gateway session (idle %.0fs)", idle)
+                    if CLI is None:
+                        init_bisecur_gw(True)
+                    else:
+                        CLI.reconnect()
+                        do_gw_login()
+                    if CLI is None or not CLI.token:
+                        raise MCPException("pre-warm login failed")
+                    CLI.last_error = None
+            # Первый get_transition после логина бывает PORT_ERROR — пусть его получит прогрев, а не команда
+            for door, resp in CLI.get_transitions(args.doors_port).items():
+                if isinstance(resp, MCPAuthError):
+                    # sr_many ошибки шлюза возвращает, а не бросает: токен истёк — relogin на следующем круге
+                    log.warning("⚠️ Pre-warm: door %s %s, re-login", door, type(resp).__name__)
+                    CLI.last_error = resp
                     continue
-                if retries < effective_max_retries:
-                    reconnect_to_bisecur()
-                    time.sleep(1)
+                if isinstance(resp, MCPDeviceError):
+                    record_door_history(door, -1, source=SOURCE_ERROR)
                     continue
-            else:
-                # Periodic polling: don't reconnect, just return failure
-                log.warning(f"⚠️ Door {set_door} poll failed: {err_str[:80]}")
-                return None, -1, None
+                LAST_GW_ACTIVITY = time.time()
+                position = resp.payload.command.percent_open if hasattr(resp.payload.command, "percent_open") else -1
+                if position != -1:
+                    publish_door_position(door, position, {0: "closed", 100: "open"}.get(position))
+        except Exception as ex:
+            log.warning("⚠️ Pre-warm: %s: %s", type(ex).__name__, ex)
+            time.sleep(1)
         finally:
-            if gateway_lock.locked():
-                gateway_lock.release()
-    return None, -1, None
+            gateway_lock.release()
+        time.sleep(1)
+    log.info("🔥 Gateway pre-warm window closed: %s", PREWARM.stats())
+
+
+def wait_for_prewarm(deadline=None):
+    """Если прогрев сейчас подключается к шлюзу — дождаться его вместо своего reconnect."""
+    timeout = 15 if deadline is None else max(0.0, min(15, deadline - time.monotonic()))
+    if PREWARM_HANDSHAKE.acquire(timeout=timeout):
+        PREWARM_HANDSHAKE.release()
+
+
+def prewarm_scheduler():
+    """Автоматический прогрев в привычное время: команды в это время суток несколько дней подряд."""
+    while True:
+        time.sleep(PREWARM_USAGE_CHECK)
+        if PREWARM.active():
+            continue
+        command_times = [t for history in DOOR_HISTORY.values() for t in history.command_times()]
+        if usage_due(command_times, lead=PREWARM.default_window):
+            prewarm_gateway("usage")
+
+
+def on_warm_message(mosq, userdata, msg):
+    """send_command/warm: payload пустой или число секунд окна (датчик присутствия, открытый дашборд)."""
+    payload = msg.payload.decode('utf-8').strip()
+    try:
+        seconds = float(payload) if payload else None
+    except ValueError:
+        log.warning("Ignoring invalid pre-warm window %r", payload)
+        seconds = None
+    prewarm_gateway("topic", seconds)
+
+
+def flush_door_history():
+    for set_door, history in DOOR_HISTORY.items():
+        try:
+            history.flush()
+        except OSError as ex:
+            log.error(f"❌ Cannot write position history of door {set_door}: {ex}")
+
+
+def learned_travel_time(doors=None):
+    """Самый долгий средний ход (сек) из истории дверей; None, пока движений не было."""
+    times = []
+    for set_door in (args.doors_port if doors is None else doors):
+        if set_door in DOOR_HISTORY:
+            times.extend(t for t in DOOR_HISTORY[set_door].travel_times().values() if t)
+    return max(times) if times else None
+
+
+def interpolate_door_positions():
+    """Оценка позиции движущихся дверей между опросами шлюза, POSITION_INTERPOLATION_HZ раз в секунду.
+
+    Оценки не retained и помечены position_source=estimated; следующая реальная позиция
+    (publish_door_position) их заменяет. Запросов к шлюзу не добавляет.
+    """
+    period = 1.0 / POSITION_INTERPOLATION_HZ
+    while True:
+        time.sleep(period)
+        if not MQTT_CLIENT or not MQTT_CLIENT.is_connected() or MQTT_JOURNALING.is_set():
+            continue  # устаревшие оценки в журнал не нужны
+        for door, motion in DOOR_MOTION.items():
+            with DOOR_POSITION_LOCK[door]:
+                publish_estimated_position(door, motion)
+
+
+def publish_estimated_position(door, motion):
+    """Один шаг интерполяции двери; вызывается под DOOR_POSITION_LOCK[door]."""
+    estimate = motion.estimate()
+    if estimate is None:
+        if ESTIMATED_POSITION.pop(door, None) is not None:
+            # Трекинг кончился без нового опроса — вернуть последнюю реальную позицию
+            publish_to_mqtt(f"garage_door/{door}/position", motion.position, retain=True)
+            publish_to_mqtt(f"garage_door/{door}/position_source", "gateway", retain=True)
+        return
+    estimate = round(estimate)
+    if ESTIMATED_POSITION.get(door) == estimate:
+        return
+    if door not in ESTIMATED_POSITION:
+        publish_to_mqtt(f"garage_door/{door}/position_source", "estimated", retain=True)
+    ESTIMATED_POSITION[door] = estimate
+    publish_or_journal(f"{MQTT_TOPIC_BASE}/garage_door/{door}/position", str(estimate))
+
+
+def door_motion_state(current_pos, last_pos):
+    """Состояние двери по двум последовательным позициям."""
+    if current_pos < last_pos:
+        return "closing"
+    if current_pos > last_pos:
+        return "opening"
+    if current_pos == 100:
+        return "open"
+    if current_pos == 0:
+        return "closed"
+    return "unknown"
 
 
 def track_realtime_door_position(current_pos=None, last_action=None, set_door=0):
     """Track door position in real-time after command. Per-door tracking."""
-    publish_to_mqtt(f"garage_door/{set_door}/position", current_pos, retain=True)
-
     global LAST_DOOR_STATE, DO_EXIT_THREAD
     set_door = int(set_door)
 
+    # Позиция из ответа SET_STATE — тоже реальная: через publish_door_position, под замком двери
+    if current_pos is not None and 0 <= current_pos <= 100:
+        publish_door_position(set_door, current_pos)
+    else:
+        publish_to_mqtt(f"garage_door/{set_door}/position", current_pos, retain=True)
+
     state = ""
     last_pos = None
 
@@ -356,44 +787,121 @@ def track_realtime_door_position(current_pos=None, last_action=None, set_door=0)
             DO_EXIT_THREAD[set_door] = True
             break
         if not check_mcp_error(resp):
-            if current_pos < last_pos:
-                state = "closing"
-            elif current_pos > last_pos:
-                state = "opening"
-            elif current_pos == 100:
-                state = "open"
-            elif current_pos == 0:
-                state = "closed"
-            else:
-                state = "unknown"
+            state = door_motion_state(current_pos, last_pos)
             LAST_DOOR_STATE[set_door] = state
-            publish_to_mqtt(f"garage_door/{set_door}/position", current_pos, retain=True)
+            # position уже опубликовал get_door_status (publish_door_position)
             publish_to_mqtt(f"garage_door/{set_door}/state", state, retain=True)
     LAST_DOOR_STATE[set_door] = state
     return state
 
 
+def parse_command(msg):
+    """Команда и кому на неё отвечать.
+
+    Payload — "open_1" или JSON {"command": "open_1", "id": "...", "response_topic": "..."}
+    ({"command": "close", "doors": [0, 1]} — групповая команда "close_0,1")
+    (для клиентов MQTT 3.1.1). ResponseTopic/CorrelationData MQTT v5 важнее полей JSON.
+    Без id и response topic ответ уходит в общие топики (reply=None).
+    """
+    text = msg.payload.decode('utf-8').strip()
+    cmd, request_id, response_topic = text, None, None
+    if text.startswith("{"):
+        try:
+            request = json.loads(text)
+        except ValueError:
+            request = None
+        if not isinstance(request, dict):
+            return text, None
+        cmd = str(request.get("command", "")).strip()
+        doors = request.get("doors")
+        if isinstance(doors, list) and doors:
+            # {"command": "close", "doors": [0, 1]} -> "close_0,1"
+            cmd = f"{cmd}_{','.join(str(d) for d in doors)}"
+        if request.get("n") is not None and re.match(r"^history_\d+$", cmd):
+            # {"command": "history_1", "n": 20} -> "history_1_20"
+            try:
+                cmd = f"{cmd}_{int(request['n'])}"
+            except (TypeError, ValueError):
+                log.warning(f"Ignoring invalid history size {request['n']!r}")
+        if request.get("id") is not None:
+            request_id = str(request["id"])
+            if not COMMAND_ID_RE.match(request_id):
+                log.warning(f"Ignoring invalid command id {request_id!r}")
+                request_id = None
+        response_topic = request.get("response_topic")
+        if not response_topic and request_id:
+            response_topic = f"{MQTT_TOPIC_BASE}/send_command/reply/{request_id}"
+
+    properties = getattr(msg, "properties", None)
+    correlation = None
+    if getattr(properties, "ResponseTopic", None):
+        response_topic = properties.ResponseTopic
+        correlation = getattr(properties, "CorrelationData", None)
+
+    if not response_topic:
+        return cmd, None
+    if not isinstance(response_topic, str) or "+" in response_topic or "#" in response_topic:
+        log.warning(f"Ignoring invalid response topic {response_topic!r}")
+        return cmd, None
+    return cmd, {"topic": response_topic, "correlation": correlation, "id": request_id}
+
+
+def run_with_reply(reply, target, *args):
+    """target(*args) в новом потоке команды, ответы — тому же инициатору."""
+    COMMAND_REPLY.reply = reply
+    try:
+        return target(*args)
+    finally:
+        COMMAND_REPLY.reply = None
+
+
+def publish_reply(kind, body):
+    """Ответ только инициатору команды этого потока: {"type": kind, "id": ..., **body}.
+
+    False — инициатора нет, публиковать в общие топики.
+    """
+    reply = getattr(COMMAND_REPLY, "reply", None)
+    if reply is None or not MQTT_CLIENT:
+        return False
+    message = {"type": kind}
+    if reply["id"] is not None:
+        message["id"] = reply["id"]
+    message.update(body)
+    properties = None
+    if reply["correlation"] is not None:
+        properties = Properties(PacketTypes.PUBLISH)
+        properties.CorrelationData = reply["correlation"]
+    log.debug("---> MQTT reply: %s %s", reply["topic"], message)
+    try:
+        publish_or_journal(reply["topic"], json.dumps(message), qos=1, lane=MQTT_LANE_REPLY, properties=properties)
+    except ValueError as ex:
+        log.error(f"Cannot reply to {reply['topic']}: {ex}")
+    return True
+
+
 def publish_command_status(action, door, status, message=""):
     """Publish command execution status to MQTT for user feedback."""
     status_obj = {
         "action": action,
         "door": door,
-        "status": status,  # pending, retrying, success, failed
+        "status": status,  # pending, retrying, success, failed, expired
         "message": message,
         "timestamp": datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
     }
-    publish_to_mqtt("command/status", json.dumps(status_obj))
-    log.info(f"📤 Command status: {action} door {door} -> {status} {message}")
+    if not publish_reply("status", status_obj):
+        publish_to_mqtt("command/status", json.dumps(status_obj), qos=1)
+    log.info("📤 Command status: %s door %s -> %s %s", action, door, status, message,
+             extra={"door": door, "action": action, "status": status})
 
 
-def smart_open(set_door):
+def smart_open(set_door, deadline=None):
     """Open door only if not already open. Checks position first."""
     log.info(f"🔓 Smart open door {set_door} - checking position first...")
-    resp, position, state = get_door_status(set_door, max_retries=2)
+    resp, position, state = get_door_status(set_door, max_retries=2, deadline=deadline)
 
     if position is None or position == -1:
         log.warning(f"⚠️ Cannot get door position, sending UP command anyway")
-        return do_door_action("up", set_door)  # UP вместо impulse - гарантированно открывает
+        return do_door_action("up", set_door, deadline=deadline)  # UP вместо impulse - гарантированно открывает
 
     if position >= 95:  # Already open (allowing small margin)
         log.info(f"✅ Door {set_door} already open ({position}%), no action needed")
@@ -406,17 +914,17 @@ def smart_open(set_door):
         return {"status": "already_opening", "position": position}
 
     log.info(f"🔓 Door at {position}%, sending open command...")
-    return do_door_action("up", set_door)
+    return do_door_action("up", set_door, deadline=deadline)
 
 
-def smart_close(set_door):
+def smart_close(set_door, deadline=None):
     """Close door only if not already closed. Checks position first."""
     log.info(f"🔒 Smart close door {set_door} - checking position first...")
-    resp, position, state = get_door_status(set_door, max_retries=2)
+    resp, position, state = get_door_status(set_door, max_retries=2, deadline=deadline)
 
     if position is None or position == -1:
         log.warning(f"⚠️ Cannot get door position, sending DOWN command anyway")
-        return do_door_action("down", set_door)  # DOWN вместо impulse - гарантированно закрывает
+        return do_door_action("down", set_door, deadline=deadline)  # DOWN вместо impulse - гарантированно закрывает
 
     if position <= 5:  # Already closed (allowing small margin)
         log.info(f"✅ Door {set_door} already closed ({position}%), no action needed")
@@ -429,17 +937,21 @@ def smart_close(set_door):
         return {"status": "already_closing", "position": position}
 
     log.info(f"🔒 Door at {position}%, sending close command...")
-    return do_door_action("down", set_door)
+    return do_door_action("down", set_door, deadline=deadline)
+
 
+def set_position(set_door, target_position, deadline=None):
+    """Open/close door to specific position (0-100%).
 
-def set_position(set_door, target_position):
-    """Open/close door to specific position (0-100%)."""
+    deadline only bounds the start of the movement; once the door moves the
+    position is monitored until the target is reached.
+    """
     target_position = max(0, min(100, int(target_position)))
     log.info(f"🎯 Setting door {set_door} to {target_position}%...")
     publish_command_status("set_position", set_door, "pending", f"Target: {target_position}%")
 
     # Get current position
-    resp, current_pos, state = get_door_status(set_door, max_retries=2)
+    resp, current_pos, state = get_door_status(set_door, max_retries=2, deadline=deadline)
     if current_pos is None or current_pos == -1:
         log.error("⚠️ Cannot get current position")
         publish_command_status("set_position", set_door, "failed", "Cannot get position")
@@ -463,7 +975,9 @@ def set_position(set_door, target_position):
 
     # Send initial impulse
     log.info(f"🔄 Starting {direction}...")
-    do_door_action("impulse", set_door)
+    if do_door_action("impulse", set_door, deadline=deadline) is None:
+        publish_command_status("set_position", set_door, "failed", "Cannot start movement")
+        return None
     time.sleep(1.5)
 
     # Monitor until target reached
@@ -497,8 +1011,11 @@ def set_position(set_door, target_position):
     return None
 
 
-def do_door_action(action, set_door, max_retries=5):
-    """Execute door action with automatic retry on failure. Per-door state tracking."""
+def do_door_action(action, set_door, max_retries=5, deadline=None):
+    """Execute door action with automatic retry on failure. Per-door state tracking.
+
+    A command whose deadline has passed is abandoned instead of being sent late.
+    """
     global LAST_DOOR_STATE, POS_TRACKING_THREAD, DO_EXIT_THREAD, LAST_GW_ACTIVITY
     value = None
     set_door = int(set_door)
@@ -521,111 +1038,320 @@ def do_door_action(action, set_door, max_retries=5):
         return None
 
     port = set_door
-    retries = 0
-    backoff_times = [0.3, 0.5, 1.0, 1.5, 2.0]  # Быстрый backoff для команд
+    session = GW_COMMAND_POLICY.begin(max_attempts=max_retries, deadline=deadline)
+    started = time.monotonic()
+    warm = PREWARM.command_started(started)
+    wait_for_prewarm(deadline)
 
     publish_command_status(action, set_door, "pending")
 
-    while retries <= max_retries:
+    while True:
+        if command_expired(deadline):
+            log.warning("⌛ Command %s door %s abandoned: deadline passed", action, set_door)
+            publish_command_status(action, set_door, "expired", "Deadline passed, command not sent")
+            return None
         try:
-            # Проверка и принудительный reconnect если CLI не инициализирован
-            if CLI is None:
-                log.warning("⚠️ CLI not initialized, trying to init...")
-                init_bisecur_gw(True)
+            # CLI без собственной блокировки: keep-alive прогрева и опрос не должны вклиниться
+            # между reconnect/login и SET_STATE
+            if not gateway_lock.acquire(timeout=gateway_lock_timeout(deadline)):
+                raise MCPGatewayBusy()
+            try:
+                # Проверка и принудительный reconnect если CLI не инициализирован
                 if CLI is None:
-                    log.error("❌ Cannot init gateway")
-                    publish_command_status(action, set_door, "failed", "Gateway not initialized")
-                    return None
-
-            # Проверка соединения и reconnect
-            if not CLI.is_connected() or CLI.last_error:
-                log.warning(f"🔄 Gateway needs reconnect (connected={CLI.is_connected()}, last_error={CLI.last_error})")
-                publish_command_status(action, set_door, "retrying", "Reconnecting to gateway")
-                try:
-                    CLI.reconnect()
+                    log.warning("⚠️ CLI not initialized, trying to init...")
+                    init_bisecur_gw(True)
+                    if CLI is None:
+                        log.error("❌ Cannot init gateway")
+                        publish_command_status(action, set_door, "failed", "Gateway not initialized")
+                        return None
+
+                # Проверка соединения и reconnect
+                if not CLI.is_connected() or CLI.last_error:
+                    log.warning("🔄 Gateway needs reconnect (connected=%s, last_error=%r)", CLI.is_connected(), CLI.last_error)
+                    publish_command_status(action, set_door, "retrying", "Reconnecting to gateway")
+                    CLI.reconnect(deadline)
                     do_gw_login()
                     CLI.last_error = None  # Сбросить ошибку после успешного reconnect
-                except Exception as reconn_ex:
-                    log.error(f"Reconnect failed: {reconn_ex}")
-                    retries += 1
-                    time.sleep(backoff_times[min(retries - 1, len(backoff_times) - 1)])
-                    continue
 
-            mcp_cmd = MCPSetState.construct(port)
-            action_resp = CLI.generic(mcp_cmd, False)
+                mcp_cmd = MCPSetState.construct(port)
+                action_resp = CLI.generic(mcp_cmd, deadline=deadline)
+            finally:
+                gateway_lock.release()
+            check_mcp_error(action_resp)
 
-            if not check_mcp_error(action_resp):
-                LAST_GW_ACTIVITY = time.time()
-                current_pos = action_resp.payload.command.percent_open if hasattr(action_resp.payload.command, "percent_open") else -1
-                publish_command_status(action, set_door, "success", f"Position: {current_pos}%")
-
-                # Start position tracking thread (per-door)
-                if set_door in POS_TRACKING_THREAD and POS_TRACKING_THREAD[set_door].is_alive():
-                    DO_EXIT_THREAD[set_door] = True
-                    time.sleep(0.3)
-                    counter = 0
-                    while POS_TRACKING_THREAD[set_door].is_alive() and counter < 15:
-                        time.sleep(0.7)
-                        counter += 0.5
-
-                POS_TRACKING_THREAD[set_door] = threading.Thread(
-                    name=f'pos_tracking_door_{set_door}',
-                    target=track_realtime_door_position,
-                    args=(current_pos, action, set_door)
-                )
-                POS_TRACKING_THREAD[set_door].start()
-                return action_resp
-            else:
-                raise Exception("MCP error in response")
+            LAST_GW_ACTIVITY = time.time()
+            record_door_command(set_door, action)
+            PREWARM.record_latency(time.monotonic() - started, warm)
+            current_pos = action_resp.payload.command.percent_open if hasattr(action_resp.payload.command, "percent_open") else -1
+            publish_command_status(action, set_door, "success", f"Position: {current_pos}%")
+
+            # Start position tracking thread (per-door); общий трекер групповой команды
+            # ждать не нужно — он сам перестаёт вести дверь, у которой сменился трекер
+            if set_door in POS_TRACKING_THREAD and POS_TRACKING_THREAD[set_door].is_alive() \
+                    and not POS_TRACKING_THREAD[set_door].name.startswith("pos_tracking_group"):
+                DO_EXIT_THREAD[set_door] = True
+                time.sleep(0.3)
+                counter = 0
+                while POS_TRACKING_THREAD[set_door].is_alive() and counter < 15:
+                    time.sleep(0.7)
+                    counter += 0.5
+
+            POS_TRACKING_THREAD[set_door] = threading.Thread(
+                name=f'pos_tracking_door_{set_door}',
+                target=track_realtime_door_position,
+                args=(current_pos, action, set_door)
+            )
+            POS_TRACKING_THREAD[set_door].start()
+            return action_resp
 
         except Exception as ex:
-            error_str = str(ex).lower()
-            retries += 1
-
-            # Check for recoverable errors
-            if "port_error" in error_str or "code: 10" in error_str:
-                if retries <= max_retries:
-                    wait_time = backoff_times[min(retries - 1, len(backoff_times) - 1)]
-                    log.warning(f"🔄 Gateway busy, retry {retries}/{max_retries} in {wait_time}s...")
-                    publish_command_status(action, set_door, "retrying", f"Gateway busy, retry {retries}/{max_retries}")
-                    time.sleep(wait_time)
-                    continue
+            decision = session.next(ex)
+            if decision.action == RetryAction.GIVE_UP:
+                log.error("❌ Command failed after %d attempts (%s): %s", decision.attempt, type(ex).__name__, ex)
+                status = "expired" if isinstance(ex, MCPDeadlineExceeded) or command_expired(deadline) else "failed"
+                publish_command_status(action, set_door, status, str(ex)[:100])
+                return None
+
+            log.warning("🔄 %s: %s, retry %d/%d in %.1fs...", type(ex).__name__, decision.action.value,
+                        decision.attempt, max_retries, decision.delay)
+            publish_command_status(action, set_door, "retrying",
+                                   f"{decision.action.value}, retry {decision.attempt}/{max_retries}")
+            recover_gateway(decision)
+
+
+def resolve_group_command(cmd):
+    """close_all / open_garage / close_0,1 -> (action, target, [door, ...]); None — не групповая команда."""
+    match = GROUP_COMMAND_RE.match(cmd.lower().strip())
+    if not match or match.group("action") not in GROUP_ACTIONS:
+        return None
+    target = match.group("target")
+    if target == "all":
+        doors = sorted(set(args.doors_port))
+    elif target in DOOR_GROUPS:
+        doors = DOOR_GROUPS[target]
+    elif target[0].isdigit():
+        doors = sorted({int(door) for door in target.split(",")})
+    else:
+        return None
+    return match.group("action"), target, doors
 
-            # Check for connection errors (включая reset by peer)
-            if any(x in error_str for x in ["errno 32", "broken pipe", "connection", "reset by peer", "errno 104"]):
-                if retries <= max_retries:
-                    log.warning(f"🔄 Connection lost, reconnecting... retry {retries}/{max_retries}")
-                    publish_command_status(action, set_door, "retrying", f"Reconnecting, retry {retries}/{max_retries}")
-                    try:
-                        CLI.reconnect()
-                        do_gw_login()
-                        CLI.last_error = None  # Сбросить ошибку
-                    except Exception as reconn_ex:
-                        log.error(f"Reconnect failed: {reconn_ex}")
-                    time.sleep(0.3)  # Быстрее retry для команд
-                    continue
 
-            # Для любых других ошибок - пробуем reconnect и retry
-            if retries <= max_retries:
-                log.warning(f"🔄 Unknown error, trying reconnect... retry {retries}/{max_retries}: {ex}")
-                publish_command_status(action, set_door, "retrying", f"Retry {retries}/{max_retries}")
+def group_door_decision(action, set_door, position, first_position=None):
+    """Нужен ли двери импульс в групповой команде: None — нужен, иначе сообщение почему нет.
+
+    first_position — позиция при первом чтении: при повторе после ошибки дверь, которая уже
+    сдвинулась, импульс получила, второй её бы остановил.
+    """
+    door_state = LAST_DOOR_STATE.get(set_door)
+    if action == "get_door_state":
+        return f"Position: {position}%"
+    if first_position is not None and first_position != -1 and position != first_position:
+        return f"Already moving ({position}%)"
+    if action == "open":
+        if position >= 95:
+            return f"Already open ({position}%)"
+        if door_state == "opening":
+            return f"Already opening ({position}%)"
+    elif action == "close":
+        if 0 <= position <= 5:
+            return f"Already closed ({position}%)"
+        if door_state == "closing":
+            return f"Already closing ({position}%)"
+    elif action == "stop" and door_state not in ("opening", "closing"):
+        return f"Not moving (state: '{door_state}')"
+    return None
+
+
+def publish_group_status(action, target, results):
+    """Итог групповой команды одним сообщением command/status: общий статус и результат каждой двери."""
+    statuses = {status for status, _ in results.values()}
+    status_obj = {
+        "action": action,
+        "target": target,
+        "status": statuses.pop() if len(statuses) == 1 else "partial",  # success, failed, expired, partial
+        "doors": {str(door): {"status": status, "message": message}
+                  for door, (status, message) in sorted(results.items())},
+        "timestamp": datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    }
+    if not publish_reply("status", status_obj):
+        publish_to_mqtt("command/status", json.dumps(status_obj), qos=1)
+    log.info("📤 Group command status: %s %s -> %s %s", action, target, status_obj["status"], status_obj["doors"],
+             extra={"action": action, "status": status_obj["status"]})
+
+
+def do_group_command(action, doors, deadline=None, target=None, max_retries=5):
+    """Команда нескольким дверям за одну сессию со шлюзом.
+
+    Позиции всех дверей читаются одним пакетом запросов (CLI.get_transitions), по ним решается,
+    каким дверям действие действительно нужно, и MCPSetState этим дверям тоже уходит одним
+    пакетом (CLI.set_states). Сдвинутые двери ведёт один общий трекер, итог по всем
+    дверям — одно сообщение command/status.
+    """
+    global IS_ACTIVE_TASK, LAST_COMMAND_TIME, LAST_GW_ACTIVITY
+    target = target or ",".join(map(str, doors))
+    results = {}  # {door: (status, message)}
+    if command_expired(deadline):
+        log.warning("⌛ Group command '%s' for %s expired before execution, dropped", action, target)
+        publish_group_status(action, target, {door: ("expired", "Deadline passed before execution") for door in doors})
+        return None
+
+    IS_ACTIVE_TASK.set()
+    LAST_COMMAND_TIME = time.time()
+    session = GW_COMMAND_POLICY.begin(max_attempts=max_retries, deadline=deadline)
+    started = time.monotonic()
+    warm = PREWARM.command_started(started)
+    wait_for_prewarm(deadline)
+    pending = list(doors)
+    first_positions = {}
+    moved = {}  # {door: position before the impulse}
+    try:
+        while pending:
+            if command_expired(deadline):
+                log.warning("⌛ Group command %s %s abandoned: deadline passed", action, target)
+                results.update((door, ("expired", "Deadline passed, command not sent")) for door in pending)
+                break
+            try:
+                if not gateway_lock.acquire(timeout=gateway_lock_timeout(deadline)):
+                    raise MCPGatewayBusy()
                 try:
-                    CLI.reconnect()
-                    do_gw_login()
-                    CLI.last_error = None
-                except Exception as reconn_ex:
-                    log.error(f"Reconnect failed: {reconn_ex}")
-                time.sleep(backoff_times[min(retries - 1, len(backoff_times) - 1)])
-                continue
+                    if CLI is None:
+                        log.warning("⚠️ CLI not initialized, trying to init...")
+                        init_bisecur_gw(True)
+                        if CLI is None:
+                            log.error("❌ Cannot init gateway")
+                            results.update((door, ("failed", "Gateway not initialized")) for door in pending)
+                            break
+                    if not CLI.is_connected() or CLI.last_error:
+                        log.warning("🔄 Gateway needs reconnect (connected=%s, last_error=%r)", CLI.is_connected(), CLI.last_error)
+                        CLI.reconnect(deadline)
+                        do_gw_login()
+                        CLI.last_error = None
+
+                    busy = None
+                    positions = {}
+                    for door, resp in CLI.get_transitions(pending, deadline=deadline).items():
+                        last_request_time[door] = time.time()
+                        if isinstance(resp, MCPDeviceError):
+                            record_door_history(door, -1, source=SOURCE_ERROR)
+                            if isinstance(resp, MCPBusyError):
+                                busy = resp
+                            else:
+                                results[door] = ("failed", str(resp)[:100])
+                            continue
+                        LAST_GW_ACTIVITY = time.time()
+                        position = resp.payload.command.percent_open if hasattr(resp.payload.command, "percent_open") else -1
+                        if position != -1:
+                            state = {0: "closed", 100: "open"}.get(position)
+                            publish_door_position(door, position, state)
+                            if state:
+                                publish_to_mqtt(f"garage_door/{door}/state", state, retain=True)
+                        reason = group_door_decision(action, door, position, first_positions.get(door))
+                        first_positions.setdefault(door, position)
+                        if reason is not None:
+                            if reason.startswith("Already moving"):
+                                moved[door] = position
+                            results[door] = ("success", reason)
+                        else:
+                            positions[door] = position
+
+                    if positions:
+                        log.info("🚪 Group %s %s: impulse to doors %s", action, target, list(positions))
+                        for door, resp in CLI.set_states(positions, deadline=deadline).items():
+                            if isinstance(resp, MCPBusyError):
+                                busy = resp
+                            elif isinstance(resp, MCPDeviceError):
+                                results[door] = ("failed", str(resp)[:100])
+                            else:
+                                LAST_GW_ACTIVITY = time.time()
+                                record_door_command(door, action)
+                                results[door] = ("success", f"Position: {positions[door]}%")
+                                moved[door] = positions[door]
+                finally:
+                    gateway_lock.release()
+
+                pending = [door for door in pending if door not in results]
+                if pending:
+                    raise busy or MCPGatewayBusy()
+
+            except Exception as ex:
+                decision = session.next(ex)
+                if decision.action == RetryAction.GIVE_UP:
+                    log.error("❌ Group command failed after %d attempts (%s): %s", decision.attempt, type(ex).__name__, ex)
+                    status = "expired" if isinstance(ex, MCPDeadlineExceeded) or command_expired(deadline) else "failed"
+                    results.update((door, (status, str(ex)[:100])) for door in pending)
+                    break
+                log.warning("🔄 %s: %s, group retry %d/%d in %.1fs (doors %s)...", type(ex).__name__,
+                            decision.action.value, decision.attempt, max_retries, decision.delay, pending)
+                recover_gateway(decision)
+
+        if moved:
+            PREWARM.record_latency(time.monotonic() - started, warm)
+            start_group_tracking(moved, action)
+    finally:
+        IS_ACTIVE_TASK.clear()
+        publish_group_status(action, target, results)
+    return results
 
-            # Max retries reached
-            log.error(f"❌ Command failed after {max_retries} retries: {ex}")
-            publish_command_status(action, set_door, "failed", str(ex)[:100])
-            return None
 
-    # Max retries exceeded
-    publish_command_status(action, set_door, "failed", f"Max retries ({max_retries}) exceeded")
-    return None
+def start_group_tracking(positions, action):
+    """Один трекер на все сдвинутые двери; их прежние трекеры останавливаются."""
+    thread = threading.Thread(
+        name=f"pos_tracking_group_{'_'.join(map(str, positions))}",
+        target=track_group_door_positions,
+        args=(positions, action)
+    )
+    for door in positions:
+        if door in POS_TRACKING_THREAD and POS_TRACKING_THREAD[door].is_alive():
+            DO_EXIT_THREAD[door] = True  # трекер двери выйдет на следующем цикле
+        POS_TRACKING_THREAD[door] = thread
+    thread.start()
+
+
+def track_group_door_positions(positions, last_action):
+    """Общий трекер дверей одной групповой команды: одно пакетное чтение позиций за цикл.
+
+    Дверь выбывает, когда перестаёт двигаться или её трекинг забрала более новая команда
+    (POS_TRACKING_THREAD[door] уже другой поток).
+    """
+    global LAST_GW_ACTIVITY
+    me = threading.current_thread()
+    last_pos = dict(positions)
+    # По истории: двойное среднее время хода самой медленной двери, но не дольше ~5 минут
+    travel = learned_travel_time(positions)
+    max_cycles = min(GROUP_TRACKING_MAX_CYCLES, int(travel * 2 / 3) + 3) if travel else GROUP_TRACKING_MAX_CYCLES
+    time.sleep(2)
+    for cycle in range(max_cycles):
+        doors = [door for door in last_pos if POS_TRACKING_THREAD.get(door) is me]
+        if not doors:
+            break
+        time.sleep(3)
+        if not gateway_lock.acquire(blocking=False):
+            log.debug("🚧 Group tracking (%s) skipped a cycle because lock is busy", last_action)
+            continue
+        try:
+            if CLI is None:
+                break
+            states = CLI.get_transitions(doors)
+        except Exception as ex:
+            log.warning("⚠️ Group tracking of doors %s stopped: %s: %s", doors, type(ex).__name__, ex)
+            break
+        finally:
+            gateway_lock.release()
+
+        for door, resp in states.items():
+            if isinstance(resp, MCPDeviceError) or not hasattr(resp.payload.command, "percent_open"):
+                record_door_history(door, -1, source=SOURCE_ERROR)
+                continue
+            LAST_GW_ACTIVITY = time.time()
+            current_pos = resp.payload.command.percent_open
+            state = door_motion_state(current_pos, last_pos[door])
+            LAST_DOOR_STATE[door] = state
+            publish_door_position(door, current_pos, state)
+            publish_to_mqtt(f"garage_door/{door}/state", state, retain=True)
+            if cycle > 0 and current_pos == last_pos[door]:
+                del last_pos[door]  # остановилась
+            else:
+                last_pos[door] = current_pos
 
 
 def do_gw_login():
@@ -658,14 +1384,14 @@ def check_mcp_error(resp):
     error_obj = None
 
     if CLI and CLI.last_error:
-        log.error(f"CLI.last_error detected: {CLI.last_error}")
-        if resp and hasattr(resp, "payload") and hasattr(resp.payload, "command") and hasattr(resp.payload.command, "error_code"):
+        log.error(f"CLI.last_error detected: {CLI.last_error!r}")
+        if isinstance(CLI.last_error, MCPDeviceError):
             error_obj = {
-                "error_code": resp.payload.command.error_code.value,
-                "error": resp.payload.command.error_code.name
+                "error_code": CLI.last_error.error_code.value,
+                "error": CLI.last_error.error_code.name
             }
         else:
-            error_obj = {"error_code": "Unknown", "error": str(resp) if resp else "Unknown error"}
+            error_obj = {"error_code": "Unknown", "error": str(CLI.last_error)}
 
     elif resp and hasattr(resp, "payload") and hasattr(resp.payload, "command_id"):
         if resp.payload.command_id == 1 and hasattr(resp.payload.command, "error_code"):
@@ -676,47 +1402,91 @@ def check_mcp_error(resp):
             }
 
     if error_obj:
-        publish_to_mqtt("send_command/error", json.dumps(error_obj))
-    else:
-        publish_to_mqtt("send_command/error", "")
+        if not publish_reply("error", error_obj):
+            publish_to_mqtt("send_command/error", json.dumps(error_obj), qos=1)
+    elif getattr(COMMAND_REPLY, "reply", None) is None:
+        publish_to_mqtt("send_command/error", "", qos=1)
 
     return error_obj
 
 
 def on_message(mosq, userdata, msg):
     log.info(f"---> Topic '{msg.topic}' received command '{msg.payload.decode('utf-8')}'")
-    cmd = msg.payload.decode('utf-8').strip()
-    parts = cmd.split("_")
+    cmd, reply = parse_command(msg)
+    if reply:
+        log.info(f"↩️ Replies for '{cmd}' go to {reply['topic']} (id={reply['id']})")
+    COMMAND_REPLY.reply = reply
+    try:
+        dispatch_command(cmd, msg.timestamp, reply)
+    finally:
+        COMMAND_REPLY.reply = None
 
+
+def dispatch_command(cmd, received, reply=None):
+    parts = cmd.split("_")
+    # received — время получения пакета (monotonic), от него отсчитывается deadline команды
+    deadline = received + COMMAND_DEADLINE if COMMAND_DEADLINE > 0 else None
+    group = resolve_group_command(cmd)
+
+    # Pre-warm: warm / warm_120 (окно в секундах)
+    if re.match(r"^warm(_\d+)?$", cmd):
+        remaining = prewarm_gateway("command", int(parts[1]) if len(parts) > 1 else None)
+        publish_reply("response", {"command": cmd, "response": f"Warm for {remaining:.0f}s"})
     # Handle position command: position_50_1 (set door 1 to 50%)
-    if re.match(r"^position_\d+_\d+$", cmd):
+    elif re.match(r"^position_\d+_\d+$", cmd):
         target_pos = int(parts[1])
         door = int(parts[2])
         if door in args.doors_port:
             log.info(f"🎯 Position command: door {door} to {target_pos}%")
-            threading.Thread(target=set_position, args=(door, target_pos), daemon=True).start()
+            threading.Thread(target=run_with_reply, args=(reply, set_position, door, target_pos, deadline),
+                             daemon=True).start()
         else:
             log.warning(f"Door {door} not in configured ports")
+            publish_reply("error", {"command": cmd, "error": f"Door {door} not in configured ports"})
+    # Handle group command: close_all, open_garage, close_0,1
+    elif group:
+        action, target, doors = group
+        unknown = [d for d in doors if d not in args.doors_port]
+        if unknown:
+            log.warning("Doors %s not in configured ports", unknown)
+            publish_reply("error", {"command": cmd, "error": f"Doors {unknown} not in configured ports"})
+        else:
+            log.info("🚪 Group command '%s' for %s: doors %s", action, target, doors)
+            threading.Thread(target=run_with_reply, args=(reply, do_group_command, action, doors, deadline, target),
+                             name=f"group_command_{target}", daemon=True).start()
+    # Handle history query with size: history_1_20 (last 20 movements of door 1)
+    elif re.match(r"^history_\d+_\d+$", cmd):
+        if int(parts[1]) in args.doors_port:
+            do_command(parts[0], parts[1], deadline, int(parts[2]))
+        else:
+            log.warning(f"Door {parts[1]} not in configured ports")
+            publish_reply("error", {"command": cmd, "error": f"Door {parts[1]} not in configured ports"})
     # Handle standard command: open_1, close_1, etc.
     elif re.match(r"^[a-zA-Z]+_\d+$", cmd):
         if int(parts[1]) in args.doors_port:
             log.info(f"Door: {parts[1]} and Command: {parts[0]}")
-            do_command(parts[0], parts[1])
+            do_command(parts[0], parts[1], deadline)
         else:
             log.warning(f"Door {parts[1]} not in configured ports")
+            publish_reply("error", {"command": cmd, "error": f"Door {parts[1]} not in configured ports"})
     else:
         log.warning(f"Received invalid command format: {cmd}")
+        publish_reply("error", {"command": cmd, "error": "Invalid command format"})
 
 
-def on_connect(client, userdata, flags, rc):
+def on_connect(client, userdata, flags, rc, properties=None):
     clear_command_topic()
     log.info(f"📡 Connected to MQTT broker (RC={rc}). Subscribing to command topic.")
+    if args.mqtt_tls:
+        log.info(f"🔐 TLS session resumed: {client.tls_session_reused()}")
     if rc == 0:
         sub_topic = f"{MQTT_TOPIC_BASE}/send_command/command"
-        client.subscribe(sub_topic, 0)
+        client.subscribe([(sub_topic, 0), (f"{MQTT_TOPIC_BASE}/send_command/warm", 0)])
         log.info(f"✅ Subscribed to {sub_topic}")
+        # Очередь отправит availability и discovery раньше накопленной телеметрии
+        flush_state_journal(client)
         for set_door in args.doors_port:
-            publish_to_mqtt(f"{set_door}/state", "online", retain=True)
+            publish_to_mqtt(f"{set_door}/state", "online", retain=True, lane=MQTT_LANE_AVAILABILITY)
             log.info(f"🚪 Set door {set_door} availability to online")
         for set_door in args.doors_port:
             init_ha_discovery(set_door)
@@ -724,22 +1494,25 @@ def on_connect(client, userdata, flags, rc):
         log.error(f"❌ MQTT connection failed with code {rc}")
 
 
-def on_disconnect(mosq, userdata, rc):
+def on_disconnect(mosq, userdata, rc, properties=None):
     log.info(f"📡 MQTT session disconnected (rc={rc})!!!")
-    clear_command_topic()
-    for set_door in args.doors_port:
-        publish_to_mqtt(f"{set_door}/state", "offline", retain=True)
-        log.info(f"Performing actions for port: {set_door}")
-    time.sleep(10)
+    if args.mqtt_v5:
+        log.info(f"📉 MQTT topic aliases: {mosq.topic_alias_stats()}")
+    journal_publish_queue(mosq)
+    # Топик команд очистит on_connect (до подписки); availability=offline публикует сам брокер (will_set).
+    # Без sleep: сетевой поток не блокируем, паузы между попытками — reconnect_delay_set()
+    log.info(f"📭 MQTT journal: {STATE_JOURNAL.stats()}")
 
 
 def clear_command_topic():
     log.info("📡 Clearing MQTT command topic...")
-    MQTT_CLIENT_PUB.publish(f"{MQTT_TOPIC_BASE}/send_command/command", "\0", qos=0, retain=True)
+    # Мимо очереди: PUBLISH должен уйти раньше SUBSCRIBE из on_connect
+    MQTT_CLIENT.publish(f"{MQTT_TOPIC_BASE}/send_command/command", "\0", qos=0, retain=True)
 
 
 def restart_script():
     log.error("MCPError.PERMISSION_DENIED detected. Restarting script...")
+    stop_logging(LOG_LISTENER)  # execl не вызывает atexit — дописать очередь логов
     python = sys.executable
     os.execl(python, python, *sys.argv)
 
@@ -791,10 +1564,11 @@ def init_ha_discovery(set_door):
     payload["connections"] = ["mac", bisecur_mac, "ip", bisecur_ip]
     payload["sw_version"] = VERSION
     _, payload["gw_hw_version"] = get_gw_version()
-    publish_to_mqtt(f"cover/bisecur/{set_door}/config", json.dumps(payload), f"{args.mqtt_topic_HA_discovery}")
-    publish_to_mqtt("attributes/system_version", VERSION)
-    publish_to_mqtt("attributes/gw_ip_address", bisecur_ip)
-    publish_to_mqtt("attributes/gw_mac_address", bisecur_mac)
+    publish_to_mqtt(f"cover/bisecur/{set_door}/config", json.dumps(payload), f"{args.mqtt_topic_HA_discovery}",
+                    lane=MQTT_LANE_DISCOVERY)
+    publish_to_mqtt("attributes/system_version", VERSION, lane=MQTT_LANE_DISCOVERY)
+    publish_to_mqtt("attributes/gw_ip_address", bisecur_ip, lane=MQTT_LANE_DISCOVERY)
+    publish_to_mqtt("attributes/gw_mac_address", bisecur_mac, lane=MQTT_LANE_DISCOVERY)
 
 
 def init_bisecur_gw(is_restart=False):
@@ -805,12 +1579,17 @@ def init_bisecur_gw(is_restart=False):
     # Init Bisecur Gateway stuff
     src_mac = args.src_mac.replace(':', '') if args.src_mac else "FFFFFFFFFFFF"
     bisecur_mac = args.bisecur_mac.replace(':', '') if args.bisecur_mac else ""
+    if not args.bisecur_ip:
+        args.bisecur_ip = resolve_gateway_ip() or ""
     bisecur_ip = args.bisecur_ip if args.bisecur_ip else None
     if not (bisecur_ip and bisecur_mac):
         log.error("ERROR: bisecur Gateway IP and MAC addresses must be specified in the config file")
     log.debug(f"INIT: Gateway IP: {bisecur_ip}, bisecur_mac: {bisecur_mac}, src_mac: {src_mac}")
-    CLI = MCPClient(bisecur_ip, 4000, bytes.fromhex(src_mac), bytes.fromhex(bisecur_mac))
+    CLI = MCPClient(bisecur_ip, 4000, bytes.fromhex(src_mac), bytes.fromhex(bisecur_mac), rtt=GW_RTT,
+                    capture=GW_CAPTURE)
     login_token = do_gw_login()
+    if not login_token and isinstance(CLI.last_error, MCPTransportError) and rediscover_gateway():
+        login_token = do_gw_login()
     if not login_token:
         log.error("ERROR: login token")
 
@@ -847,9 +1626,9 @@ def poll_door_status(set_door):
                 return resp, position, state
 
             # Проверяем тип ошибки
-            err_info = str(CLI.last_error) if CLI and CLI.last_error else ""
+            err = CLI.last_error if CLI else None
 
-            if "PORT_ERROR" in err_info or "Code: 10" in err_info:
+            if isinstance(err, MCPBusyError):
                 CLI.last_error = None
                 if query_attempt < 2:
                     log.debug(f"🔄 PORT_ERROR (warm-up), retry через 3с...")
@@ -876,6 +1655,7 @@ def periodic_door_status_check():
     подключается только при открытии). Адаптивный интервал:
     - В покое: IDLE_POLL_INTERVAL (300с/5мин) — минимальная нагрузка на шлюз
     - После команды: ACTIVE_POLL_INTERVAL (10с) на 2 мин — для tracking
+      (короче, если по истории позиций двери доезжают быстрее)
     - Per-door cooldown: если дверь не отвечает, опрашиваем ещё реже
     """
     global DOOR_FAILURE_COUNT, DOOR_COOLDOWN_UNTIL
@@ -918,10 +1698,22 @@ def periodic_door_status_check():
 
         timestamp = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
         publish_to_mqtt("status/last_heartbeat", timestamp)
-
-        # Адаптивный интервал: чаще после команд, реже в покое
+        publish_to_mqtt("status/retry_stats", json.dumps({"query": GW_QUERY_POLICY.stats(),
+                                                          "command": GW_COMMAND_POLICY.stats()}))
+        publish_to_mqtt("status/gateway_rtt", json.dumps(GW_RTT.stats()))
+        publish_to_mqtt("status/mqtt_journal", json.dumps(STATE_JOURNAL.stats()))
+        if MQTT_QUEUE is not None:
+            publish_to_mqtt("status/mqtt_queue", json.dumps(MQTT_QUEUE.stats()))
+        publish_to_mqtt("status/gateway_prewarm", json.dumps(PREWARM.stats()))
+        flush_door_history()
+
+        # Адаптивный интервал: чаще после команд, реже в покое. Активный режим — пока двери
+        # по истории успевают доехать (два средних хода + запас), не дольше ACTIVE_POLL_DURATION
+        travel = learned_travel_time()
+        active_duration = min(ACTIVE_POLL_DURATION, travel * 2 + 2 * ACTIVE_POLL_INTERVAL) if travel \
+            else ACTIVE_POLL_DURATION
         since_command = time.time() - LAST_COMMAND_TIME
-        if LAST_COMMAND_TIME > 0 and since_command < ACTIVE_POLL_DURATION:
+        if LAST_COMMAND_TIME > 0 and since_command < active_duration:
             interval = ACTIVE_POLL_INTERVAL
             log.debug(f"⏱️ Активный режим, опрос через {interval}с")
         else:
@@ -929,38 +1721,69 @@ def periodic_door_status_check():
         time.sleep(interval)
 
 
+async def run_mqtt_asyncio():
+    """MQTT_CLIENT через asyncio-цикл в главном потоке вместо loop_forever()."""
+    aclient = AsyncClient(MQTT_CLIENT)
+    try:
+        return await aclient.wait_closed()
+    finally:
+        aclient.helper.detach()
+
+
 def main():
-    global MQTT_CLIENT_SUB, MQTT_CLIENT_PUB
+    global MQTT_CLIENT, MQTT_QUEUE
 
     # Init mqtt
     userdata = {}
 
     clientid = args.mqtt_clientid if args.mqtt_clientid else f"biscure2mqtt-{os.getpid()}"
-    MQTT_CLIENT_SUB = paho.Client(f"{clientid}_sub", clean_session=False)
-    MQTT_CLIENT_PUB = paho.Client(f"{clientid}_pub", clean_session=False)
+    connect_kwargs = {}
+    # Одно соединение на всё; id "_sub" прежний — брокер сохраняет сессию (подписку, QoS>0)
+    if args.mqtt_v5:
+        # v5: частые топики (position, _ts, ...) уходят как 2-байтовый topic alias
+        MQTT_CLIENT = paho.Client(f"{clientid}_sub", protocol=paho.MQTTv5)
+        # аналог clean_session=False из v3.1.1: сессия не истекает
+        session = Properties(PacketTypes.CONNECT)
+        session.SessionExpiryInterval = 0xFFFFFFFF
+        connect_kwargs = {"clean_start": False, "properties": session}
+    else:
+        MQTT_CLIENT = paho.Client(f"{clientid}_sub", clean_session=False)
+    MQTT_CLIENT.set_loop_engine(paho.LOOP_ENGINE_SELECTOR)  # epoll, постоянная регистрация сокета
+    # Публикации из потоков опроса/команд — в очередь, пачками отправляет сетевой цикл
+    MQTT_QUEUE = MQTT_CLIENT.publish_queue_set(maxsize=MQTT_QUEUE_SIZE, lanes=3)
+
+    if args.mqtt_session_store:
+        # Неподтверждённые QoS>0 переживают restart_script()/перезапуск HA: дошлются после connect
+        try:
+            restored = MQTT_CLIENT.session_store_set(paho.MQTTFileSessionStore(f"{args.mqtt_session_store}_sub.log"))
+            if restored:
+                log.info(f"📦 Restored {restored} unacknowledged MQTT messages")
+        except OSError as e:
+            log.error(f"❌ MQTT session store unavailable, keeping the session in memory: {e}")
 
     for set_door in args.doors_port:
-        MQTT_CLIENT_SUB.will_set(f"{MQTT_TOPIC_BASE}/{set_door}/state", "offline", qos=0, retain=True)
+        MQTT_CLIENT.will_set(f"{MQTT_TOPIC_BASE}/{set_door}/state", "offline", qos=0, retain=True)
 
-    MQTT_CLIENT_SUB.on_message = on_message
-    MQTT_CLIENT_SUB.on_connect = on_connect
-    MQTT_CLIENT_SUB.on_disconnect = on_disconnect
+    MQTT_CLIENT.on_message = on_message
+    MQTT_CLIENT.message_callback_add(f"{MQTT_TOPIC_BASE}/send_command/warm", on_warm_message)
+    MQTT_CLIENT.on_connect = on_connect
+    MQTT_CLIENT.on_disconnect = on_disconnect
+    # Пауза между попытками переподключения (раньше — time.sleep(10) в on_disconnect)
+    MQTT_CLIENT.reconnect_delay_set(min_delay=1, max_delay=60)
 
     if args.mqtt_username:
-        MQTT_CLIENT_SUB.username_pw_set(args.mqtt_username, args.mqtt_password)
-        MQTT_CLIENT_PUB.username_pw_set(args.mqtt_username, args.mqtt_password)
+        MQTT_CLIENT.username_pw_set(args.mqtt_username, args.mqtt_password)
 
     if args.mqtt_tls:
-        MQTT_CLIENT_SUB.tls_set()
+        # Переподключения возобновляют TLS-сессию, без полного handshake
+        MQTT_CLIENT.tls_set_context(ssl.create_default_context())
 
     try:
-        MQTT_CLIENT_SUB.connect(args.mqtt_broker, args.mqtt_port, 60)
+        MQTT_CLIENT.connect(args.mqtt_broker, args.mqtt_port, 60, **connect_kwargs)
     except Exception as e:
         log.error(f"❌ MQTT connect failed: {e}")
-        MQTT_CLIENT_SUB = None
+        MQTT_CLIENT = None
         return
-
-    MQTT_CLIENT_PUB.connect(args.mqtt_broker, args.mqtt_port, 60)
     log.info("📡 Connecting to MQTT broker")
 
     # Init Bisecur Gateway
@@ -981,12 +1804,22 @@ def main():
     status_thread.start()
     log.info("✅ Thread periodic_door_status_check started successfully")
 
+    if args.prewarm_usage:
+        threading.Thread(target=prewarm_scheduler, name="prewarm_scheduler", daemon=True).start()
+        log.info("✅ Usage based gateway pre-warm enabled")
+
+    if POSITION_INTERPOLATION_HZ > 0:
+        threading.Thread(target=interpolate_door_positions, name="position_interpolation", daemon=True).start()
+        log.info(f"✅ Position interpolation at {POSITION_INTERPOLATION_HZ:g} Hz")
+
     while True:
         log.info("🔄 Entering loop_forever()... (script should not exit)")
         try:
-            log.info(f"🔄 MQTT_CLIENT_SUB: {MQTT_CLIENT_SUB}")
-            log.info(f"🔄 MQTT_CLIENT_PUB: {MQTT_CLIENT_PUB}")
-            MQTT_CLIENT_SUB.loop_forever()
+            log.info(f"🔄 MQTT_CLIENT: {MQTT_CLIENT}")
+            if args.mqtt_asyncio:
+                asyncio.run(run_mqtt_asyncio())
+            else:
+                MQTT_CLIENT.loop_forever()
             log.error("❌ loop_forever() unexpectedly exited!")
         except socket.error:
             print("... doing sleep(5)")
@@ -998,12 +1831,13 @@ def main():
             log.info("Shutting down connections")
         finally:
             log.info("Exiting system. Changing MQTT state to 'offline'")
+            # Цикл уже не крутится: напрямую, publish() без цикла пишет в сокет сам
             for set_door in args.doors_port:
-                MQTT_CLIENT_PUB.publish(f"{MQTT_TOPIC_BASE}/{set_door}/state", "offline", retain=True)
-            MQTT_CLIENT_SUB.loop_stop()
+                MQTT_CLIENT.publish(f"{MQTT_TOPIC_BASE}/{set_door}/state", "offline", retain=True)
+            MQTT_CLIENT.loop_stop()
+            flush_door_history()
             if CLI:
-                if hasattr(CLI,
-                           "last_error") and CLI.last_error is not None and "value" in CLI.last_error and CLI.last_error.value == 12:
+                if isinstance(getattr(CLI, "last_error", None), MCPPermissionDenied):
                     log.info(f"Logging out of Bisecur Gateway ({CLI.token})")
                     CLI.logout()
                 elif hasattr(CLI, "last_error"):
@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import threading
+
+"""
+Per-door position history: a fixed-size ring buffer whose memory image is the file
+
+File layout (little endian), capacity records whatever the fill level:
+
++-----------------+----------------+-------------+----------------+-------------+-------------------+
+| MAGIC [8 bytes] | RECORD_SIZE [2]| RESERVED [2]| CAPACITY [4]   | HEAD [4]    | COUNT [4]         |
++-----------------+----------------+-------------+----------------+-------------+-------------------+
+| CLOCK_OFFSET [8, double]         | RECORD * CAPACITY                                            |
++----------------------------------+--------------------------------------------------------------+
+
+Record
+
++-------------------------+-----------------+---------------+------------+-------------+
+|  TIMESTAMP [8, double]  | POSITION [1, s] | STATE [1]     | SOURCE [1] | PADDING [1] |
++-------------------------+-----------------+---------------+------------+-------------+
+
+TIMESTAMP is time.monotonic(); CLOCK_OFFSET is time.time() - time.monotonic() at
+the last flush, so a loaded history is shifted onto the current monotonic clock
+(and time.time() = TIMESTAMP + CLOCK_OFFSET for readers of the file). HEAD is the
+slot the next record goes to, the oldest record is at (HEAD - COUNT) % CAPACITY.
+POSITION is -1 when unknown (commands, failed reads).
+
+The file is rewritten whole (tmp + rename) by flush(), so readers may mmap it at
+any time: python3 -m libs.doorhistory <file>
+"""
+
+MAGIC = b'BSHIST01'
+HEADER = struct.Struct('<8sHHIIId')
+RECORD = struct.Struct('<dbBBx')
+
+STATES = (None, 'closed', 'open', 'opening', 'closing', 'unknown')
+STATE_CODES = {state: code for code, state in enumerate(STATES)}
+
+SOURCE_GATEWAY = 0  # position read from the gateway
+SOURCE_COMMAND = 1  # impulse sent, STATE is the intended direction
+SOURCE_ERROR = 2    # position read failed
+SOURCES = ('gateway', 'command', 'error')
+
+
+def iter_records(buf):
+    """
+    (timestamp, position, state, source) oldest first, from a history file image
+    (bytes, bytearray or mmap); timestamps are on the writer's monotonic clock
+    """
+    magic, record_size, _, capacity, head, count, _ = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or record_size != RECORD.size:
+        raise ValueError('not a door history image')
+    count = min(count, capacity)
+    for i in range(count):
+        slot = (head - count + i) % capacity
+        timestamp, position, state, source = RECORD.unpack_from(buf, HEADER.size + slot * RECORD.size)
+        yield timestamp, position, STATES[state] if state < len(STATES) else None, source
+
+
+def movements(records):
+    """
+    Split records into movements: [{"start", "end", "from", "to", "duration", "direction"}, ...]
+
+    A movement starts at the last gateway sample (or the command sent) before the
+    position changes and ends at the first sample of the final position: the next
+    sample repeats it, the direction reverses or a new command is sent.
+    """
+    result = []
+    current = None
+    last = None           # (timestamp, position) of the previous gateway sample
+    command_time = None
+
+    def close():
+        if current is not None and current['to'] != current['from']:
+            current['duration'] = round(current['end'] - current['start'], 2)
+            result.append(current)
+
+    for timestamp, position, state, source in records:
+        if source == SOURCE_COMMAND:
+            close()
+            current = None
+            command_time = timestamp
+            continue
+        if source != SOURCE_GATEWAY or position < 0:
+            continue
+        if last is not None and position != last[1]:
+            direction = 'opening' if position > last[1] else 'closing'
+            if current is None or current['direction'] != direction:
+                close()
+                # the door starts a little after the command; an old command did not move it
+                start = command_time if command_time is not None and 0 <= last[0] - command_time < 10 else last[0]
+                command_time = None
+                current = {'start': start, 'end': timestamp, 'from': last[1], 'to': position,
+                           'direction': direction}
+            else:
+                current['end'] = timestamp
+                current['to'] = position
+        elif current is not None:
+            close()
+            current = None
+        last = (timestamp, position)
+    close()
+    return result
+
+
+class DoorHistory:
+    """
+    Thread-safe: record() is called by the trackers/poll thread, queries and
+    flush() by the command and poll threads
+    """
+
+    def __init__(self, capacity=4096, path=None):
+        self.capacity = capacity
+        self.path = path
+        self._lock = threading.Lock()
+        self._buf = bytearray(HEADER.size + capacity * RECORD.size)
+        self._head = 0
+        self._count = 0
+        self._dirty = False
+        if path and os.path.exists(path):
+            self._load()
+
+    def record(self, position, state=None, source=SOURCE_GATEWAY, timestamp=None):
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        with self._lock:
+            RECORD.pack_into(self._buf, HEADER.size + self._head * RECORD.size,
+                             timestamp, max(-1, min(100, int(position))), STATE_CODES.get(state, 0), source)
+            self._head = (self._head + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+            self._dirty = True
+
+    def _image(self):
+        HEADER.pack_into(self._buf, 0, MAGIC, RECORD.size, 0, self.capacity, self._head, self._count,
+                         time.time() - time.monotonic())
+        return self._buf
+
+    def records(self):
+        with self._lock:
+            return list(iter_records(self._image()))
+
+    def __len__(self):
+        with self._lock:
+            return self._count
+
+    def movements(self, limit=10):
+        """
+        The last limit movements, timestamps as wall clock
+        """
+        offset = time.time() - time.monotonic()
+        result = movements(self.records())[-limit:]
+        for movement in result:
+            movement['start'] = round(movement['start'] + offset, 1)
+            movement['end'] = round(movement['end'] + offset, 1)
+        return result
+
+    def command_times(self):
+        """
+        Wall clock times of the recorded commands
+        """
+        offset = time.time() - time.monotonic()
+        return [r[0] + offset for r in self.records() if r[3] == SOURCE_COMMAND]
+
+    def travel_times(self, min_travel=50):
+        """
+        Average full travel (0 <-> 100) time per direction in seconds, scaled from
+        movements covering at least min_travel percent; None without data
+        """
+        times = {'opening': [], 'closing': []}
+        for movement in movements(self.records()):
+            travel = abs(movement['to'] - movement['from'])
+            if travel >= min_travel and movement['duration'] > 0:
+                times[movement['direction']].append(movement['duration'] * 100.0 / travel)
+        return {direction: round(sum(values) / len(values), 1) if values else None
+                for direction, values in times.items()}
+
+    def stats(self):
+        records = self.records()
+        reads = sum(1 for r in records if r[3] == SOURCE_GATEWAY)
+        errors = sum(1 for r in records if r[3] == SOURCE_ERROR)
+        travel = self.travel_times()
+        return {
+            'records': len(records),
+            'span': round(records[-1][0] - records[0][0]) if records else 0,
+            'commands': sum(1 for r in records if r[3] == SOURCE_COMMAND),
+            'reads': reads,
+            'errors': errors,
+            'error_rate': round(errors / (reads + errors), 3) if reads + errors else 0.0,
+            'movement_count': len(movements(records)),
+            'travel_open': travel['opening'],
+            'travel_close': travel['closing'],
+        }
+
+    def flush(self):
+        """
+        Rewrite the file if anything was recorded since the last flush; True if written
+        """
+        if not self.path:
+            return False
+        with self._lock:
+            if not self._dirty:
+                return False
+            image = bytes(self._image())
+            self._dirty = False
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as fh:
+            fh.write(image)
+        os.replace(tmp, self.path)
+        return True
+
+    def _load(self):
+        with open(self.path, 'rb') as fh:
+            image = fh.read()
+        records = list(iter_records(image))  # ValueError for foreign files
+        shift = HEADER.unpack_from(image, 0)[6] - (time.time() - time.monotonic())
+        for timestamp, position, state, source in records[-self.capacity:]:
+            self.record(position, state, source, timestamp + shift)
+        self._dirty = False
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print('usage: python3 -m libs.doorhistory <history file>')
+        return 2
+    with open(argv[0], 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as image:
+        offset = HEADER.unpack_from(image, 0)[6]
+        records = list(iter_records(image))
+    for timestamp, position, state, source in records:
+        print('%s  %4d%%  %-8s %s' % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp + offset)),
+                                      position, state or '-', SOURCES[source] if source < len(SOURCES) else source))
+    history = DoorHistory(capacity=max(len(records), 1))
+    for record in records:
+        history.record(record[1], record[2], record[3], record[0])
+    print(json.dumps(history.stats(), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
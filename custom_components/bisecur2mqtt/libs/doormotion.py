@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import deque
+
+"""
+Dead-reckoning of a moving door between gateway polls
+
+The gateway is only asked for the position every few seconds. DoorMotionEstimator
+keeps the last few real samples of one door, fits a constant-speed model to the
+samples of the current movement (least squares over (time, position)) and
+extrapolates from the newest sample:
+
+ - a repeated position means the door stopped: no estimate until it moves again
+ - a reversal starts a new fit from the last two samples
+ - the estimate is clamped to 0..100 and held after max_horizon seconds (or 1.5x
+   the current poll interval, if shorter) without a new sample, so a missed poll
+   does not run the door off into a made-up position
+ - no estimate once the newest sample is older than max_age (tracking stopped)
+
+A new real sample always replaces the estimate (observe() resets the anchor).
+"""
+
+
+class DoorMotionEstimator:
+    """
+    Thread-safe: observe() is called by the trackers/poll thread, estimate()
+    by the interpolation thread
+    """
+
+    def __init__(self, window=4, max_age=10.0, max_horizon=4.0):
+        self.window = window
+        self.max_age = max_age
+        self.max_horizon = max_horizon
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)  # (monotonic time, position) of the current movement
+        self._velocity = 0.0                  # percent per second, < 0 while closing
+        self._horizon = 0.0
+        self._position = None                 # newest real position
+
+    def observe(self, position, t=None):
+        """
+        Record a real position from the gateway
+        """
+        t = time.monotonic() if t is None else t
+        with self._lock:
+            samples = self._samples
+            while samples and t - samples[0][0] > self.max_age:
+                samples.popleft()
+            if samples:
+                last_pos = samples[-1][1]
+                if position == last_pos:
+                    samples.clear()  # stopped
+                elif len(samples) >= 2 and (position - last_pos) * self._velocity < 0:
+                    while len(samples) > 1:
+                        samples.popleft()  # reversed: only the turning point belongs to the new movement
+            samples.append((t, position))
+            self._position = position
+            self._fit()
+
+    def _fit(self):
+        samples = self._samples
+        if len(samples) < 2:
+            self._velocity = 0.0
+            return
+        n = len(samples)
+        mean_t = sum(s[0] for s in samples) / n
+        mean_p = sum(s[1] for s in samples) / n
+        var_t = sum((s[0] - mean_t) ** 2 for s in samples)
+        if var_t <= 0:
+            self._velocity = 0.0
+            return
+        self._velocity = sum((s[0] - mean_t) * (s[1] - mean_p) for s in samples) / var_t
+        interval = (samples[-1][0] - samples[0][0]) / (n - 1)
+        self._horizon = min(self.max_horizon, 1.5 * interval)
+
+    def estimate(self, t=None):
+        """
+        Estimated position now, or None if the door is not known to be moving
+        """
+        t = time.monotonic() if t is None else t
+        with self._lock:
+            if not self._velocity or not self._samples:
+                return None
+            last_t, last_pos = self._samples[-1]
+            if t - last_t > self.max_age:
+                return None  # nobody is polling this door any more
+            elapsed = min(max(t - last_t, 0.0), self._horizon)
+            return max(0.0, min(100.0, last_pos + self._velocity * elapsed))
+
+    @property
+    def position(self):
+        """
+        Newest real position (None before the first sample)
+        """
+        with self._lock:
+            return self._position
+
+    @property
+    def velocity(self):
+        with self._lock:
+            return self._velocity
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._velocity = 0.0
@@ -0,0 +1,101 @@
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime
+
+"""
+Non-blocking logging pipeline
+
+Callers (gateway thread holding gateway_lock, MQTT network thread, trackers) only
+put the LogRecord on a queue. Formatting and file I/O happen in the QueueListener
+thread:
+
+    logger --> LazyQueueHandler --> SimpleQueue --> QueueListener --+--> RotatingFileHandler / stderr (text)
+                                                                    +--> RotatingFileHandler (JSON lines)
+
+Records are queued unformatted, so arguments must not be mutated after the call
+(pass ints/str/bytes, not live dicts).
+"""
+
+# LogRecord attributes that are not user supplied `extra=` fields
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that defers message formatting to the listener thread
+    (the stock prepare() formats in the calling thread)
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line; `extra=` fields of the call are added as keys
+    """
+
+    def format(self, record):
+        t = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "file": record.filename,
+            "line": record.lineno,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                t[key] = value
+        if record.exc_info:
+            t["exc"] = self.formatException(record.exc_info)
+        return json.dumps(t, ensure_ascii=False, default=str)
+
+
+def _rotating(filename, max_bytes, backups):
+    return logging.handlers.RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backups,
+                                                encoding='utf-8', delay=True)
+
+
+def setup_logging(level, fmt, logfile=None, jsonfile=None, max_bytes=1024 * 1024, backups=3):
+    """
+    Replaces the root handlers with a queue fed writer thread and returns the started
+    QueueListener. Text goes to logfile (size rotated) or stderr, JSON lines to jsonfile.
+    """
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.setLevel(level)
+
+    if logfile:
+        text_handler = _rotating(logfile, max_bytes, backups)
+    else:
+        text_handler = logging.StreamHandler()
+    text_handler.setFormatter(logging.Formatter(fmt))
+    handlers = [text_handler]
+
+    if jsonfile:
+        json_handler = _rotating(jsonfile, max_bytes, backups)
+        json_handler.setFormatter(JsonFormatter())
+        handlers.append(json_handler)
+
+    q = queue.SimpleQueue()
+    root.addHandler(LazyQueueHandler(q))
+    listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging, listener)
+    return listener
+
+
+def stop_logging(listener):
+    """
+    Drains the queue and stops the writer thread (safe to call twice)
+    """
+    if listener._thread is not None:
+        listener.stop()
+    for handler in listener.handlers:
+        handler.flush()
@@ -0,0 +1,258 @@
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Eclipse Public License v2.0
+# and Eclipse Distribution License v1.0 which accompany this distribution.
+#
+# The Eclipse Public License is available at
+#    http://www.eclipse.org/legal/epl-v10.html
+# and the Eclipse Distribution License is available at
+#   http://www.eclipse.org/org/documents/edl-v10.php.
+
+"""
+This module drives a Client from an asyncio event loop instead of a network
+thread. The client socket is watched with loop.add_reader()/add_writer()
+through the on_socket_* callbacks and loop_misc() runs on a timer, so no
+loop_start()/loop_forever() thread is needed.
+
+    client = paho.Client("id")
+    aclient = AsyncClient(client)
+    await aclient.connect("localhost")
+    await aclient.subscribe("some/topic", 1)
+    await aclient.publish("some/topic", "payload", qos=1)
+    await aclient.disconnect()
+
+Callbacks (on_message, on_connect, ...) run in the event loop. publish() on
+the wrapped Client may still be called from other threads, socket
+registration is then handed over to the loop thread.
+"""
+from __future__ import absolute_import
+
+import asyncio
+
+from .. import mqtt
+from . import client as paho
+
+
+class AsyncioHelper(object):
+    """Connects the socket callbacks of a Client to an event loop."""
+
+    def __init__(self, loop, client, misc_interval=1.0):
+        self.loop = loop
+        self.client = client
+        self.misc_interval = misc_interval
+        self._misc = None
+
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+        # Socket opened before the helper was attached (connect() already called)
+        sock = client.socket()
+        if sock is not None:
+            self._on_socket_open(client, client.user_data_get(), sock)
+            if client.want_write():
+                self._on_socket_register_write(client, client.user_data_get(), sock)
+
+    def _in_loop(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def _call(self, func, *args):
+        if self._in_loop():
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call(self._open, sock)
+
+    def _open(self, sock):
+        self.loop.add_reader(sock, self.client.loop_read)
+        if self._misc is None:
+            self._misc = self.loop.call_later(self.misc_interval, self._loop_misc)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._call(self._close, sock)
+
+    def _close(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        if self._misc is not None:
+            self._misc.cancel()
+            self._misc = None
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call(self.loop.add_writer, sock, self._write)
+
+    def _write(self):
+        # Next batch of the publish queue (if any) goes out with this write
+        self.client.loop_queue()
+        self.client.loop_write()
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call(self.loop.remove_writer, sock)
+
+    def _loop_misc(self):
+        self._misc = None
+        if self.client.socket() is None:
+            return
+        # Covers a publish from another thread racing with unregister_write
+        if self.client.want_write():
+            self._write()
+        if self.client.loop_misc() == paho.MQTT_ERR_SUCCESS and self.client.socket() is not None:
+            self._misc = self.loop.call_later(self.misc_interval, self._loop_misc)
+
+    def detach(self):
+        sock = self.client.socket()
+        if sock is not None:
+            self._close(sock)
+        self.client.on_socket_open = None
+        self.client.on_socket_close = None
+        self.client.on_socket_register_write = None
+        self.client.on_socket_unregister_write = None
+
+
+class AsyncClient(object):
+    """Awaitable connect/publish/subscribe/unsubscribe/disconnect on top of a
+    Client driven by AsyncioHelper.
+
+    Callbacks already set on the client keep being called, after the
+    matching future has been resolved. Lost connections are re-established
+    with the client's reconnect_delay_set() backoff unless
+    reconnect_on_failure is off."""
+
+    def __init__(self, client, loop=None):
+        self.client = client
+        self.loop = loop or asyncio.get_event_loop()
+        self.helper = AsyncioHelper(self.loop, client)
+        self._connected = None
+        self._closed = self.loop.create_future()
+        self._pending = {}  # mid -> future, for publish/subscribe/unsubscribe
+        self._reconnect = None
+        self._user_disconnect = False
+
+        self._on_connect = client.on_connect
+        self._on_publish = client.on_publish
+        self._on_subscribe = client.on_subscribe
+        self._on_unsubscribe = client.on_unsubscribe
+        self._on_disconnect = client.on_disconnect
+        client.on_connect = self._handle_connect
+        client.on_publish = self._handle_publish
+        client.on_subscribe = self._handle_subscribe
+        client.on_unsubscribe = self._handle_unsubscribe
+        client.on_disconnect = self._handle_disconnect
+
+    def _handle_connect(self, client, userdata, flags, rc, *args):
+        if self._connected is not None and not self._connected.done():
+            if rc == paho.CONNACK_ACCEPTED:
+                self._connected.set_result(flags)
+            else:
+                self._connected.set_exception(mqtt.MQTTException(paho.connack_string(rc)))
+        if self._on_connect:
+            self._on_connect(client, userdata, flags, rc, *args)
+
+    def _resolve(self, mid, result):
+        future = self._pending.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    def _handle_publish(self, client, userdata, mid):
+        self._resolve(mid, mid)
+        if self._on_publish:
+            self._on_publish(client, userdata, mid)
+
+    def _handle_subscribe(self, client, userdata, mid, granted_qos, *args):
+        self._resolve(mid, granted_qos)
+        if self._on_subscribe:
+            self._on_subscribe(client, userdata, mid, granted_qos, *args)
+
+    def _handle_unsubscribe(self, client, userdata, mid, *args):
+        self._resolve(mid, args[1] if len(args) > 1 else None)
+        if self._on_unsubscribe:
+            self._on_unsubscribe(client, userdata, mid, *args)
+
+    def _handle_disconnect(self, client, userdata, rc, *args):
+        error = mqtt.MQTTException(paho.error_string(rc))
+        if self._connected is not None and not self._connected.done():
+            self._connected.set_exception(error)
+        if self._on_disconnect:
+            self._on_disconnect(client, userdata, rc, *args)
+
+        if self._user_disconnect or not client._reconnect_on_failure:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+            if not self._closed.done():
+                self._closed.set_result(rc)
+        elif self._reconnect is None:
+            # QoS>0 publish futures stay pending: the messages are resent after reconnecting
+            self._reconnect = self.loop.create_task(self._reconnect_loop())
+
+    async def _reconnect_loop(self):
+        try:
+            delay = self.client._reconnect_min_delay
+            while not self._user_disconnect:
+                await asyncio.sleep(delay)
+                try:
+                    self.client.reconnect()
+                    return
+                except (OSError, paho.WebsocketConnectionError):
+                    self.client._handle_on_connect_fail()
+                    delay = min(delay * 2, self.client._reconnect_max_delay)
+        finally:
+            self._reconnect = None
+
+    async def connect(self, host, port=1883, keepalive=60, **kwargs):
+        """Connect and wait for the CONNACK. Returns the CONNACK flags.
+
+        The TCP connect itself is blocking, as in Client.connect()."""
+        self._user_disconnect = False
+        if self._closed.done():
+            self._closed = self.loop.create_future()
+        self._connected = self.loop.create_future()
+        self.client.connect(host, port, keepalive, **kwargs)
+        return await self._connected
+
+    def _track(self, rc, mid):
+        if rc != paho.MQTT_ERR_SUCCESS:
+            raise mqtt.MQTTException(paho.error_string(rc))
+        future = self.loop.create_future()
+        self._pending[mid] = future
+        return future
+
+    async def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        """Publish and wait until the message is written (QoS 0) or
+        acknowledged (QoS 1 and 2). Returns the mid."""
+        info = self.client.publish(topic, payload, qos, retain, properties)
+        if info.is_published():
+            return info.mid
+        return await self._track(info.rc, info.mid)
+
+    async def subscribe(self, topic, qos=0, options=None, properties=None):
+        """Subscribe and wait for the SUBACK. Returns the granted QoS list
+        (reason codes for MQTT v5)."""
+        rc, mid = self.client.subscribe(topic, qos, options, properties)
+        return await self._track(rc, mid)
+
+    async def unsubscribe(self, topic, properties=None):
+        rc, mid = self.client.unsubscribe(topic, properties)
+        return await self._track(rc, mid)
+
+    async def disconnect(self, reasoncode=None, properties=None):
+        """Send DISCONNECT and wait until the socket is closed."""
+        self._user_disconnect = True
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+        rc = self.client.disconnect(reasoncode, properties)
+        if rc == paho.MQTT_ERR_SUCCESS:
+            await self._closed
+        elif not self._closed.done():
+            self._closed.set_result(rc)
+
+    async def wait_closed(self):
+        """Wait until disconnect() was called or the connection was lost with
+        reconnect_on_failure off. Returns the disconnect rc."""
+        return await self._closed
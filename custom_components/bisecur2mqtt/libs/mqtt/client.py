@@ -22,9 +22,10 @@ import sys
 import threading
 import time
 import uuid
+import zlib
 
 from .matcher import MQTTMatcher
-from .properties import Properties
+from .properties import Properties, VariableByteIntegers
 from .reasoncodes import ReasonCodes
 from .subscribeoptions import SubscribeOptions
 
@@ -37,7 +38,9 @@ import errno
 import os
 import platform
 import select
+import selectors
 import socket
+import weakref
 
 ssl = None
 try:
@@ -181,6 +184,23 @@ MQTT_CLEAN_START_FIRST_ONLY = 3
 
 sockpair_data = b"0"
 
+# Initial size of the inbound read-ahead buffer (grows for larger packets)
+_IN_BUFFER_SIZE = 16384
+
+# Loop engines, see Client.set_loop_engine()
+LOOP_ENGINE_SELECT = "select"
+LOOP_ENGINE_SELECTOR = "selector"
+
+# Publishes of a topic before it gets an MQTT v5 topic alias, and the number
+# of counted topics after which the counters start over
+_TOPIC_ALIAS_MIN_COUNT = 2
+_TOPIC_ALIAS_COUNT_LIMIT = 4096
+
+# Last TLS session per (host, port), per SSLContext: clients sharing a context
+# (tls_set_context() with the same object) resume each other's sessions
+_tls_sessions = weakref.WeakKeyDictionary()
+_tls_sessions_mutex = threading.Lock()
+
 
 class WebsocketConnectionError(ValueError):
     pass
@@ -294,6 +314,37 @@ def _socketpair_compat():
     return (sock1, sock2)
 
 
+class _InPacket(object):
+    """The inbound packet being handled: fixed header command byte,
+    remaining length and the variable header + payload bytes."""
+
+    __slots__ = 'command', 'remaining_length', 'packet', 'pos'
+
+    def __init__(self, command=0, remaining_length=0, packet=b""):
+        self.command = command
+        self.remaining_length = remaining_length
+        self.packet = packet
+        self.pos = 0
+
+
+class _OutPacket(object):
+    """An encoded packet waiting in Client._out_packet.
+
+    pos is the offset of the first byte not yet written to the socket,
+    to_process the number of bytes left."""
+
+    __slots__ = 'command', 'mid', 'qos', 'pos', 'to_process', 'packet', 'info'
+
+    def __init__(self, command, packet, mid, qos, info=None):
+        self.command = command
+        self.mid = mid
+        self.qos = qos
+        self.pos = 0
+        self.to_process = len(packet)
+        self.packet = packet
+        self.info = info
+
+
 class MQTTMessageInfo(object):
     """This is a class returned from Client.publish() and can be used to find
     out the mid of the message that was published, and to determine whether the
@@ -430,6 +481,362 @@ class MQTTMessage(object):
         self._topic = value
 
 
+class MQTTSessionStore(object):
+    """Persistence interface for the client side of an MQTT session.
+
+    Attach an implementation with Client.session_store_set(). The client then
+    reports every change to the messages it must not lose across a process
+    restart:
+
+    * outgoing QoS 1 and 2 messages, from publish() until PUBACK/PUBCOMP
+      (out_add, out_released when PUBREC arrives, out_remove)
+    * incoming QoS 2 messages, from PUBLISH until PUBREL (in_add, in_remove)
+
+    and calls load() once to restore them into a new client. The methods are
+    called with the client's message mutexes held, from publish() and from the
+    network loop, so they should not block for long.
+
+    topic and payload are bytes, properties is the packed MQTT v5 property
+    block of the message or b"".
+
+    This base class keeps nothing, use MQTTFileSessionStore or subclass it.
+    """
+
+    def load(self):
+        """Return (out_messages, in_messages), oldest first.
+
+        out_messages is a list of (mid, topic, payload, qos, retain, properties,
+        released) tuples, in_messages a list of (mid, topic, payload, qos,
+        retain, properties) tuples."""
+        return [], []
+
+    def out_add(self, mid, topic, payload, qos, retain, properties):
+        pass
+
+    def out_released(self, mid):
+        pass
+
+    def out_remove(self, mid):
+        pass
+
+    def in_add(self, mid, topic, payload, qos, retain, properties):
+        pass
+
+    def in_remove(self, mid):
+        pass
+
+    def in_clear(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MQTTFileSessionStore(MQTTSessionStore):
+    """Append-only log file session store.
+
+    Every change is one record appended to the file with a single write():
+    the data is in the operating system when the client call returns, so it
+    survives the process being killed or replaced (os.exec*). Set fsync to
+    True to also survive a power loss, at the cost of a disk sync per record.
+
+    The log is rewritten with only the pending messages when it holds more
+    than compact_threshold records that are no longer needed (and more of
+    them than live ones), and every time it is loaded. A torn record at the
+    end of the file, left by a crash in the middle of a write, is ignored.
+    """
+
+    _MAGIC = b"PAHOSES1"
+    # op, mid, body length ... body ... crc32 of header and body
+    _HEADER = struct.Struct("!BHI")
+    _CRC = struct.Struct("!I")
+    # qos, retain, topic length, properties length, then topic, properties, payload
+    _BODY = struct.Struct("!BBHI")
+
+    _OP_OUT = 1
+    _OP_OUT_RELEASED = 2
+    _OP_OUT_REMOVE = 3
+    _OP_IN = 4
+    _OP_IN_REMOVE = 5
+    _OP_IN_CLEAR = 6
+
+    def __init__(self, path, compact_threshold=1000, fsync=False):
+        self.path = path
+        self.compact_threshold = compact_threshold
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._file = None
+        # mid -> encoded record, in the order the messages were added
+        self._out = collections.OrderedDict()
+        self._released = set()
+        self._in = collections.OrderedDict()
+        self._dead = 0
+        self.compactions = 0
+
+    def _encode(self, op, mid, body=b""):
+        record = bytearray(self._HEADER.pack(op, mid, len(body)))
+        record += body
+        record += self._CRC.pack(zlib.crc32(record))
+        return bytes(record)
+
+    def _encode_message(self, op, mid, topic, payload, qos, retain, properties):
+        body = bytearray(self._BODY.pack(qos, 1 if retain else 0, len(topic), len(properties)))
+        body += topic
+        body += properties
+        body += payload
+        return self._encode(op, mid, body)
+
+    def _decode_message(self, body):
+        qos, retain, topic_len, props_len = self._BODY.unpack_from(body)
+        start = self._BODY.size
+        topic = bytes(body[start:start + topic_len])
+        start += topic_len
+        properties = bytes(body[start:start + props_len])
+        payload = bytes(body[start + props_len:])
+        return topic, payload, qos, bool(retain), properties
+
+    def _append(self, record):
+        if self._file is None:
+            self._open()
+        self._file.write(record)
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _open(self):
+        self._file = open(self.path, "ab", buffering=0)
+        if self._file.tell() == 0:
+            self._file.write(self._MAGIC)
+
+    def _replay(self, data):
+        """Rebuild the pending messages from the log contents"""
+        view = memoryview(data)
+        if bytes(view[:len(self._MAGIC)]) != self._MAGIC:
+            return
+        pos = len(self._MAGIC)
+        header_size = self._HEADER.size
+        while pos + header_size + self._CRC.size <= len(view):
+            op, mid, length = self._HEADER.unpack_from(view, pos)
+            end = pos + header_size + length
+            if end + self._CRC.size > len(view):
+                break
+            crc, = self._CRC.unpack_from(view, end)
+            if crc != zlib.crc32(view[pos:end]):
+                break
+            if op == self._OP_OUT:
+                self._out.pop(mid, None)
+                self._released.discard(mid)
+                self._out[mid] = bytes(view[pos:end + self._CRC.size])
+            elif op == self._OP_OUT_RELEASED:
+                if mid in self._out:
+                    self._released.add(mid)
+            elif op == self._OP_OUT_REMOVE:
+                self._out.pop(mid, None)
+                self._released.discard(mid)
+            elif op == self._OP_IN:
+                self._in.pop(mid, None)
+                self._in[mid] = bytes(view[pos:end + self._CRC.size])
+            elif op == self._OP_IN_REMOVE:
+                self._in.pop(mid, None)
+            elif op == self._OP_IN_CLEAR:
+                self._in.clear()
+            pos = end + self._CRC.size
+
+    def load(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._out.clear()
+            self._released.clear()
+            self._in.clear()
+            try:
+                with open(self.path, "rb") as f:
+                    self._replay(f.read())
+            except FileNotFoundError:
+                pass
+            self._compact()
+
+            out_messages = []
+            header_size = self._HEADER.size
+            for mid, record in self._out.items():
+                message = self._decode_message(memoryview(record)[header_size:-self._CRC.size])
+                out_messages.append((mid,) + message + (mid in self._released,))
+            in_messages = []
+            for mid, record in self._in.items():
+                in_messages.append((mid,) + self._decode_message(memoryview(record)[header_size:-self._CRC.size]))
+            return out_messages, in_messages
+
+    def _compact(self):
+        """Rewrite the log with the pending messages only"""
+        records = bytearray(self._MAGIC)
+        for mid, record in self._out.items():
+            records += record
+            if mid in self._released:
+                records += self._encode(self._OP_OUT_RELEASED, mid)
+        for record in self._in.values():
+            records += record
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(records)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._dead = 0
+        self.compactions += 1
+
+    def _retire(self, count=1):
+        self._dead += count
+        if self._dead >= self.compact_threshold and self._dead > len(self._out) + len(self._in):
+            self._compact()
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def out_add(self, mid, topic, payload, qos, retain, properties):
+        record = self._encode_message(self._OP_OUT, mid, topic, payload, qos, retain, properties)
+        with self._lock:
+            if self._out.pop(mid, None) is not None:
+                self._released.discard(mid)
+                self._dead += 1
+            self._out[mid] = record
+            self._append(record)
+
+    def out_released(self, mid):
+        with self._lock:
+            if mid in self._out and mid not in self._released:
+                self._released.add(mid)
+                self._append(self._encode(self._OP_OUT_RELEASED, mid))
+
+    def out_remove(self, mid):
+        with self._lock:
+            if self._out.pop(mid, None) is None:
+                return
+            dead = 2
+            if mid in self._released:
+                self._released.discard(mid)
+                dead = 3
+            self._append(self._encode(self._OP_OUT_REMOVE, mid))
+            self._retire(dead)
+
+    def in_add(self, mid, topic, payload, qos, retain, properties):
+        record = self._encode_message(self._OP_IN, mid, topic, payload, qos, retain, properties)
+        with self._lock:
+            if self._in.pop(mid, None) is not None:
+                self._dead += 1
+            self._in[mid] = record
+            self._append(record)
+
+    def in_remove(self, mid):
+        with self._lock:
+            if self._in.pop(mid, None) is None:
+                return
+            self._append(self._encode(self._OP_IN_REMOVE, mid))
+            self._retire(2)
+
+    def in_clear(self):
+        with self._lock:
+            if not self._in:
+                return
+            count = len(self._in)
+            self._in.clear()
+            self._append(self._encode(self._OP_IN_CLEAR, 0))
+            self._retire(count + 1)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._out) + len(self._in)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class MQTTPublishQueue(object):
+    """Bounded, thread-safe queue of messages waiting for the network loop.
+
+    Messages are kept in lanes, lane 0 first: take() empties lane 0 before it
+    looks at lane 1 and so on, in order within a lane. When maxsize messages
+    are queued, put() drops the oldest message of the last non-empty lane at
+    or after the lane of the new message; the new message itself is refused
+    if all queued messages are in earlier lanes.
+
+    Used through Client.publish_queue_set() and Client.publish_queued().
+    """
+
+    def __init__(self, maxsize=1000, lanes=3):
+        if lanes < 1:
+            raise ValueError('lanes must be at least 1.')
+        self.maxsize = maxsize
+        self._lanes = tuple(collections.deque() for _ in range(lanes))
+        self._size = 0
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.dropped = 0
+        self.batches = 0
+
+    @property
+    def lanes(self):
+        return len(self._lanes)
+
+    def put(self, topic, payload=None, qos=0, retain=False, properties=None, lane=-1):
+        """Queue a message, returns False if it was refused."""
+        queue = self._lanes[lane]
+        with self._lock:
+            if self.maxsize > 0 and self._size >= self.maxsize:
+                last = lane % len(self._lanes)
+                for victim in reversed(self._lanes[last:]):
+                    if victim:
+                        victim.popleft()
+                        self._size -= 1
+                        self.dropped += 1
+                        break
+                else:
+                    self.dropped += 1
+                    return False
+            queue.append((topic, payload, qos, retain, properties))
+            self._size += 1
+            self.queued += 1
+            return True
+
+    def take(self, count=0):
+        """Remove and return up to count messages (all if count is 0) as a
+        list of (topic, payload, qos, retain, properties), lane 0 first."""
+        with self._lock:
+            if not self._size:
+                return []
+            if count <= 0 or count > self._size:
+                count = self._size
+            batch = []
+            for queue in self._lanes:
+                while queue and len(batch) < count:
+                    batch.append(queue.popleft())
+                if len(batch) == count:
+                    break
+            self._size -= len(batch)
+            self.batches += 1
+            return batch
+
+    def __len__(self):
+        return self._size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": [len(queue) for queue in self._lanes],
+                "queued": self.queued,
+                "dropped": self.dropped,
+                "batches": self.batches,
+            }
+
+
 class Client(object):
     """MQTT version 3.1/3.1.1/5.0 client class.
 
@@ -561,16 +968,23 @@ class Client(object):
 
         self._username = None
         self._password = None
-        self._in_packet = {
-            "command": 0,
-            "have_remaining": 0,
-            "remaining_count": [],
-            "remaining_mult": 1,
-            "remaining_length": 0,
-            "packet": bytearray(b""),
-            "to_process": 0,
-            "pos": 0}
+        self._in_packet = _InPacket()
+        # Read-ahead buffer: bytes [_in_start:_in_end] are received but not
+        # yet handled (an incomplete packet)
+        self._in_buffer = bytearray(_IN_BUFFER_SIZE)
+        self._in_start = 0
+        self._in_end = 0
         self._out_packet = collections.deque()
+        # Max packets gathered into a single send()/sendmsg() by _packet_write
+        self._write_batch = 64
+        # Set when a wake-up byte is in flight to sockpairR: further publishes
+        # from other threads don't need to send another one
+        self._wake_pending = False
+        self._loop_engine = LOOP_ENGINE_SELECT
+        self._selector = None
+        self._selector_sock = None
+        self._selector_wake = None
+        self._selector_write = False
         self._last_msg_in = time_func()
         self._last_msg_out = time_func()
         self._reconnect_min_delay = 1
@@ -584,7 +998,22 @@ class Client(object):
         self._in_messages = collections.OrderedDict()
         self._max_inflight_messages = 20
         self._inflight_messages = 0
+        # mids of _out_messages in state mqtt_ms_queued, oldest first
+        self._queued_mids = collections.deque()
+        # MQTT v5 topic aliases, see topic_alias_auto_set()
+        self._topic_alias_auto = True
+        self._topic_alias_maximum = 0
+        self._topic_aliases = {}
+        self._topic_publish_counts = {}
+        self._topic_alias_mutex = threading.Lock()
+        self._topic_alias_bytes_saved = 0
+        self._topic_alias_publishes = 0
         self._max_queued_messages = 0
+        # see session_store_set()
+        self._session_store = None
+        # see publish_queue_set()
+        self._publish_queue = None
+        self._publish_queue_batch = 64
         self._connect_properties = None
         self._will_properties = None
         self._will = False
@@ -592,7 +1021,7 @@ class Client(object):
         self._will_payload = b""
         self._will_qos = 0
         self._will_retain = False
-        self._on_message_filtered = MQTTMatcher()
+        self._on_message_filtered = MQTTMatcher(cache_size=1024)
         self._host = ""
         self._port = 1883
         self._bind_address = ""
@@ -611,6 +1040,8 @@ class Client(object):
         self._ssl_context = None
         # Only used when SSL context does not have check_hostname attribute
         self._tls_insecure = False
+        self._tls_resumption = True
+        self._tls_session_reused = False
         self._logger = None
         self._registered_write = False
         # No default callbacks
@@ -644,6 +1075,20 @@ class Client(object):
             self._call_socket_register_write()
             raise BlockingIOError
 
+    def _sock_recv_into(self, view):
+        try:
+            if hasattr(self._sock, 'recv_into'):
+                return self._sock.recv_into(view)
+            # WebsocketWrapper
+            data = self._sock.recv(len(view))
+            view[:len(data)] = data
+            return len(data)
+        except ssl.SSLWantReadError:
+            raise BlockingIOError
+        except ssl.SSLWantWriteError:
+            self._call_socket_register_write()
+            raise BlockingIOError
+
     def _sock_send(self, buf):
         try:
             return self._sock.send(buf)
@@ -656,6 +1101,22 @@ class Client(object):
             self._call_socket_register_write()
             raise BlockingIOError
 
+    def _sock_sendv(self, bufs):
+        """Write several buffers with one system call.
+
+        Plain sockets use scatter/gather sendmsg(); TLS and websocket
+        sockets get a single joined buffer."""
+        if len(bufs) == 1:
+            return self._sock_send(bufs[0])
+        sock = self._sock
+        if not hasattr(sock, 'sendmsg') or (ssl is not None and isinstance(sock, ssl.SSLSocket)):
+            return self._sock_send(b''.join(bufs))
+        try:
+            return sock.sendmsg(bufs)
+        except BlockingIOError:
+            self._call_socket_register_write()
+            raise BlockingIOError
+
     def _sock_close(self):
         """Close the connection to the server."""
         if not self._sock:
@@ -680,6 +1141,8 @@ class Client(object):
         if self._sockpairW:
             self._sockpairW.close()
             self._sockpairW = None
+        # A wake byte left in the old pair must not block wake-ups on the next one
+        self._wake_pending = False
 
     def reinitialise(self, client_id="", clean_session=True, userdata=None):
         self._reset_sockets()
@@ -845,6 +1308,72 @@ class Client(object):
             # If verify_mode is CERT_NONE then the host name will never be checked
             self._ssl_context.check_hostname = not value
 
+    def tls_resumption_set(self, value):
+        """Enable or disable TLS session resumption (enabled by default).
+
+        The session of the last successful connection is offered on the next
+        connect()/reconnect() to the same host and port, which turns the
+        handshake into an abbreviated one if the broker accepts it. Sessions
+        are kept per SSLContext, so clients configured with the same context
+        through tls_set_context() share them."""
+        self._tls_resumption = bool(value)
+
+    def tls_session_reused(self):
+        """True if the TLS handshake of the current (or last) connection
+        resumed an earlier session."""
+        return self._tls_session_reused
+
+    def topic_alias_auto_set(self, value):
+        """Enable or disable automatic MQTT v5 topic aliases (enabled by
+        default, only used with MQTTv5 and a broker announcing a
+        TopicAliasMaximum in CONNACK).
+
+        Topics published more than once get an alias, up to the broker's
+        maximum; when all are in use, the alias of the least published topic
+        is moved to a more frequently published one. Following publishes to
+        that topic send the two byte alias instead of the topic string.
+        Aliases start over on every connection. Publishes with an explicit
+        TopicAlias property are left alone."""
+        self._topic_alias_auto = bool(value)
+
+    def topic_alias_stats(self):
+        """Returns a dict with the broker's TopicAliasMaximum ('maximum'), the
+        aliases assigned on this connection ('assigned'), the publishes sent
+        with an alias instead of the topic ('aliased_publishes') and the net
+        number of bytes saved on the wire ('bytes_saved'), counted since the
+        client was created."""
+        with self._topic_alias_mutex:
+            return {
+                'maximum': self._topic_alias_maximum,
+                'assigned': len(self._topic_aliases),
+                'aliased_publishes': self._topic_alias_publishes,
+                'bytes_saved': self._topic_alias_bytes_saved,
+            }
+
+    def _tls_session_get(self):
+        if not self._tls_resumption:
+            return None
+        with _tls_sessions_mutex:
+            sessions = _tls_sessions.get(self._ssl_context)
+            if sessions is None:
+                return None
+            return sessions.get((self._host, self._port))
+
+    def _tls_session_save(self):
+        # Called once the broker has answered: TLS 1.3 tickets are sent after
+        # the handshake and only show up in sock.session after a read.
+        if not self._ssl or not self._tls_resumption:
+            return
+        sock = self._sock
+        if isinstance(sock, WebsocketWrapper):
+            sock = sock._socket
+        session = getattr(sock, 'session', None)
+        if session is None:
+            return
+        with _tls_sessions_mutex:
+            sessions = _tls_sessions.setdefault(self._ssl_context, {})
+            sessions[(self._host, self._port)] = session
+
     def proxy_set(self, **proxy_args):
         """Configure proxying of MQTT connection. Enables support for SOCKS or
         HTTP proxies.
@@ -1017,17 +1546,18 @@ class Client(object):
         if self._port <= 0:
             raise ValueError('Invalid port number.')
 
-        self._in_packet = {
-            "command": 0,
-            "have_remaining": 0,
-            "remaining_count": [],
-            "remaining_mult": 1,
-            "remaining_length": 0,
-            "packet": bytearray(b""),
-            "to_process": 0,
-            "pos": 0}
+        self._in_packet = _InPacket()
+        self._in_buffer = bytearray(_IN_BUFFER_SIZE)
+        self._in_start = 0
+        self._in_end = 0
 
-        self._out_packet = collections.deque()
+        # Aliases only live as long as the network connection. Reset them
+        # together with the queue, under the lock publish() queues aliased
+        # packets with, so none reaches the new connection.
+        with self._topic_alias_mutex:
+            self._topic_alias_maximum = 0
+            self._topic_aliases = {}
+            self._out_packet = collections.deque()
 
         with self._msgtime_mutex:
             self._last_msg_in = time_func()
@@ -1042,17 +1572,25 @@ class Client(object):
         self._messages_reconnect_reset()
 
         sock = self._create_socket_connection()
+        try:
+            # Otherwise Nagle holds CONNECT back behind the last handshake
+            # flight (most visible with an abbreviated TLS 1.2 handshake)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            pass
 
         if self._ssl:
             # SSL is only supported when SSLContext is available (implies Python >= 2.7.9 or >= 3.2)
 
             verify_host = not self._tls_insecure
+            session = self._tls_session_get()
             try:
                 # Try with server_hostname, even it's not supported in certain scenarios
                 sock = self._ssl_context.wrap_socket(
                     sock,
                     server_hostname=self._host,
                     do_handshake_on_connect=False,
+                    session=session,
                 )
             except ssl.CertificateError:
                 # CertificateError is derived from ValueError
@@ -1062,6 +1600,7 @@ class Client(object):
                 sock = self._ssl_context.wrap_socket(
                     sock,
                     do_handshake_on_connect=False,
+                    session=session,
                 )
             else:
                 # If SSL context has already checked hostname, then don't need to do it again
@@ -1071,6 +1610,9 @@ class Client(object):
 
             sock.settimeout(self._keepalive)
             sock.do_handshake()
+            self._tls_session_reused = sock.session_reused
+            if self._tls_session_reused:
+                self._easy_log(MQTT_LOG_DEBUG, "TLS session resumed")
 
             if verify_host:
                 ssl.match_hostname(sock.getpeercert(), self._host)
@@ -1116,18 +1658,37 @@ class Client(object):
         if self._sockpairR is None or self._sockpairW is None:
             self._reset_sockets(sockpair_only=True)
             self._sockpairR, self._sockpairW = _socketpair_compat()
+            self._wake_pending = False
 
         return self._loop(timeout)
 
+    def set_loop_engine(self, engine=LOOP_ENGINE_SELECTOR):
+        """Choose how loop(), loop_forever() and loop_start() wait for events.
+
+        LOOP_ENGINE_SELECT (default) calls select.select() with fresh socket
+        lists on every iteration.
+
+        LOOP_ENGINE_SELECTOR keeps the socket registered in a
+        selectors.DefaultSelector (epoll on Linux) and only changes the write
+        interest when the outgoing queue becomes empty or non-empty.
+
+        Call this before starting the loop."""
+        if engine not in (LOOP_ENGINE_SELECT, LOOP_ENGINE_SELECTOR):
+            raise ValueError('Invalid loop engine.')
+        self._loop_engine = engine
+
     def _loop(self, timeout=1.0):
+        self.loop_queue()
+
+        if self._loop_engine == LOOP_ENGINE_SELECTOR:
+            return self._loop_selector(timeout)
+
         if timeout < 0.0:
             raise ValueError('Invalid timeout.')
 
-        try:
-            packet = self._out_packet.popleft()
-            self._out_packet.appendleft(packet)
+        if self._out_packet:
             wlist = [self._sock]
-        except IndexError:
+        else:
             wlist = []
 
         # used to check if there are any bytes left in the (SSL) socket
@@ -1176,6 +1737,8 @@ class Client(object):
                 self._sockpairR.recv(10000)
             except BlockingIOError:
                 pass
+            # Only after draining: a publisher racing with us sends a new byte
+            self._wake_pending = False
 
         if self._sock in socklist[1]:
             rc = self.loop_write()
@@ -1184,6 +1747,106 @@ class Client(object):
 
         return self.loop_misc()
 
+    def _selector_sync(self):
+        """(Re)register the current network socket and sockpairR with the
+        selector. Only does work after a (re)connect or loop_start()."""
+        if self._selector is None:
+            self._selector = selectors.DefaultSelector()
+
+        if self._selector_sock is not self._sock:
+            if self._selector_sock is not None:
+                try:
+                    self._selector.unregister(self._selector_sock)
+                except (KeyError, ValueError, OSError):
+                    pass
+            self._selector_sock = None
+            self._selector_write = False
+            if self._sock is not None:
+                self._selector.register(self._sock, selectors.EVENT_READ)
+                self._selector_sock = self._sock
+
+        if self._selector_wake is not self._sockpairR:
+            if self._selector_wake is not None:
+                try:
+                    self._selector.unregister(self._selector_wake)
+                except (KeyError, ValueError, OSError):
+                    pass
+            self._selector_wake = None
+            if self._sockpairR is not None:
+                self._selector.register(self._sockpairR, selectors.EVENT_READ, sockpair_data)
+                self._selector_wake = self._sockpairR
+
+    def _loop_selector(self, timeout=1.0):
+        if timeout < 0.0:
+            raise ValueError('Invalid timeout.')
+
+        try:
+            self._selector_sync()
+        except (ValueError, OSError):
+            return MQTT_ERR_CONN_LOST
+        if self._sock is None:
+            return MQTT_ERR_CONN_LOST
+
+        # Write interest only changes when the queue becomes empty/non-empty
+        want_write = bool(self._out_packet)
+        if want_write != self._selector_write:
+            try:
+                self._selector.modify(
+                    self._sock, selectors.EVENT_READ | selectors.EVENT_WRITE if want_write else selectors.EVENT_READ)
+            except (KeyError, ValueError, OSError):
+                return MQTT_ERR_CONN_LOST
+            self._selector_write = want_write
+
+        # used to check if there are any bytes left in the (SSL) socket
+        pending_bytes = 0
+        if hasattr(self._sock, 'pending'):
+            pending_bytes = self._sock.pending()
+
+        # if bytes are pending do not wait in select
+        if pending_bytes > 0:
+            timeout = 0.0
+
+        try:
+            events = self._selector.select(timeout)
+        except (ValueError, OSError):
+            return MQTT_ERR_CONN_LOST
+        except Exception:
+            # Note that KeyboardInterrupt, etc. can still terminate since they
+            # are not derived from Exception
+            return MQTT_ERR_UNKNOWN
+
+        readable = pending_bytes > 0
+        writable = False
+        woken = False
+        for key, mask in events:
+            if key.data is sockpair_data:
+                woken = True
+            else:
+                readable = readable or bool(mask & selectors.EVENT_READ)
+                writable = writable or bool(mask & selectors.EVENT_WRITE)
+
+        if readable:
+            rc = self.loop_read()
+            if rc or self._sock is None:
+                return rc
+
+        if woken:
+            # A publish from another thread: write right away instead of
+            # waiting for the next EVENT_WRITE
+            writable = True
+            try:
+                self._sockpairR.recv(10000)
+            except BlockingIOError:
+                pass
+            self._wake_pending = False
+
+        if writable:
+            rc = self.loop_write()
+            if rc or self._sock is None:
+                return rc
+
+        return self.loop_misc()
+
     def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
         """Publish a message on a topic.
 
@@ -1277,6 +1940,9 @@ class Client(object):
                     return message.info
 
                 self._out_messages[message.mid] = message
+                if self._session_store is not None:
+                    self._session_store.out_add(message.mid, topic, message.payload, qos, retain,
+                                                self._session_store_properties(properties))
                 if self._max_inflight_messages == 0 or self._inflight_messages < self._max_inflight_messages:
                     self._inflight_messages += 1
                     if qos == 1:
@@ -1296,6 +1962,7 @@ class Client(object):
                     return message.info
                 else:
                     message.state = mqtt_ms_queued
+                    self._queued_mids.append(message.mid)
                     message.info.rc = MQTT_ERR_SUCCESS
                     return message.info
 
@@ -1546,18 +2213,10 @@ class Client(object):
         if self._sock is None:
             return MQTT_ERR_NO_CONN
 
-        max_packets = len(self._out_messages) + len(self._in_messages)
-        if max_packets < 1:
-            max_packets = 1
-
-        for _ in range(0, max_packets):
-            if self._sock is None:
-                return MQTT_ERR_NO_CONN
-            rc = self._packet_read()
-            if rc > 0:
-                return self._loop_rc_handle(rc)
-            elif rc == MQTT_ERR_AGAIN:
-                return MQTT_ERR_SUCCESS
+        # _packet_read() handles every complete packet received so far
+        rc = self._packet_read()
+        if rc > 0:
+            return self._loop_rc_handle(rc)
         return MQTT_ERR_SUCCESS
 
     def loop_write(self, max_packets=1):
@@ -1591,12 +2250,35 @@ class Client(object):
         """Call to determine if there is network data waiting to be written.
         Useful if you are calling select() yourself rather than using loop().
         """
-        try:
-            packet = self._out_packet.popleft()
-            self._out_packet.appendleft(packet)
+        if self._out_packet:
             return True
-        except IndexError:
-            return False
+        return bool(self._publish_queue) and self._state == mqtt_cs_connected
+
+    def loop_queue(self):
+        """Move the next batch of messages from the publish queue (see
+        publish_queue_set()) into the client. Call before loop_write() if you
+        are not using loop(), loop_forever() or loop_start().
+
+        Messages stay queued while the client is not connected."""
+        queue = self._publish_queue
+        if not queue or self._state != mqtt_cs_connected:
+            return MQTT_ERR_SUCCESS
+
+        batch = queue.take(self._publish_queue_batch)
+        # publish() must not write each message on its own: the batch goes
+        # out with the next loop_write()
+        with self._in_callback_mutex:
+            for topic, payload, qos, retain, properties in batch:
+                try:
+                    self.publish(topic, payload, qos, retain, properties)
+                except (ValueError, TypeError) as err:
+                    self._easy_log(MQTT_LOG_ERR, 'Dropped queued message for %s: %s', topic, err)
+        if queue:
+            # Come back for the next batch once this one is written
+            self._loop_wake()
+        if self._thread is None and self._sockpairW is None and self._on_socket_register_write is None:
+            return self.loop_write()
+        return MQTT_ERR_SUCCESS
 
     def loop_misc(self):
         """Process miscellaneous network events. Use in place of calling loop() if you
@@ -1642,6 +2324,116 @@ class Client(object):
         self._max_queued_messages = queue_size
         return self
 
+    def session_store_set(self, store):
+        """Persist the session state that must survive a restart of the process.
+
+        store is an MQTTSessionStore, for example MQTTFileSessionStore(path).
+        Outgoing QoS 1 and 2 messages that were not yet acknowledged and
+        incoming QoS 2 messages that were not yet released when the previous
+        process stopped are restored from it, and resent or completed on the
+        next connect(). Only useful with clean_session=False (clean_start=False
+        for MQTT v5): a clean session makes the broker forget its half.
+
+        Must be called before connect(). Returns the number of restored
+        messages. Set to None to stop persisting."""
+        if self._state == mqtt_cs_connected:
+            raise ValueError('session_store_set() must be called before connect().')
+        self._session_store = store
+        if store is None:
+            return 0
+
+        out_messages, in_messages = store.load()
+        with self._out_message_mutex:
+            for mid, topic, payload, qos, retain, properties, released in out_messages:
+                message = self._session_store_message(mid, topic, payload, qos, retain, properties)
+                # It may have reached the broker already
+                message.dup = True
+                if released:
+                    message.state = mqtt_ms_wait_for_pubcomp
+                elif qos == 1:
+                    message.state = mqtt_ms_wait_for_puback
+                else:
+                    message.state = mqtt_ms_wait_for_pubrec
+                self._out_messages.pop(mid, None)
+                self._out_messages[mid] = message
+                # continue the message ids after the newest restored message
+                self._last_mid = mid
+        with self._in_message_mutex:
+            for mid, topic, payload, qos, retain, properties in in_messages:
+                message = self._session_store_message(mid, topic, payload, qos, retain, properties)
+                message.state = mqtt_ms_wait_for_pubrel
+                self._in_messages[mid] = message
+
+        restored = len(out_messages) + len(in_messages)
+        if restored:
+            self._easy_log(
+                MQTT_LOG_INFO, "Restored %d outgoing and %d incoming messages from the session store",
+                len(out_messages), len(in_messages))
+        return restored
+
+    def _session_store_message(self, mid, topic, payload, qos, retain, properties):
+        message = MQTTMessage(mid, topic)
+        message.payload = payload
+        message.qos = qos
+        message.retain = retain
+        message.properties = None
+        if properties:
+            message.properties = Properties(PUBLISH >> 4)
+            message.properties.unpack(properties)
+        return message
+
+    @staticmethod
+    def _session_store_properties(properties):
+        if properties is None:
+            return b""
+        return bytes(properties.pack())
+
+    def publish_queue_set(self, maxsize=1000, lanes=3, batch=64):
+        """Route publish_queued() through a bounded queue with priority lanes.
+
+        publish_queued() may be called from any thread: it only queues the
+        message and wakes the network loop, which moves up to batch messages
+        at a time into the client (lane 0 first) and writes them together.
+        maxsize bounds the queue, see MQTTPublishQueue for what is dropped
+        when it is full. Queued messages wait while the client is not
+        connected; publish_queue_take() hands them back.
+
+        Returns the MQTTPublishQueue, for its stats()."""
+        self._publish_queue = MQTTPublishQueue(maxsize, lanes)
+        self._publish_queue_batch = batch
+        return self._publish_queue
+
+    def publish_queued(self, topic, payload=None, qos=0, retain=False, properties=None, lane=-1):
+        """Queue a message for the network loop, in lane (0 is sent first,
+        default: the last lane). Arguments as for publish().
+
+        Without publish_queue_set() this is publish(). Returns True if the
+        message was queued, False if the queue was full."""
+        queue = self._publish_queue
+        if queue is None:
+            return self.publish(topic, payload, qos, retain, properties).rc == MQTT_ERR_SUCCESS
+        if qos < 0 or qos > 2:
+            raise ValueError('Invalid QoS level.')
+        if not queue.put(topic, payload, qos, retain, properties, lane):
+            return False
+        if self._state == mqtt_cs_connected:
+            if self._sockpairW is not None:
+                self._loop_wake()
+            elif self._on_socket_register_write is not None:
+                self._call_socket_register_write()
+            elif self._in_callback_mutex.acquire(False):
+                # No network loop to wake: send right away
+                self._in_callback_mutex.release()
+                self.loop_queue()
+        return True
+
+    def publish_queue_take(self):
+        """Remove and return all queued messages as a list of
+        (topic, payload, qos, retain, properties), lane 0 first."""
+        if self._publish_queue is None:
+            return []
+        return self._publish_queue.take()
+
     def message_retry_set(self, retry):
         """No longer used, remove in version 2.0"""
         pass
@@ -1733,6 +2525,11 @@ class Client(object):
 
         run = True
 
+        if self._publish_queue is not None and self._sockpairR is None:
+            # publish_queued() from other threads wakes the loop through it
+            self._sockpairR, self._sockpairW = _socketpair_compat()
+            self._wake_pending = False
+
         while run:
             if self._thread_terminate is True:
                 break
@@ -1793,6 +2590,7 @@ class Client(object):
             return MQTT_ERR_INVAL
 
         self._sockpairR, self._sockpairW = _socketpair_compat()
+        self._wake_pending = False
         self._thread_terminate = False
         self._thread = threading.Thread(target=self._thread_main)
         self._thread.daemon = True
@@ -2352,165 +3150,153 @@ class Client(object):
         return rc
 
     def _packet_read(self):
-        # This gets called if pselect() indicates that there is network data
-        # available - ie. at least one byte.  What we do depends on what data we
-        # already have.
-        # If we've not got a command, attempt to read one and save it. This should
-        # always work because it's only a single byte.
-        # Then try to read the remaining length. This may fail because it is may
-        # be more than one byte - will need to save data pending next read if it
-        # does fail.
-        # Then try to read the remaining payload, where 'payload' here means the
-        # combined variable header and actual payload. This is the most likely to
-        # fail due to longer length, so save current data and current position.
-        # After all data is read, send to _mqtt_handle_packet() to deal with.
-        # Finally, free the memory and reset everything to starting conditions.
-        if self._in_packet['command'] == 0:
-            try:
-                command = self._sock_recv(1)
-            except BlockingIOError:
-                return MQTT_ERR_AGAIN
-            except ConnectionError as err:
-                self._easy_log(
-                    MQTT_LOG_ERR, 'failed to receive on socket: %s', err)
-                return MQTT_ERR_CONN_LOST
-            else:
-                if len(command) == 0:
-                    return MQTT_ERR_CONN_LOST
-                command, = struct.unpack("!B", command)
-                self._in_packet['command'] = command
+        # This gets called if select() indicates that there is network data
+        # available - ie. at least one byte. Pull whatever the socket has into
+        # the read-ahead buffer with a single recv_into(), then hand every
+        # complete packet in it to _packet_handle(). An incomplete packet at
+        # the end stays in the buffer until the next call; the buffer grows
+        # if that packet does not fit.
+        buf = self._in_buffer
+        start, end = self._in_start, self._in_end
+        if start == end:
+            start = end = 0
+            if len(buf) > _IN_BUFFER_SIZE:
+                # Release the space taken by a big packet
+                buf = self._in_buffer = bytearray(_IN_BUFFER_SIZE)
+        elif end == len(buf):
+            buf[:end - start] = buf[start:end]
+            end -= start
+            start = 0
+            if end == len(buf):
+                buf.extend(bytes(len(buf)))
+        self._in_start, self._in_end = start, end
+
+        try:
+            with memoryview(buf) as view:
+                count = self._sock_recv_into(view[end:])
+        except BlockingIOError:
+            return MQTT_ERR_AGAIN
+        except ConnectionError as err:
+            self._easy_log(
+                MQTT_LOG_ERR, 'failed to receive on socket: %s', err)
+            return MQTT_ERR_CONN_LOST
+        if count == 0:
+            return MQTT_ERR_CONN_LOST
+        end += count
+        self._in_end = end
+
+        with self._msgtime_mutex:
+            self._last_msg_in = time_func()
 
-        if self._in_packet['have_remaining'] == 0:
-            # Read remaining
+        rc = MQTT_ERR_SUCCESS
+        while end - start >= 2:
+            # Fixed header: command byte and 1-4 bytes of remaining length.
             # Algorithm for decoding taken from pseudo code at
             # http://publib.boulder.ibm.com/infocenter/wmbhelp/v6r0m0/topic/com.ibm.etools.mft.doc/ac10870_.htm
+            remaining_length = 0
+            mult = 1
+            pos = start + 1
             while True:
-                try:
-                    byte = self._sock_recv(1)
-                except BlockingIOError:
-                    return MQTT_ERR_AGAIN
-                except ConnectionError as err:
-                    self._easy_log(
-                        MQTT_LOG_ERR, 'failed to receive on socket: %s', err)
-                    return MQTT_ERR_CONN_LOST
-                else:
-                    if len(byte) == 0:
-                        return MQTT_ERR_CONN_LOST
-                    byte, = struct.unpack("!B", byte)
-                    self._in_packet['remaining_count'].append(byte)
-                    # Max 4 bytes length for remaining length as defined by protocol.
-                    # Anything more likely means a broken/malicious client.
-                    if len(self._in_packet['remaining_count']) > 4:
-                        return MQTT_ERR_PROTOCOL
-
-                    self._in_packet['remaining_length'] += (
-                        byte & 127) * self._in_packet['remaining_mult']
-                    self._in_packet['remaining_mult'] = self._in_packet['remaining_mult'] * 128
-
+                if pos == end:
+                    return rc  # header not complete yet
+                byte = buf[pos]
+                pos += 1
+                remaining_length += (byte & 127) * mult
+                mult *= 128
                 if (byte & 128) == 0:
                     break
+                # Max 4 bytes length for remaining length as defined by protocol.
+                # Anything more likely means a broken/malicious client.
+                if pos - start > 4:
+                    return MQTT_ERR_PROTOCOL
 
-            self._in_packet['have_remaining'] = 1
-            self._in_packet['to_process'] = self._in_packet['remaining_length']
-
-        count = 100 # Don't get stuck in this loop if we have a huge message.
-        while self._in_packet['to_process'] > 0:
-            try:
-                data = self._sock_recv(self._in_packet['to_process'])
-            except BlockingIOError:
-                return MQTT_ERR_AGAIN
-            except ConnectionError as err:
-                self._easy_log(
-                    MQTT_LOG_ERR, 'failed to receive on socket: %s', err)
-                return MQTT_ERR_CONN_LOST
-            else:
-                if len(data) == 0:
-                    return MQTT_ERR_CONN_LOST
-                self._in_packet['to_process'] -= len(data)
-                self._in_packet['packet'] += data
-            count -= 1
-            if count == 0:
-                with self._msgtime_mutex:
-                    self._last_msg_in = time_func()
-                return MQTT_ERR_AGAIN
+            if pos + remaining_length > end:
+                needed = pos - start + remaining_length
+                if needed > len(buf):
+                    buf.extend(bytes(needed - len(buf)))
+                break
 
-        # All data for this packet is read.
-        self._in_packet['pos'] = 0
-        rc = self._packet_handle()
-
-        # Free data and reset values
-        self._in_packet = {
-            'command': 0,
-            'have_remaining': 0,
-            'remaining_count': [],
-            'remaining_mult': 1,
-            'remaining_length': 0,
-            'packet': bytearray(b""),
-            'to_process': 0,
-            'pos': 0}
+            self._in_packet = _InPacket(buf[start], remaining_length, bytes(buf[pos:pos + remaining_length]))
+            start = self._in_start = pos + remaining_length
+            rc = self._packet_handle()
+            if rc or self._sock is None or self._in_start != start:
+                # Error, or a callback disconnected/reconnected the client
+                return rc
 
-        with self._msgtime_mutex:
-            self._last_msg_in = time_func()
         return rc
 
     def _packet_write(self):
         while True:
-            try:
-                packet = self._out_packet.popleft()
-            except IndexError:
+            # Gather what is ready (stop after a DISCONNECT: the socket is
+            # closed once it is written)
+            batch = []
+            while len(batch) < self._write_batch:
+                try:
+                    packet = self._out_packet.popleft()
+                except IndexError:
+                    break
+                batch.append(packet)
+                if (packet.command & 0xF0) == DISCONNECT:
+                    break
+            if not batch:
                 return MQTT_ERR_SUCCESS
 
             try:
-                write_length = self._sock_send(
-                    packet['packet'][packet['pos']:])
+                write_length = self._sock_sendv(
+                    [memoryview(packet.packet)[packet.pos:] for packet in batch])
             except (AttributeError, ValueError):
-                self._out_packet.appendleft(packet)
+                self._out_packet.extendleft(reversed(batch))
                 return MQTT_ERR_SUCCESS
             except BlockingIOError:
-                self._out_packet.appendleft(packet)
+                self._out_packet.extendleft(reversed(batch))
                 return MQTT_ERR_AGAIN
             except ConnectionError as err:
-                self._out_packet.appendleft(packet)
+                self._out_packet.extendleft(reversed(batch))
                 self._easy_log(
                     MQTT_LOG_ERR, 'failed to receive on socket: %s', err)
                 return MQTT_ERR_CONN_LOST
 
-            if write_length > 0:
-                packet['to_process'] -= write_length
-                packet['pos'] += write_length
-
-                if packet['to_process'] == 0:
-                    if (packet['command'] & 0xF0) == PUBLISH and packet['qos'] == 0:
-                        with self._callback_mutex:
-                            on_publish = self.on_publish
-
-                        if on_publish:
-                            with self._in_callback_mutex:
-                                try:
-                                    on_publish(
-                                        self, self._userdata, packet['mid'])
-                                except Exception as err:
-                                    self._easy_log(
-                                        MQTT_LOG_ERR, 'Caught exception in on_publish: %s', err)
-                                    if not self.suppress_exceptions:
-                                        raise
-
-                        packet['info']._set_as_published()
-
-                    if (packet['command'] & 0xF0) == DISCONNECT:
-                        with self._msgtime_mutex:
-                            self._last_msg_out = time_func()
-
-                        self._do_on_disconnect(MQTT_ERR_SUCCESS)
-                        self._sock_close()
-                        return MQTT_ERR_SUCCESS
-
-                else:
-                    # We haven't finished with this packet
-                    self._out_packet.appendleft(packet)
-            else:
+            if write_length <= 0:
+                self._out_packet.extendleft(reversed(batch))
                 break
 
+            for i, packet in enumerate(batch):
+                if write_length < packet.to_process:
+                    # We haven't finished with this packet (and the following ones)
+                    packet.to_process -= write_length
+                    packet.pos += write_length
+                    self._out_packet.extendleft(reversed(batch[i:]))
+                    break
+
+                write_length -= packet.to_process
+                packet.pos += packet.to_process
+                packet.to_process = 0
+
+                if (packet.command & 0xF0) == PUBLISH and packet.qos == 0:
+                    with self._callback_mutex:
+                        on_publish = self.on_publish
+
+                    if on_publish:
+                        with self._in_callback_mutex:
+                            try:
+                                on_publish(
+                                    self, self._userdata, packet.mid)
+                            except Exception as err:
+                                self._easy_log(
+                                    MQTT_LOG_ERR, 'Caught exception in on_publish: %s', err)
+                                if not self.suppress_exceptions:
+                                    raise
+
+                    packet.info._set_as_published()
+
+                if (packet.command & 0xF0) == DISCONNECT:
+                    with self._msgtime_mutex:
+                        self._last_msg_out = time_func()
+
+                    self._do_on_disconnect(MQTT_ERR_SUCCESS)
+                    self._sock_close()
+                    return MQTT_ERR_SUCCESS
+
         with self._msgtime_mutex:
             self._last_msg_out = time_func()
 
@@ -2676,8 +3462,28 @@ class Client(object):
                 packed_properties = b'\x00'
             else:
                 packed_properties = properties.pack()
+
+            if (self._topic_alias_auto and self._topic_alias_maximum > 0 and topic
+                    and (properties is None or not hasattr(properties, 'TopicAlias'))):
+                # The packet introducing an alias must be queued before any
+                # packet using it, so choose and queue under one lock.
+                with self._topic_alias_mutex:
+                    alias_topic, packed_properties = self._topic_alias_apply(topic, packed_properties)
+                    remaining_length += len(alias_topic) - len(topic) + len(packed_properties)
+                    self._publish_packet_build(packet, remaining_length, alias_topic, mid, qos,
+                                               packed_properties, payload)
+                    self._out_packet.append(_OutPacket(PUBLISH, packet, mid, qos, info))
+                return self._packet_queued()
+
             remaining_length += len(packed_properties)
+        else:
+            packed_properties = None
+
+        self._publish_packet_build(packet, remaining_length, topic, mid, qos, packed_properties, payload)
 
+        return self._packet_queue(PUBLISH, packet, mid, qos, info)
+
+    def _publish_packet_build(self, packet, remaining_length, topic, mid, qos, packed_properties, payload):
         self._pack_remaining_length(packet, remaining_length)
         self._pack_str16(packet, topic)
 
@@ -2685,12 +3491,58 @@ class Client(object):
             # For message id
             packet.extend(struct.pack("!H", mid))
 
-        if self._protocol == MQTTv5:
+        if packed_properties is not None:
             packet.extend(packed_properties)
 
         packet.extend(payload)
 
-        return self._packet_queue(PUBLISH, packet, mid, qos, info)
+    def _topic_alias_apply(self, topic, packed_properties):
+        """Returns the (topic, packed properties) to send: the topic plus a new
+        TopicAlias for frequently published topics, an empty topic plus the
+        alias once the broker knows it, the unchanged arguments otherwise.
+        Called with _topic_alias_mutex held."""
+        counts = self._topic_publish_counts
+        if len(counts) >= _TOPIC_ALIAS_COUNT_LIMIT and topic not in counts:
+            counts.clear()
+        count = counts.get(topic, 0) + 1
+        counts[topic] = count
+
+        if self._topic_alias_maximum <= 0:
+            return topic, packed_properties  # reconnect() reset the aliases meanwhile
+
+        alias = self._topic_aliases.get(topic)
+        if alias is not None:
+            packed = self._topic_alias_pack(packed_properties, alias)
+            self._topic_alias_bytes_saved += len(topic) - (len(packed) - len(packed_properties))
+            self._topic_alias_publishes += 1
+            return b'', packed
+
+        # The alias property costs 3 bytes, short topics would not shrink
+        if count < _TOPIC_ALIAS_MIN_COUNT or len(topic) <= 3:
+            return topic, packed_properties
+
+        if len(self._topic_aliases) < self._topic_alias_maximum:
+            alias = len(self._topic_aliases) + 1
+        else:
+            # All aliases in use: take over the one of the least published
+            # topic, if that one is published less than this topic
+            victim = min(self._topic_aliases, key=lambda t: counts.get(t, 0))
+            if counts.get(victim, 0) >= count:
+                return topic, packed_properties
+            alias = self._topic_aliases.pop(victim)
+
+        self._topic_aliases[topic] = alias
+        packed = self._topic_alias_pack(packed_properties, alias)
+        self._topic_alias_bytes_saved -= len(packed) - len(packed_properties)
+        return topic, packed
+
+    @staticmethod
+    def _topic_alias_pack(packed_properties, alias):
+        # Append the TopicAlias property (identifier 0x23, two byte integer)
+        # behind the already packed properties and fix up their length.
+        length, length_len = VariableByteIntegers.decode(packed_properties)
+        return (VariableByteIntegers.encode(length + 3) + packed_properties[length_len:]
+                + struct.pack("!BH", 0x23, alias))
 
     def _send_pubrec(self, mid):
         self._easy_log(MQTT_LOG_DEBUG, "Sending PUBREC (Mid: %d)", mid)
@@ -2945,6 +3797,7 @@ class Client(object):
     def _messages_reconnect_reset_out(self):
         with self._out_message_mutex:
             self._inflight_messages = 0
+            self._queued_mids.clear()
             for m in self._out_messages.values():
                 m.timestamp = 0
                 if self._max_inflight_messages == 0 or self._inflight_messages < self._max_inflight_messages:
@@ -2970,11 +3823,14 @@ class Client(object):
                                 m.state = mqtt_ms_publish
                 else:
                     m.state = mqtt_ms_queued
+                    self._queued_mids.append(m.mid)
 
     def _messages_reconnect_reset_in(self):
         with self._in_message_mutex:
             if self._check_clean_session():
                 self._in_messages = collections.OrderedDict()
+                if self._session_store is not None:
+                    self._session_store.in_clear()
                 return
             for m in self._in_messages.values():
                 m.timestamp = 0
@@ -2988,26 +3844,24 @@ class Client(object):
         self._messages_reconnect_reset_out()
         self._messages_reconnect_reset_in()
 
-    def _packet_queue(self, command, packet, mid, qos, info=None):
-        mpkt = {
-            'command': command,
-            'mid': mid,
-            'qos': qos,
-            'pos': 0,
-            'to_process': len(packet),
-            'packet': packet,
-            'info': info}
-
-        self._out_packet.append(mpkt)
-
+    def _loop_wake(self):
         # Write a single byte to sockpairW (connected to sockpairR) to break
-        # out of select() if in threaded mode.
-        if self._sockpairW is not None:
+        # out of select() if in threaded mode. One pending byte is enough:
+        # the loop drains the whole queue when it wakes up.
+        if self._sockpairW is not None and not self._wake_pending:
+            self._wake_pending = True
             try:
                 self._sockpairW.send(sockpair_data)
             except BlockingIOError:
                 pass
 
+    def _packet_queue(self, command, packet, mid, qos, info=None):
+        self._out_packet.append(_OutPacket(command, packet, mid, qos, info))
+        return self._packet_queued()
+
+    def _packet_queued(self):
+        self._loop_wake()
+
         # If we have an external event loop registered, use that instead
         # of calling loop_write() directly.
         if self._thread is None and self._on_socket_register_write is None:
@@ -3020,7 +3874,7 @@ class Client(object):
         return MQTT_ERR_SUCCESS
 
     def _packet_handle(self):
-        cmd = self._in_packet['command'] & 0xF0
+        cmd = self._in_packet.command & 0xF0
         if cmd == PINGREQ:
             return self._handle_pingreq()
         elif cmd == PINGRESP:
@@ -3049,14 +3903,14 @@ class Client(object):
             return MQTT_ERR_PROTOCOL
 
     def _handle_pingreq(self):
-        if self._in_packet['remaining_length'] != 0:
+        if self._in_packet.remaining_length != 0:
             return MQTT_ERR_PROTOCOL
 
         self._easy_log(MQTT_LOG_DEBUG, "Received PINGREQ")
         return self._send_pingresp()
 
     def _handle_pingresp(self):
-        if self._in_packet['remaining_length'] != 0:
+        if self._in_packet.remaining_length != 0:
             return MQTT_ERR_PROTOCOL
 
         # No longer waiting for a PINGRESP.
@@ -3066,14 +3920,14 @@ class Client(object):
 
     def _handle_connack(self):
         if self._protocol == MQTTv5:
-            if self._in_packet['remaining_length'] < 2:
+            if self._in_packet.remaining_length < 2:
                 return MQTT_ERR_PROTOCOL
-        elif self._in_packet['remaining_length'] != 2:
+        elif self._in_packet.remaining_length != 2:
             return MQTT_ERR_PROTOCOL
 
         if self._protocol == MQTTv5:
             (flags, result) = struct.unpack(
-                "!BB", self._in_packet['packet'][:2])
+                "!BB", self._in_packet.packet[:2])
             if result == 1:
                 # This is probably a failure from a broker that doesn't support
                 # MQTT v5.
@@ -3082,9 +3936,11 @@ class Client(object):
             else:
                 reason = ReasonCodes(CONNACK >> 4, identifier=result)
                 properties = Properties(CONNACK >> 4)
-                properties.unpack(self._in_packet['packet'][2:])
+                properties.unpack(self._in_packet.packet[2:])
+                with self._topic_alias_mutex:
+                    self._topic_alias_maximum = getattr(properties, 'TopicAliasMaximum', 0)
         else:
-            (flags, result) = struct.unpack("!BB", self._in_packet['packet'])
+            (flags, result) = struct.unpack("!BB", self._in_packet.packet)
         if self._protocol == MQTTv311:
             if result == CONNACK_REFUSED_PROTOCOL_VERSION:
                 if not self._reconnect_on_failure:
@@ -3112,6 +3968,7 @@ class Client(object):
         if result == 0:
             self._state = mqtt_cs_connected
             self._reconnect_delay = None
+            self._tls_session_save()
 
         if self._protocol == MQTTv5:
             self._easy_log(
@@ -3215,13 +4072,13 @@ class Client(object):
     def _handle_disconnect(self):
         packet_type = DISCONNECT >> 4
         reasonCode = properties = None
-        if self._in_packet['remaining_length'] > 2:
+        if self._in_packet.remaining_length > 2:
             reasonCode = ReasonCodes(packet_type)
-            reasonCode.unpack(self._in_packet['packet'])
-            if self._in_packet['remaining_length'] > 3:
+            reasonCode.unpack(self._in_packet.packet)
+            if self._in_packet.remaining_length > 3:
                 properties = Properties(packet_type)
                 props, props_len = properties.unpack(
-                    self._in_packet['packet'][1:])
+                    self._in_packet.packet[1:])
         self._easy_log(MQTT_LOG_DEBUG, "Received DISCONNECT %s %s",
                        reasonCode,
                        properties
@@ -3233,8 +4090,8 @@ class Client(object):
 
     def _handle_suback(self):
         self._easy_log(MQTT_LOG_DEBUG, "Received SUBACK")
-        pack_format = "!H" + str(len(self._in_packet['packet']) - 2) + 's'
-        (mid, packet) = struct.unpack(pack_format, self._in_packet['packet'])
+        pack_format = "!H" + str(len(self._in_packet.packet) - 2) + 's'
+        (mid, packet) = struct.unpack(pack_format, self._in_packet.packet)
 
         if self._protocol == MQTTv5:
             properties = Properties(SUBACK >> 4)
@@ -3271,14 +4128,14 @@ class Client(object):
     def _handle_publish(self):
         rc = 0
 
-        header = self._in_packet['command']
+        header = self._in_packet.command
         message = MQTTMessage()
         message.dup = (header & 0x08) >> 3
         message.qos = (header & 0x06) >> 1
         message.retain = (header & 0x01)
 
-        pack_format = "!H" + str(len(self._in_packet['packet']) - 2) + 's'
-        (slen, packet) = struct.unpack(pack_format, self._in_packet['packet'])
+        pack_format = "!H" + str(len(self._in_packet.packet) - 2) + 's'
+        (slen, packet) = struct.unpack(pack_format, self._in_packet.packet)
         pack_format = '!' + str(slen) + 's' + str(len(packet) - slen) + 's'
         (topic, packet) = struct.unpack(pack_format, packet)
 
@@ -3334,18 +4191,22 @@ class Client(object):
             message.state = mqtt_ms_wait_for_pubrel
             with self._in_message_mutex:
                 self._in_messages[message.mid] = message
+                if self._session_store is not None:
+                    self._session_store.in_add(
+                        message.mid, message._topic, message.payload, message.qos, message.retain,
+                        self._session_store_properties(message.properties if self._protocol == MQTTv5 else None))
             return rc
         else:
             return MQTT_ERR_PROTOCOL
 
     def _handle_pubrel(self):
         if self._protocol == MQTTv5:
-            if self._in_packet['remaining_length'] < 2:
+            if self._in_packet.remaining_length < 2:
                 return MQTT_ERR_PROTOCOL
-        elif self._in_packet['remaining_length'] != 2:
+        elif self._in_packet.remaining_length != 2:
             return MQTT_ERR_PROTOCOL
 
-        mid, = struct.unpack("!H", self._in_packet['packet'])
+        mid, = struct.unpack("!H", self._in_packet.packet)
         self._easy_log(MQTT_LOG_DEBUG, "Received PUBREL (Mid: %d)", mid)
 
         with self._in_message_mutex:
@@ -3354,6 +4215,8 @@ class Client(object):
                 # prevents multiple callbacks for the same message.
                 message = self._in_messages.pop(mid)
                 self._handle_on_message(message)
+                if self._session_store is not None:
+                    self._session_store.in_remove(mid)
                 self._inflight_messages -= 1
                 if self._max_inflight_messages > 0:
                     with self._out_message_mutex:
@@ -3363,53 +4226,55 @@ class Client(object):
 
         # FIXME: this should only be done if the message is known
         # If unknown it's a protocol error and we should close the connection.
-        # But since we don't have (on disk) persistence for the session, it
-        # is possible that we must known about this message.
+        # But unless a session store is set (session_store_set()) we don't
+        # have (on disk) persistence for the session, so it is possible that
+        # we must known about this message.
         # Choose to acknwoledge this messsage (and thus losing a message) but
         # avoid hanging. See #284.
         return self._send_pubcomp(mid)
 
     def _update_inflight(self):
         # Dont lock message_mutex here
-        for m in self._out_messages.values():
-            if self._inflight_messages < self._max_inflight_messages:
-                if m.qos > 0 and m.state == mqtt_ms_queued:
-                    self._inflight_messages += 1
-                    if m.qos == 1:
-                        m.state = mqtt_ms_wait_for_puback
-                    elif m.qos == 2:
-                        m.state = mqtt_ms_wait_for_pubrec
-                    rc = self._send_publish(
-                        m.mid,
-                        m.topic.encode('utf-8'),
-                        m.payload,
-                        m.qos,
-                        m.retain,
-                        m.dup,
-                        properties=m.properties,
-                    )
-                    if rc != 0:
-                        return rc
-            else:
-                return MQTT_ERR_SUCCESS
+        # Promote queued messages, oldest first, until the window is full.
+        # Stale mids (message already gone or no longer queued) are dropped.
+        while self._queued_mids and self._inflight_messages < self._max_inflight_messages:
+            m = self._out_messages.get(self._queued_mids.popleft())
+            if m is None or m.qos == 0 or m.state != mqtt_ms_queued:
+                continue
+            self._inflight_messages += 1
+            if m.qos == 1:
+                m.state = mqtt_ms_wait_for_puback
+            elif m.qos == 2:
+                m.state = mqtt_ms_wait_for_pubrec
+            rc = self._send_publish(
+                m.mid,
+                m.topic.encode('utf-8'),
+                m.payload,
+                m.qos,
+                m.retain,
+                m.dup,
+                properties=m.properties,
+            )
+            if rc != 0:
+                return rc
         return MQTT_ERR_SUCCESS
 
     def _handle_pubrec(self):
         if self._protocol == MQTTv5:
-            if self._in_packet['remaining_length'] < 2:
+            if self._in_packet.remaining_length < 2:
                 return MQTT_ERR_PROTOCOL
-        elif self._in_packet['remaining_length'] != 2:
+        elif self._in_packet.remaining_length != 2:
             return MQTT_ERR_PROTOCOL
 
-        mid, = struct.unpack("!H", self._in_packet['packet'][:2])
+        mid, = struct.unpack("!H", self._in_packet.packet[:2])
         if self._protocol == MQTTv5:
-            if self._in_packet['remaining_length'] > 2:
+            if self._in_packet.remaining_length > 2:
                 reasonCode = ReasonCodes(PUBREC >> 4)
-                reasonCode.unpack(self._in_packet['packet'][2:])
-                if self._in_packet['remaining_length'] > 3:
+                reasonCode.unpack(self._in_packet.packet[2:])
+                if self._in_packet.remaining_length > 3:
                     properties = Properties(PUBREC >> 4)
                     props, props_len = properties.unpack(
-                        self._in_packet['packet'][3:])
+                        self._in_packet.packet[3:])
         self._easy_log(MQTT_LOG_DEBUG, "Received PUBREC (Mid: %d)", mid)
 
         with self._out_message_mutex:
@@ -3417,20 +4282,22 @@ class Client(object):
                 msg = self._out_messages[mid]
                 msg.state = mqtt_ms_wait_for_pubcomp
                 msg.timestamp = time_func()
+                if self._session_store is not None:
+                    self._session_store.out_released(mid)
                 return self._send_pubrel(mid)
 
         return MQTT_ERR_SUCCESS
 
     def _handle_unsuback(self):
         if self._protocol == MQTTv5:
-            if self._in_packet['remaining_length'] < 4:
+            if self._in_packet.remaining_length < 4:
                 return MQTT_ERR_PROTOCOL
-        elif self._in_packet['remaining_length'] != 2:
+        elif self._in_packet.remaining_length != 2:
             return MQTT_ERR_PROTOCOL
 
-        mid, = struct.unpack("!H", self._in_packet['packet'][:2])
+        mid, = struct.unpack("!H", self._in_packet.packet[:2])
         if self._protocol == MQTTv5:
-            packet = self._in_packet['packet'][2:]
+            packet = self._in_packet.packet[2:]
             properties = Properties(UNSUBACK >> 4)
             props, props_len = properties.unpack(packet)
             reasoncodes = []
@@ -3496,6 +4363,8 @@ class Client(object):
         msg = self._out_messages.pop(mid)
         msg.info._set_as_published()
         if msg.qos > 0:
+            if self._session_store is not None:
+                self._session_store.out_remove(mid)
             self._inflight_messages -= 1
             if self._max_inflight_messages > 0:
                 rc = self._update_inflight()
@@ -3505,22 +4374,22 @@ class Client(object):
 
     def _handle_pubackcomp(self, cmd):
         if self._protocol == MQTTv5:
-            if self._in_packet['remaining_length'] < 2:
+            if self._in_packet.remaining_length < 2:
                 return MQTT_ERR_PROTOCOL
-        elif self._in_packet['remaining_length'] != 2:
+        elif self._in_packet.remaining_length != 2:
             return MQTT_ERR_PROTOCOL
 
         packet_type = PUBACK if cmd == "PUBACK" else PUBCOMP
         packet_type = packet_type >> 4
-        mid, = struct.unpack("!H", self._in_packet['packet'][:2])
+        mid, = struct.unpack("!H", self._in_packet.packet[:2])
         if self._protocol == MQTTv5:
-            if self._in_packet['remaining_length'] > 2:
+            if self._in_packet.remaining_length > 2:
                 reasonCode = ReasonCodes(packet_type)
-                reasonCode.unpack(self._in_packet['packet'][2:])
-                if self._in_packet['remaining_length'] > 3:
+                reasonCode.unpack(self._in_packet.packet[2:])
+                if self._in_packet.remaining_length > 3:
                     properties = Properties(packet_type)
                     props, props_len = properties.unpack(
-                        self._in_packet['packet'][3:])
+                        self._in_packet.packet[3:])
         self._easy_log(MQTT_LOG_DEBUG, "Received %s (Mid: %d)", cmd, mid)
 
         with self._out_message_mutex:
@@ -3539,11 +4408,10 @@ class Client(object):
         except UnicodeDecodeError:
             topic = None
 
-        on_message_callbacks = []
+        on_message_callbacks = ()
         with self._callback_mutex:
             if topic is not None:
-                for callback in self._on_message_filtered.iter_match(message.topic):
-                    on_message_callbacks.append(callback)
+                on_message_callbacks = self._on_message_filtered.match(topic)
 
             if len(on_message_callbacks) == 0:
                 on_message = self.on_message
@@ -3685,6 +4553,21 @@ class Client(object):
             return socket.create_connection(addr, timeout=self._connect_timeout, source_address=source)
 
 
+# Bytes requested from the socket per read, and the consumed size after
+# which WebsocketWrapper compacts its read buffer
+_WS_READ_AHEAD = 65536
+
+
+def _ws_mask(data, mask_key):
+    """XOR data with the repeated 4 byte mask_key (masking and unmasking are
+    the same operation), as one big integer XOR instead of a per-byte loop"""
+    length = len(data)
+    if length == 0:
+        return b""
+    mask = (bytes(mask_key) * ((length + 3) // 4))[:length]
+    return (int.from_bytes(data, "big") ^ int.from_bytes(mask, "big")).to_bytes(length, "big")
+
+
 class WebsocketWrapper(object):
     OPCODE_CONTINUATION = 0x0
     OPCODE_TEXT = 0x1
@@ -3709,6 +4592,7 @@ class WebsocketWrapper(object):
         self._requested_size = 0
         self._payload_head = 0
         self._readbuffer_head = 0
+        self._frame_unmasked = False
 
         self._do_handshake(extra_headers)
 
@@ -3828,113 +4712,141 @@ class WebsocketWrapper(object):
             raise ValueError("Maximum payload size is 2^63")
 
         if mask_flag == 1:
-            for index in range(length):
-                data[index] ^= mask_key[index % 4]
-            data = mask_key + data
+            data = mask_key + _ws_mask(data, mask_key)
 
         return header + data
 
-    def _buffered_read(self, length):
-
-        # try to recv and store needed bytes
-        wanted_bytes = length - (len(self._readbuffer) - self._readbuffer_head)
-        if wanted_bytes > 0:
-
-            data = self._socket.recv(wanted_bytes)
+    def _parse_frame(self):
+        """Decode the frame header at _readbuffer_head. Returns
+        (opcode, payload start, payload length, mask key) once the whole
+        frame is in the buffer, None otherwise."""
+        buf = self._readbuffer
+        head = self._readbuffer_head
+        available = len(buf) - head
+        if available < 2:
+            return None
 
+        opcode = buf[head] & 0x0f
+        maskbit = (buf[head + 1] & 0x80) == 0x80
+        payload_length = buf[head + 1] & 0x7f
+        pos = head + 2
+
+        # read length
+        if payload_length == 0x7e:
+            if available < 4:
+                return None
+            payload_length, = struct.unpack_from("!H", buf, pos)
+            pos += 2
+        elif payload_length == 0x7f:
+            if available < 10:
+                return None
+            payload_length, = struct.unpack_from("!Q", buf, pos)
+            pos += 8
+
+        # read mask
+        mask_key = None
+        if maskbit:
+            if len(buf) < pos + 4:
+                return None
+            mask_key = bytes(buf[pos:pos + 4])
+            pos += 4
+
+        if len(buf) < pos + payload_length:
+            return None
+        return opcode, pos, payload_length, mask_key
+
+    def _frame_ready(self):
+        """Parse (and unmask in place) the frame at the head of the read
+        buffer, receiving more data if needed. Raises BlockingIOError
+        if it is not complete yet."""
+        frame = self._parse_frame()
+        if frame is None:
+            data = self._socket.recv(_WS_READ_AHEAD)
             if not data:
                 raise ConnectionAbortedError
-            else:
-                self._readbuffer.extend(data)
-
-            if len(data) < wanted_bytes:
+            self._readbuffer += data
+            frame = self._parse_frame()
+            if frame is None:
                 raise BlockingIOError
 
-        self._readbuffer_head += length
-        return self._readbuffer[self._readbuffer_head - length:self._readbuffer_head]
-
-    def _recv_impl(self, length):
-
-        # try to decode websocket payload part from data
-        try:
+        opcode, start, payload_length, mask_key = frame
+        if mask_key is not None and not self._frame_unmasked:
+            with memoryview(self._readbuffer) as view:
+                view[start:start + payload_length] = _ws_mask(view[start:start + payload_length], mask_key)
+            self._frame_unmasked = True
+        return frame
 
+    def _consume_frame(self, start, payload_length):
+        self._readbuffer_head = start + payload_length
+        self._payload_head = 0
+        self._frame_unmasked = False
+        # Compact only once in a while, not after every frame
+        if self._readbuffer_head == len(self._readbuffer):
+            self._readbuffer = bytearray()
+            self._readbuffer_head = 0
+        elif self._readbuffer_head >= _WS_READ_AHEAD:
+            del self._readbuffer[:self._readbuffer_head]
             self._readbuffer_head = 0
 
-            result = None
-
-            chunk_startindex = self._payload_head
-            chunk_endindex = self._payload_head + length
-
-            header1 = self._buffered_read(1)
-            header2 = self._buffered_read(1)
-
-            opcode = (header1[0] & 0x0f)
-            maskbit = (header2[0] & 0x80) == 0x80
-            lengthbits = (header2[0] & 0x7f)
-            payload_length = lengthbits
-            mask_key = None
-
-            # read length
-            if lengthbits == 0x7e:
-
-                value = self._buffered_read(2)
-                payload_length, = struct.unpack("!H", value)
-
-            elif lengthbits == 0x7f:
-
-                value = self._buffered_read(8)
-                payload_length, = struct.unpack("!Q", value)
-
-            # read mask
-            if maskbit:
-                mask_key = self._buffered_read(4)
-
-            # if frame payload is shorter than the requested data, read only the possible part
-            readindex = chunk_endindex
-            if payload_length < readindex:
-                readindex = payload_length
-
-            if readindex > 0:
-                # get payload chunk
-                payload = self._buffered_read(readindex)
-
-                # unmask only the needed part
-                if maskbit:
-                    for index in range(chunk_startindex, readindex):
-                        payload[index] ^= mask_key[index % 4]
-
-                result = payload[chunk_startindex:readindex]
-                self._payload_head = readindex
-            else:
-                payload = bytearray()
+    def _recv_chunk(self, length):
+        """Returns (start, end, frame payload start, frame payload length)
+        of the next payload chunk of at most length bytes in _readbuffer.
+        The caller copies it out, then calls _chunk_done()."""
+        while True:
+            opcode, start, payload_length, _ = self._frame_ready()
+
+            if opcode == WebsocketWrapper.OPCODE_BINARY or opcode == WebsocketWrapper.OPCODE_CONTINUATION:
+                if payload_length == 0:
+                    self._consume_frame(start, 0)
+                    continue
+                chunk_start = start + self._payload_head
+                chunk_end = min(chunk_start + length, start + payload_length)
+                return chunk_start, chunk_end, start, payload_length
+
+            payload = self._readbuffer[start:start + payload_length]
+            self._consume_frame(start, payload_length)
+
+            # respond to non-binary opcodes, their arrival is not guaranteed beacause of non-blocking sockets
+            if opcode == WebsocketWrapper.OPCODE_CONNCLOSE:
+                frame = self._create_frame(
+                    WebsocketWrapper.OPCODE_CONNCLOSE, payload, 0)
+                self._socket.send(frame)
+
+            if opcode == WebsocketWrapper.OPCODE_PING:
+                frame = self._create_frame(
+                    WebsocketWrapper.OPCODE_PONG, payload, 0)
+                self._socket.send(frame)
+
+    def _chunk_done(self, end, start, payload_length):
+        if end == start + payload_length:
+            self._consume_frame(start, payload_length)
+        else:
+            self._payload_head = end - start
 
-            # check if full frame arrived and reset readbuffer and payloadhead if needed
-            if readindex == payload_length:
-                self._readbuffer = bytearray()
-                self._payload_head = 0
-
-                # respond to non-binary opcodes, their arrival is not guaranteed beacause of non-blocking sockets
-                if opcode == WebsocketWrapper.OPCODE_CONNCLOSE:
-                    frame = self._create_frame(
-                        WebsocketWrapper.OPCODE_CONNCLOSE, payload, 0)
-                    self._socket.send(frame)
-
-                if opcode == WebsocketWrapper.OPCODE_PING:
-                    frame = self._create_frame(
-                        WebsocketWrapper.OPCODE_PONG, payload, 0)
-                    self._socket.send(frame)
-
-            # This isn't *proper* handling of continuation frames, but given
-            # that we only support binary frames, it is *probably* good enough.
-            if (opcode == WebsocketWrapper.OPCODE_BINARY or opcode == WebsocketWrapper.OPCODE_CONTINUATION) \
-                    and payload_length > 0:
-                return result
-            else:
-                raise BlockingIOError
+    def _recv_impl(self, length):
 
+        # try to decode websocket payload part from data
+        try:
+            chunk_start, chunk_end, start, payload_length = self._recv_chunk(length)
         except ConnectionError:
             self.connected = False
             return b''
+        data = bytes(self._readbuffer[chunk_start:chunk_end])
+        self._chunk_done(chunk_end, start, payload_length)
+        return data
+
+    def recv_into(self, buffer, nbytes=0):
+        """Like socket.recv_into(): copies the payload straight from the
+        read buffer, without an intermediate bytes object"""
+        try:
+            chunk_start, chunk_end, start, payload_length = self._recv_chunk(nbytes or len(buffer))
+        except ConnectionError:
+            self.connected = False
+            return 0
+        with memoryview(self._readbuffer) as view:
+            buffer[:chunk_end - chunk_start] = view[chunk_start:chunk_end]
+        self._chunk_done(chunk_end, start, payload_length)
+        return chunk_end - chunk_start
 
     def _send_impl(self, data):
 
@@ -3977,6 +4889,9 @@ class WebsocketWrapper(object):
         return self._socket.fileno()
 
     def pending(self):
+        # A complete frame read ahead into _readbuffer is invisible to select()
+        if self._parse_frame() is not None:
+            return len(self._readbuffer) - self._readbuffer_head
         # Fix for bug #131: a SSL socket may still have data available
         # for reading without select() being aware of it.
         if self._ssl:
@@ -1,10 +1,18 @@
+import collections
+
+
 class MQTTMatcher(object):
     """Intended to manage topic filters including wildcards.
 
     Internally, MQTTMatcher use a prefix tree (trie) to store
     values associated with filters, and has an iter_match()
     method to iterate efficiently over all filters that match
-    some topic name."""
+    some topic name.
+
+    With cache_size > 0 the results of match() are memoized per topic
+    in a bounded LRU, which is cleared whenever a filter is added or
+    removed. The cache is not locked: callers sharing a matcher between
+    threads must serialize access (Client does so with _callback_mutex)."""
 
     class Node(object):
         __slots__ = '_children', '_content'
@@ -13,12 +21,15 @@ class MQTTMatcher(object):
             self._children = {}
             self._content = None
 
-    def __init__(self):
+    def __init__(self, cache_size=0):
         self._root = self.Node()
+        self._cache_size = cache_size
+        self._cache = collections.OrderedDict()
 
     def __setitem__(self, key, value):
         """Add a topic filter :key to the prefix tree
         and associate it to :value"""
+        self._cache.clear()
         node = self._root
         for sym in key.split('/'):
             node = node._children.setdefault(sym, self.Node())
@@ -38,6 +49,7 @@ class MQTTMatcher(object):
 
     def __delitem__(self, key):
         """Delete the value associated with some topic filter :key"""
+        self._cache.clear()
         lst = []
         try:
             parent, node = None, self._root
@@ -57,22 +69,56 @@ class MQTTMatcher(object):
     def iter_match(self, topic):
         """Return an iterator on all values associated with filters
         that match the :topic"""
+        return iter(self.match(topic))
+
+    def match(self, topic):
+        """Return a tuple of all values associated with filters that
+        match the :topic, in the same order as iter_match()"""
+        if self._cache_size:
+            try:
+                result = self._cache[topic]
+            except KeyError:
+                pass
+            else:
+                self._cache.move_to_end(topic)
+                return result
+
+        result = tuple(self._walk(topic))
+
+        if self._cache_size:
+            self._cache[topic] = result
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _walk(self, topic):
+        """Iterative depth-first walk: exact level first, then '+', then
+        the '#' filter of the level"""
         lst = topic.split('/')
+        n = len(lst)
         normal = not topic.startswith('$')
-        def rec(node, i=0):
-            if i == len(lst):
+        result = []
+        # (node, level) to visit, or (content, -1) for a deferred '#' match
+        stack = [(self._root, 0)]
+        while stack:
+            node, i = stack.pop()
+            if i < 0:
+                result.append(node)
+                continue
+            children = node._children
+            if normal or i > 0:
+                multi = children.get('#')
+                if multi is not None and multi._content is not None:
+                    stack.append((multi._content, -1))
+            if i == n:
                 if node._content is not None:
-                    yield node._content
-            else:
-                part = lst[i]
-                if part in node._children:
-                    for content in rec(node._children[part], i + 1):
-                        yield content
-                if '+' in node._children and (normal or i > 0):
-                    for content in rec(node._children['+'], i + 1):
-                        yield content
-            if '#' in node._children and (normal or i > 0):
-                content = node._children['#']._content
-                if content is not None:
-                    yield content
-        return rec(self._root)
+                    result.append(node._content)
+                continue
+            if normal or i > 0:
+                single = children.get('+')
+                if single is not None:
+                    stack.append((single, i + 1))
+            child = children.get(lst[i])
+            if child is not None:
+                stack.append((child, i + 1))
+        return result
@@ -139,6 +139,148 @@ class VariableByteIntegers:  # Variable Byte Integer
         return (value, bytes)
 
 
+# Property data types, Properties.types[i] is the name of type i
+_BYTE, _TWO_BYTE_INT, _FOUR_BYTE_INT, _VBI, _BINARY, _UTF8, _UTF8_PAIR = range(7)
+
+_TYPES = ["Byte", "Two Byte Integer", "Four Byte Integer", "Variable Byte Integer",
+          "Binary Data", "UTF-8 Encoded String", "UTF-8 String Pair"]
+
+_NAMES = {
+    "Payload Format Indicator": 1,
+    "Message Expiry Interval": 2,
+    "Content Type": 3,
+    "Response Topic": 8,
+    "Correlation Data": 9,
+    "Subscription Identifier": 11,
+    "Session Expiry Interval": 17,
+    "Assigned Client Identifier": 18,
+    "Server Keep Alive": 19,
+    "Authentication Method": 21,
+    "Authentication Data": 22,
+    "Request Problem Information": 23,
+    "Will Delay Interval": 24,
+    "Request Response Information": 25,
+    "Response Information": 26,
+    "Server Reference": 28,
+    "Reason String": 31,
+    "Receive Maximum": 33,
+    "Topic Alias Maximum": 34,
+    "Topic Alias": 35,
+    "Maximum QoS": 36,
+    "Retain Available": 37,
+    "User Property": 38,
+    "Maximum Packet Size": 39,
+    "Wildcard Subscription Available": 40,
+    "Subscription Identifier Available": 41,
+    "Shared Subscription Available": 42
+}
+
+_PROPERTIES = {
+    # id:  type, packets
+    # payload format indicator
+    1: (_BYTE, [PacketTypes.PUBLISH, PacketTypes.WILLMESSAGE]),
+    2: (_FOUR_BYTE_INT, [PacketTypes.PUBLISH, PacketTypes.WILLMESSAGE]),
+    3: (_UTF8, [PacketTypes.PUBLISH, PacketTypes.WILLMESSAGE]),
+    8: (_UTF8, [PacketTypes.PUBLISH, PacketTypes.WILLMESSAGE]),
+    9: (_BINARY, [PacketTypes.PUBLISH, PacketTypes.WILLMESSAGE]),
+    11: (_VBI, [PacketTypes.PUBLISH, PacketTypes.SUBSCRIBE]),
+    17: (_FOUR_BYTE_INT, [PacketTypes.CONNECT, PacketTypes.CONNACK, PacketTypes.DISCONNECT]),
+    18: (_UTF8, [PacketTypes.CONNACK]),
+    19: (_TWO_BYTE_INT, [PacketTypes.CONNACK]),
+    21: (_UTF8, [PacketTypes.CONNECT, PacketTypes.CONNACK, PacketTypes.AUTH]),
+    22: (_BINARY, [PacketTypes.CONNECT, PacketTypes.CONNACK, PacketTypes.AUTH]),
+    23: (_BYTE, [PacketTypes.CONNECT]),
+    24: (_FOUR_BYTE_INT, [PacketTypes.WILLMESSAGE]),
+    25: (_BYTE, [PacketTypes.CONNECT]),
+    26: (_UTF8, [PacketTypes.CONNACK]),
+    28: (_UTF8, [PacketTypes.CONNACK, PacketTypes.DISCONNECT]),
+    31: (_UTF8, [PacketTypes.CONNACK, PacketTypes.PUBACK, PacketTypes.PUBREC,
+                 PacketTypes.PUBREL, PacketTypes.PUBCOMP, PacketTypes.SUBACK,
+                 PacketTypes.UNSUBACK, PacketTypes.DISCONNECT, PacketTypes.AUTH]),
+    33: (_TWO_BYTE_INT, [PacketTypes.CONNECT, PacketTypes.CONNACK]),
+    34: (_TWO_BYTE_INT, [PacketTypes.CONNECT, PacketTypes.CONNACK]),
+    35: (_TWO_BYTE_INT, [PacketTypes.PUBLISH]),
+    36: (_BYTE, [PacketTypes.CONNACK]),
+    37: (_BYTE, [PacketTypes.CONNACK]),
+    38: (_UTF8_PAIR, [PacketTypes.CONNECT, PacketTypes.CONNACK,
+                      PacketTypes.PUBLISH, PacketTypes.PUBACK,
+                      PacketTypes.PUBREC, PacketTypes.PUBREL, PacketTypes.PUBCOMP,
+                      PacketTypes.SUBSCRIBE, PacketTypes.SUBACK,
+                      PacketTypes.UNSUBSCRIBE, PacketTypes.UNSUBACK,
+                      PacketTypes.DISCONNECT, PacketTypes.AUTH, PacketTypes.WILLMESSAGE]),
+    39: (_FOUR_BYTE_INT, [PacketTypes.CONNECT, PacketTypes.CONNACK]),
+    40: (_BYTE, [PacketTypes.CONNACK]),
+    41: (_BYTE, [PacketTypes.CONNACK]),
+    42: (_BYTE, [PacketTypes.CONNACK]),
+}
+
+# Lookup tables derived from the above, built once at import time.
+# Attribute names are the property names without spaces, in the order of
+# _NAMES, which is also the order properties are packed in.
+_ATTR_NAMES = tuple(name.replace(' ', '') for name in _NAMES)
+_IDENT_BY_ATTR = {name.replace(' ', ''): ident for name, ident in _NAMES.items()}
+_ATTR_BY_IDENT = {ident: name.replace(' ', '') for name, ident in _NAMES.items()}
+_NAME_BY_IDENT = {ident: name for name, ident in _NAMES.items()}
+_BIT_BY_ATTR = {name: 1 << index for index, name in enumerate(_ATTR_NAMES)}
+_ATTR_BY_BIT = {1 << index: name for index, name in enumerate(_ATTR_NAMES)}
+_TYPE_BY_IDENT = {ident: attr_type for ident, (attr_type, _) in _PROPERTIES.items()}
+_PACKETS_BY_IDENT = {ident: frozenset(packets) for ident, (_, packets) in _PROPERTIES.items()}
+_MULTIPLE = frozenset((11, 38))
+
+# (min, max, message) of the properties with restricted values
+_RANGES = {
+    "ReceiveMaximum": (1, 65535, "%s property value must be in the range 1-65535"),
+    "TopicAlias": (1, 65535, "%s property value must be in the range 1-65535"),
+    "TopicAliasMaximum": (0, 65535, "%s property value must be in the range 0-65535"),
+    "MaximumPacketSize": (1, 268435455, "%s property value must be in the range 1-268435455"),
+    "SubscriptionIdentifier": (1, 268435455, "%s property value must be in the range 1-268435455"),
+    "RequestResponseInformation": (0, 1, "%s property value must be 0 or 1"),
+    "RequestProblemInformation": (0, 1, "%s property value must be 0 or 1"),
+    "PayloadFormatIndicator": (0, 1, "%s property value must be 0 or 1"),
+}
+
+_UINT16 = struct.Struct("!H")
+_UINT32 = struct.Struct("!L")
+
+
+def _write_utf(buffer, data):
+    if not isinstance(data, (bytes, bytearray)):
+        data = data.encode("utf-8")
+    buffer += _UINT16.pack(len(data))
+    buffer += data
+
+
+def _read_vbi(buffer, pos):
+    multiplier = 1
+    value = 0
+    while True:
+        digit = buffer[pos]
+        pos += 1
+        value += (digit & 127) * multiplier
+        if digit & 128 == 0:
+            return value, pos
+        multiplier *= 128
+
+
+def _read_utf(buffer, pos, end):
+    if end - pos < 2:
+        raise MalformedPacket("Not enough data to read string length")
+    length, = _UINT16.unpack_from(buffer, pos)
+    pos += 2
+    if length > end - pos:
+        raise MalformedPacket("Length delimited string too long")
+    # A strict utf-8 decode already rejects D800-DFFF
+    try:
+        value = str(buffer[pos:pos + length], "utf-8")
+    except UnicodeDecodeError:
+        raise MalformedPacket("[MQTT-1.5.4-1] D800-DFFF found in UTF-8 data")
+    if "\x00" in value:
+        raise MalformedPacket("[MQTT-1.5.4-2] Null found in UTF-8 data")
+    if "\ufeff" in value:
+        raise MalformedPacket("[MQTT-1.5.4-3] U+FEFF in UTF-8 data")
+    return value, pos + length
+
+
 class Properties(object):
     """MQTT v5.0 properties class.
 
@@ -156,283 +298,195 @@ class Properties(object):
     this point.  Then properties are added as attributes, the name of which is the string property
     name without the spaces.
 
+    The name/identifier/type tables are shared by all instances and each
+    property has a slot, so creating, packing and unpacking Properties does
+    not rebuild or scan them.
     """
 
+    # _mask has bit i set when property _ATTR_NAMES[i] is set
+    __slots__ = ("packetType", "_mask") + _ATTR_NAMES
+
+    types = _TYPES
+    names = _NAMES
+    properties = {ident: (attr_type, list(packets)) for ident, (attr_type, packets) in _PROPERTIES.items()}
+
     def __init__(self, packetType):
         self.packetType = packetType
-        self.types = ["Byte", "Two Byte Integer", "Four Byte Integer", "Variable Byte Integer",
-                      "Binary Data", "UTF-8 Encoded String", "UTF-8 String Pair"]
-
-        self.names = {
-            "Payload Format Indicator": 1,
-            "Message Expiry Interval": 2,
-            "Content Type": 3,
-            "Response Topic": 8,
-            "Correlation Data": 9,
-            "Subscription Identifier": 11,
-            "Session Expiry Interval": 17,
-            "Assigned Client Identifier": 18,
-            "Server Keep Alive": 19,
-            "Authentication Method": 21,
-            "Authentication Data": 22,
-            "Request Problem Information": 23,
-            "Will Delay Interval": 24,
-            "Request Response Information": 25,
-            "Response Information": 26,
-            "Server Reference": 28,
-            "Reason String": 31,
-            "Receive Maximum": 33,
-            "Topic Alias Maximum": 34,
-            "Topic Alias": 35,
-            "Maximum QoS": 36,
-            "Retain Available": 37,
-            "User Property": 38,
-            "Maximum Packet Size": 39,
-            "Wildcard Subscription Available": 40,
-            "Subscription Identifier Available": 41,
-            "Shared Subscription Available": 42
-        }
-
-        self.properties = {
-            # id:  type, packets
-            # payload format indicator
-            1: (self.types.index("Byte"), [PacketTypes.PUBLISH, PacketTypes.WILLMESSAGE]),
-            2: (self.types.index("Four Byte Integer"), [PacketTypes.PUBLISH, PacketTypes.WILLMESSAGE]),
-            3: (self.types.index("UTF-8 Encoded String"), [PacketTypes.PUBLISH, PacketTypes.WILLMESSAGE]),
-            8: (self.types.index("UTF-8 Encoded String"), [PacketTypes.PUBLISH, PacketTypes.WILLMESSAGE]),
-            9: (self.types.index("Binary Data"), [PacketTypes.PUBLISH, PacketTypes.WILLMESSAGE]),
-            11: (self.types.index("Variable Byte Integer"),
-                 [PacketTypes.PUBLISH, PacketTypes.SUBSCRIBE]),
-            17: (self.types.index("Four Byte Integer"),
-                 [PacketTypes.CONNECT, PacketTypes.CONNACK, PacketTypes.DISCONNECT]),
-            18: (self.types.index("UTF-8 Encoded String"), [PacketTypes.CONNACK]),
-            19: (self.types.index("Two Byte Integer"), [PacketTypes.CONNACK]),
-            21: (self.types.index("UTF-8 Encoded String"),
-                 [PacketTypes.CONNECT, PacketTypes.CONNACK, PacketTypes.AUTH]),
-            22: (self.types.index("Binary Data"),
-                 [PacketTypes.CONNECT, PacketTypes.CONNACK, PacketTypes.AUTH]),
-            23: (self.types.index("Byte"),
-                 [PacketTypes.CONNECT]),
-            24: (self.types.index("Four Byte Integer"), [PacketTypes.WILLMESSAGE]),
-            25: (self.types.index("Byte"), [PacketTypes.CONNECT]),
-            26: (self.types.index("UTF-8 Encoded String"), [PacketTypes.CONNACK]),
-            28: (self.types.index("UTF-8 Encoded String"),
-                 [PacketTypes.CONNACK, PacketTypes.DISCONNECT]),
-            31: (self.types.index("UTF-8 Encoded String"),
-                 [PacketTypes.CONNACK, PacketTypes.PUBACK, PacketTypes.PUBREC,
-                  PacketTypes.PUBREL, PacketTypes.PUBCOMP, PacketTypes.SUBACK,
-                  PacketTypes.UNSUBACK, PacketTypes.DISCONNECT, PacketTypes.AUTH]),
-            33: (self.types.index("Two Byte Integer"),
-                 [PacketTypes.CONNECT, PacketTypes.CONNACK]),
-            34: (self.types.index("Two Byte Integer"),
-                 [PacketTypes.CONNECT, PacketTypes.CONNACK]),
-            35: (self.types.index("Two Byte Integer"), [PacketTypes.PUBLISH]),
-            36: (self.types.index("Byte"), [PacketTypes.CONNACK]),
-            37: (self.types.index("Byte"), [PacketTypes.CONNACK]),
-            38: (self.types.index("UTF-8 String Pair"),
-                 [PacketTypes.CONNECT, PacketTypes.CONNACK,
-                  PacketTypes.PUBLISH, PacketTypes.PUBACK,
-                  PacketTypes.PUBREC, PacketTypes.PUBREL, PacketTypes.PUBCOMP,
-                  PacketTypes.SUBSCRIBE, PacketTypes.SUBACK,
-                  PacketTypes.UNSUBSCRIBE, PacketTypes.UNSUBACK,
-                  PacketTypes.DISCONNECT, PacketTypes.AUTH, PacketTypes.WILLMESSAGE]),
-            39: (self.types.index("Four Byte Integer"),
-                 [PacketTypes.CONNECT, PacketTypes.CONNACK]),
-            40: (self.types.index("Byte"), [PacketTypes.CONNACK]),
-            41: (self.types.index("Byte"), [PacketTypes.CONNACK]),
-            42: (self.types.index("Byte"), [PacketTypes.CONNACK]),
-        }
+        object.__setattr__(self, "_mask", 0)
+
+    def __reduce__(self):
+        return self.__class__, (self.packetType,), dict(self._present())
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+            object.__setattr__(self, "_mask", self._mask | _BIT_BY_ATTR[name])
 
     def allowsMultiple(self, compressedName):
-        return self.getIdentFromName(compressedName) in [11, 38]
+        return self.getIdentFromName(compressedName) in _MULTIPLE
 
     def getIdentFromName(self, compressedName):
         # return the identifier corresponding to the property name
-        result = -1
-        for name in self.names.keys():
-            if compressedName == name.replace(' ', ''):
-                result = self.names[name]
-                break
-        return result
+        return _IDENT_BY_ATTR.get(compressedName, -1)
 
     def __setattr__(self, name, value):
-        name = name.replace(' ', '')
-        privateVars = ["packetType", "types", "names", "properties"]
-        if name in privateVars:
+        if name == "packetType":
             object.__setattr__(self, name, value)
-        else:
+            return
+
+        identifier = _IDENT_BY_ATTR.get(name)
+        if identifier is None:
             # the name could have spaces in, or not.  Remove spaces before assignment
-            if name not in [aname.replace(' ', '') for aname in self.names.keys()]:
+            name = name.replace(' ', '')
+            identifier = _IDENT_BY_ATTR.get(name)
+            if identifier is None:
                 raise MQTTException(
-                    "Property name must be one of "+str(self.names.keys()))
-            # check that this attribute applies to the packet type
-            if self.packetType not in self.properties[self.getIdentFromName(name)][1]:
-                raise MQTTException("Property %s does not apply to packet type %s"
-                                    % (name, PacketTypes.Names[self.packetType]))
-
-            # Check for forbidden values
+                    "Property name must be one of "+str(_NAMES.keys()))
+        # check that this attribute applies to the packet type
+        if self.packetType not in _PACKETS_BY_IDENT[identifier]:
+            raise MQTTException("Property %s does not apply to packet type %s"
+                                % (name, PacketTypes.Names[self.packetType]))
+
+        # Check for forbidden values
+        if type(value) != type([]):
+            limits = _RANGES.get(name)
+            if limits is not None and (value < limits[0] or value > limits[1]):
+                raise MQTTException(limits[2] % (name))
+
+        if identifier in _MULTIPLE:
             if type(value) != type([]):
-                if name in ["ReceiveMaximum", "TopicAlias"] \
-                        and (value < 1 or value > 65535):
+                value = [value]
+            if self._mask & _BIT_BY_ATTR[name]:
+                value = object.__getattribute__(self, name) + value
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, "_mask", self._mask | _BIT_BY_ATTR[name])
 
-                    raise MQTTException(
-                        "%s property value must be in the range 1-65535" % (name))
-                elif name in ["TopicAliasMaximum"] \
-                        and (value < 0 or value > 65535):
-
-                    raise MQTTException(
-                        "%s property value must be in the range 0-65535" % (name))
-                elif name in ["MaximumPacketSize", "SubscriptionIdentifier"] \
-                        and (value < 1 or value > 268435455):
-
-                    raise MQTTException(
-                        "%s property value must be in the range 1-268435455" % (name))
-                elif name in ["RequestResponseInformation", "RequestProblemInformation", "PayloadFormatIndicator"] \
-                        and (value != 0 and value != 1):
-
-                    raise MQTTException(
-                        "%s property value must be 0 or 1" % (name))
-
-            if self.allowsMultiple(name):
-                if type(value) != type([]):
-                    value = [value]
-                if hasattr(self, name):
-                    value = object.__getattribute__(self, name) + value
-            object.__setattr__(self, name, value)
+    def __delattr__(self, name):
+        name = name.replace(' ', '')
+        object.__delattr__(self, name)
+        if name in _BIT_BY_ATTR:
+            object.__setattr__(self, "_mask", self._mask & ~_BIT_BY_ATTR[name])
+
+    def _present(self):
+        # (name, value) of the properties that are set, in packing order
+        present = []
+        mask = self._mask
+        while mask:
+            bit = mask & -mask
+            name = _ATTR_BY_BIT[bit]
+            present.append((name, object.__getattribute__(self, name)))
+            mask ^= bit
+        return present
 
     def __str__(self):
-        buffer = "["
-        first = True
-        for name in self.names.keys():
-            compressedName = name.replace(' ', '')
-            if hasattr(self, compressedName):
-                if not first:
-                    buffer += ", "
-                buffer += compressedName + " : " + \
-                    str(getattr(self, compressedName))
-                first = False
-        buffer += "]"
-        return buffer
+        return "[" + ", ".join(name + " : " + str(value) for name, value in self._present()) + "]"
 
     def json(self):
         data = {}
-        for name in self.names.keys():
-            compressedName = name.replace(' ', '')
-            if hasattr(self, compressedName):
-                val = getattr(self, compressedName)
-                if compressedName == 'CorrelationData' and isinstance(val, bytes):
-                    data[compressedName] = val.hex()
-                else:
-                    data[compressedName] = val
+        for compressedName, val in self._present():
+            if compressedName == 'CorrelationData' and isinstance(val, bytes):
+                data[compressedName] = val.hex()
+            else:
+                data[compressedName] = val
         return data
 
     def isEmpty(self):
-        rc = True
-        for name in self.names.keys():
-            compressedName = name.replace(' ', '')
-            if hasattr(self, compressedName):
-                rc = False
-                break
-        return rc
+        return not self._mask
 
     def clear(self):
-        for name in self.names.keys():
-            compressedName = name.replace(' ', '')
-            if hasattr(self, compressedName):
-                delattr(self, compressedName)
+        for name, _ in self._present():
+            object.__delattr__(self, name)
+        object.__setattr__(self, "_mask", 0)
 
     def writeProperty(self, identifier, type, value):
-        buffer = b""
-        buffer += VariableByteIntegers.encode(identifier)  # identifier
-        if type == self.types.index("Byte"):  # value
-            if sys.version_info[0] < 3:
-                buffer += chr(value)
-            else:
-                buffer += bytes([value])
-        elif type == self.types.index("Two Byte Integer"):
-            buffer += writeInt16(value)
-        elif type == self.types.index("Four Byte Integer"):
-            buffer += writeInt32(value)
-        elif type == self.types.index("Variable Byte Integer"):
+        buffer = bytearray()
+        self._write_property(buffer, identifier, type, value)
+        return bytes(buffer)
+
+    @staticmethod
+    def _write_property(buffer, identifier, type, value):
+        # all identifiers are below 128: their variable byte integer is one byte
+        buffer.append(identifier)
+        if type == _BYTE:
+            buffer.append(value)
+        elif type == _TWO_BYTE_INT:
+            buffer += _UINT16.pack(value)
+        elif type == _FOUR_BYTE_INT:
+            buffer += _UINT32.pack(value)
+        elif type == _VBI:
             buffer += VariableByteIntegers.encode(value)
-        elif type == self.types.index("Binary Data"):
-            buffer += writeBytes(value)
-        elif type == self.types.index("UTF-8 Encoded String"):
-            buffer += writeUTF(value)
-        elif type == self.types.index("UTF-8 String Pair"):
-            buffer += writeUTF(value[0]) + writeUTF(value[1])
-        return buffer
+        elif type == _BINARY:
+            buffer += _UINT16.pack(len(value))
+            buffer += value
+        elif type == _UTF8:
+            _write_utf(buffer, value)
+        elif type == _UTF8_PAIR:
+            _write_utf(buffer, value[0])
+            _write_utf(buffer, value[1])
 
     def pack(self):
         # serialize properties into buffer for sending over network
-        buffer = b""
-        for name in self.names.keys():
-            compressedName = name.replace(' ', '')
-            if hasattr(self, compressedName):
-                identifier = self.getIdentFromName(compressedName)
-                attr_type = self.properties[identifier][0]
-                if self.allowsMultiple(compressedName):
-                    for prop in getattr(self, compressedName):
-                        buffer += self.writeProperty(identifier,
-                                                     attr_type, prop)
-                else:
-                    buffer += self.writeProperty(identifier, attr_type,
-                                                 getattr(self, compressedName))
-        return VariableByteIntegers.encode(len(buffer)) + buffer
+        # One pass over the set properties into a buffer with room for the
+        # length in front (at most 4 bytes), which is filled in at the end.
+        buffer = bytearray(4)
+        write = self._write_property
+        for name, value in self._present():
+            identifier = _IDENT_BY_ATTR[name]
+            attr_type = _TYPE_BY_IDENT[identifier]
+            if identifier in _MULTIPLE:
+                for prop in value:
+                    write(buffer, identifier, attr_type, prop)
+            else:
+                write(buffer, identifier, attr_type, value)
+        length = VariableByteIntegers.encode(len(buffer) - 4)
+        start = 4 - len(length)
+        buffer[start:4] = length
+        return bytes(buffer[start:]) if start else bytes(buffer)
 
     def readProperty(self, buffer, type, propslen):
-        if type == self.types.index("Byte"):
-            value = buffer[0]
-            valuelen = 1
-        elif type == self.types.index("Two Byte Integer"):
-            value = readInt16(buffer)
-            valuelen = 2
-        elif type == self.types.index("Four Byte Integer"):
-            value = readInt32(buffer)
-            valuelen = 4
-        elif type == self.types.index("Variable Byte Integer"):
-            value, valuelen = VariableByteIntegers.decode(buffer)
-        elif type == self.types.index("Binary Data"):
-            value, valuelen = readBytes(buffer)
-        elif type == self.types.index("UTF-8 Encoded String"):
-            value, valuelen = readUTF(buffer, propslen)
-        elif type == self.types.index("UTF-8 String Pair"):
-            value, valuelen = readUTF(buffer, propslen)
-            buffer = buffer[valuelen:]  # strip the bytes used by the value
-            value1, valuelen1 = readUTF(buffer, propslen - valuelen)
-            value = (value, value1)
-            valuelen += valuelen1
-        return value, valuelen
+        value, pos = self._read_property(memoryview(buffer), 0, type, propslen)
+        return value, pos
+
+    @staticmethod
+    def _read_property(buffer, pos, type, end):
+        if type == _BYTE:
+            return buffer[pos], pos + 1
+        elif type == _TWO_BYTE_INT:
+            return _UINT16.unpack_from(buffer, pos)[0], pos + 2
+        elif type == _FOUR_BYTE_INT:
+            return _UINT32.unpack_from(buffer, pos)[0], pos + 4
+        elif type == _VBI:
+            return _read_vbi(buffer, pos)
+        elif type == _BINARY:
+            length, = _UINT16.unpack_from(buffer, pos)
+            pos += 2
+            return bytes(buffer[pos:pos + length]), pos + length
+        elif type == _UTF8:
+            return _read_utf(buffer, pos, end)
+        elif type == _UTF8_PAIR:
+            value, pos = _read_utf(buffer, pos, end)
+            value1, pos = _read_utf(buffer, pos, end)
+            return (value, value1), pos
 
     def getNameFromIdent(self, identifier):
-        rc = None
-        for name in self.names:
-            if self.names[name] == identifier:
-                rc = name
-        return rc
+        return _NAME_BY_IDENT.get(identifier)
 
     def unpack(self, buffer):
-        if sys.version_info[0] < 3:
-            buffer = bytearray(buffer)
         self.clear()
         # deserialize properties into attributes from buffer received from network
-        propslen, VBIlen = VariableByteIntegers.decode(buffer)
-        buffer = buffer[VBIlen:]  # strip the bytes used by the VBI
-        propslenleft = propslen
-        while propslenleft > 0:  # properties length is 0 if there are none
-            identifier, VBIlen2 = VariableByteIntegers.decode(
-                buffer)  # property identifier
-            buffer = buffer[VBIlen2:]  # strip the bytes used by the VBI
-            propslenleft -= VBIlen2
-            attr_type = self.properties[identifier][0]
-            value, valuelen = self.readProperty(
-                buffer, attr_type, propslenleft)
-            buffer = buffer[valuelen:]  # strip the bytes used by the value
-            propslenleft -= valuelen
-            propname = self.getNameFromIdent(identifier)
-            compressedName = propname.replace(' ', '')
-            if not self.allowsMultiple(compressedName) and hasattr(self, compressedName):
-                raise MQTTException(
-                    "Property '%s' must not exist more than once" % property)
-            setattr(self, propname, value)
+        with memoryview(buffer) as view:
+            propslen, pos = _read_vbi(view, 0)
+            VBIlen = pos
+            end = pos + propslen
+            while pos < end:  # properties length is 0 if there are none
+                identifier, pos = _read_vbi(view, pos)  # property identifier
+                attr_type = _TYPE_BY_IDENT.get(identifier)
+                if attr_type is None:
+                    raise MalformedPacket("Unknown property identifier %d" % identifier)
+                value, pos = self._read_property(view, pos, attr_type, end)
+                name = _ATTR_BY_IDENT[identifier]
+                if identifier not in _MULTIPLE and self._mask & _BIT_BY_ATTR[name]:
+                    raise MQTTException(
+                        "Property '%s' must not exist more than once" % name)
+                setattr(self, name, value)
         return self, propslen + VBIlen
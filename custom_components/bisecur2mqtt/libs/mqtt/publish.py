@@ -17,10 +17,14 @@ This module provides some helper functions to allow straightforward publishing
 of messages in a one-shot manner. In other words, they are useful for the
 situation where you have a single/multiple messages you want to publish to a
 broker, then disconnect and nothing else is required.
+
+PublishPool offers the same single()/multiple() calls, but keeps the
+connection open for the next call instead of connecting every time.
 """
 from __future__ import absolute_import
 
 import collections
+import threading
 
 try:
     from collections.abc import Iterable
@@ -31,19 +35,23 @@ from .. import mqtt
 from . import client as paho
 
 
-def _do_publish(client):
+def _publish_message(client, message):
     """Internal function"""
 
-    message = client._userdata.popleft()
-
     if isinstance(message, dict):
-        client.publish(**message)
+        return client.publish(**message)
     elif isinstance(message, (tuple, list)):
-        client.publish(*message)
+        return client.publish(*message)
     else:
         raise TypeError('message must be a dict, tuple, or list')
 
 
+def _do_publish(client):
+    """Internal function"""
+
+    _publish_message(client, client._userdata.popleft())
+
+
 def _on_connect(client, userdata, flags, rc):
     """Internal callback"""
     #pylint: disable=invalid-name, unused-argument
@@ -141,11 +149,20 @@ def multiple(msgs, hostname="localhost", port=1883, client_id="", keepalive=60,
                          protocol=protocol, transport=transport)
 
     client.on_publish = _on_publish
-    if protocol == custom_components.bisecur2mqtt.libs.mqtt.client.MQTTv5:
+    if protocol == paho.MQTTv5:
         client.on_connect = _on_connect_v5
     else:
         client.on_connect = _on_connect
 
+    _configure(client, will, auth, tls, proxy_args)
+
+    client.connect(hostname, port, keepalive)
+    client.loop_forever()
+
+
+def _configure(client, will, auth, tls, proxy_args):
+    """Internal function"""
+
     if proxy_args is not None:
         client.proxy_set(**proxy_args)
 
@@ -163,6 +180,7 @@ def multiple(msgs, hostname="localhost", port=1883, client_id="", keepalive=60,
 
     if tls is not None:
         if isinstance(tls, dict):
+            tls = dict(tls)
             insecure = tls.pop('insecure', False)
             client.tls_set(**tls)
             if insecure:
@@ -173,9 +191,6 @@ def multiple(msgs, hostname="localhost", port=1883, client_id="", keepalive=60,
             # Assume input is SSLContext object
             client.tls_set_context(tls)
 
-    client.connect(hostname, port, keepalive)
-    client.loop_forever()
-
 
 def single(topic, payload=None, qos=0, retain=False, hostname="localhost",
            port=1883, client_id="", keepalive=60, will=None, auth=None,
@@ -239,3 +254,224 @@ def single(topic, payload=None, qos=0, retain=False, hostname="localhost",
 
     multiple([msg], hostname, port, client_id, keepalive, will, auth, tls,
              protocol, transport, proxy_args)
+
+
+def _freeze(value):
+    """Internal function: hashable form of a will/auth/tls/proxy argument"""
+
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class _PooledConnection(object):
+    """Internal class: a connected client with its network thread"""
+
+    def __init__(self, client):
+        self.client = client
+        self.connack = threading.Event()
+        self.rc = None
+        self.error = None
+        self.last_used = paho.time_func()
+        self.busy = 0
+
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        self.rc = rc
+        self.connack.set()
+
+    def _on_disconnect(self, client, userdata, rc, properties=None):
+        self.connack.clear()
+
+    def wait_connected(self, timeout):
+        if not self.connack.wait(timeout):
+            raise mqtt.MQTTException('Timed out waiting for CONNACK')
+        if self.error is not None:
+            raise mqtt.MQTTException('Connect failed: %s' % self.error)
+        if self.rc != 0:
+            raise mqtt.MQTTException(paho.connack_string(self.rc))
+
+    def close(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+
+class PublishPool(object):
+    """Publish messages over connections that stay open between calls.
+
+    single() and multiple() take the same arguments as the module functions.
+    The first call for a broker connects a client and starts its network
+    thread; later calls with the same hostname, port, client_id, keepalive,
+    will, auth, tls, protocol, transport and proxy_args reuse it. All
+    messages of a call are written back to back and the acknowledgements of
+    QoS 1 and 2 messages are awaited together at the end, not one by one.
+
+    Connections that were not used for idle_timeout seconds are closed by a
+    background thread. ack_timeout limits how long a call waits for the
+    CONNACK and for the acknowledgements, an MQTTException is raised after
+    that. max_inflight is passed to max_inflight_messages_set() of the
+    pooled clients.
+
+        pool = PublishPool(idle_timeout=30)
+        pool.multiple(msgs, hostname="broker", auth=auth)
+        ...
+        pool.close()
+
+    A lost connection is re-established by the client's own network thread,
+    unacknowledged QoS > 0 messages are then sent again.
+    """
+
+    def __init__(self, idle_timeout=60.0, ack_timeout=30.0, max_inflight=100):
+        self.idle_timeout = idle_timeout
+        self.ack_timeout = ack_timeout
+        self.max_inflight = max_inflight
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._connections)
+
+    def _connection(self, hostname, port, client_id, keepalive, will, auth,
+                    tls, protocol, transport, proxy_args):
+        key = (hostname, port, client_id, keepalive, _freeze(will),
+               _freeze(auth), _freeze(tls), protocol, transport,
+               _freeze(proxy_args))
+
+        created = False
+        with self._lock:
+            conn = self._connections.get(key)
+            if conn is None:
+                client = paho.Client(client_id=client_id, protocol=protocol,
+                                     transport=transport)
+                client.max_inflight_messages_set(self.max_inflight)
+                _configure(client, will, auth, tls, proxy_args)
+                conn = _PooledConnection(client)
+                self._connections[key] = conn
+                created = True
+                if self._reaper is None:
+                    self._reaper = threading.Event()
+                    reaper = threading.Thread(
+                        target=self._reap_loop, args=(self._reaper,),
+                        name='paho-publish-pool')
+                    reaper.daemon = True
+                    reaper.start()
+            conn.busy += 1
+
+        if created:
+            # DNS/TCP/TLS outside the lock: a slow broker must not block
+            # callers of other connections. Callers of this one wait for
+            # the CONNACK (or the error) in wait_connected().
+            try:
+                conn.client.connect(hostname, port, keepalive)
+                conn.client.loop_start()
+            except Exception as err:
+                conn.error = err
+                conn.connack.set()
+                self._release(conn)
+                self._discard(key, conn)
+                raise
+
+        try:
+            conn.wait_connected(self.ack_timeout)
+        except mqtt.MQTTException:
+            self._release(conn)
+            self._discard(key, conn)
+            raise
+        return conn
+
+    def _release(self, conn):
+        with self._lock:
+            conn.busy -= 1
+            conn.last_used = paho.time_func()
+
+    def _discard(self, key, conn):
+        with self._lock:
+            if self._connections.get(key) is conn:
+                del self._connections[key]
+        conn.close()
+
+    def multiple(self, msgs, hostname="localhost", port=1883, client_id="",
+                 keepalive=60, will=None, auth=None, tls=None,
+                 protocol=paho.MQTTv311, transport="tcp", proxy_args=None):
+        """Publish multiple messages over a pooled connection. Returns once
+        every message has been written (QoS 0) or acknowledged (QoS 1, 2).
+
+        See the module function multiple() for the arguments."""
+
+        if not isinstance(msgs, Iterable):
+            raise TypeError('msgs must be an iterable')
+
+        conn = self._connection(hostname, port, client_id, keepalive, will,
+                                auth, tls, protocol, transport, proxy_args)
+
+        try:
+            infos = [_publish_message(conn.client, message) for message in msgs]
+
+            deadline = paho.time_func() + self.ack_timeout
+            for info in infos:
+                info.wait_for_publish(max(deadline - paho.time_func(), 0.0))
+                if not info.is_published():
+                    raise mqtt.MQTTException(
+                        'Timed out waiting for %d messages to be published'
+                        % sum(not i.is_published() for i in infos))
+        finally:
+            self._release(conn)
+
+    def single(self, topic, payload=None, qos=0, retain=False,
+               hostname="localhost", port=1883, client_id="", keepalive=60,
+               will=None, auth=None, tls=None, protocol=paho.MQTTv311,
+               transport="tcp", proxy_args=None):
+        """Publish a single message over a pooled connection.
+
+        See the module function single() for the arguments."""
+
+        msg = {'topic':topic, 'payload':payload, 'qos':qos, 'retain':retain}
+
+        self.multiple([msg], hostname, port, client_id, keepalive, will, auth,
+                      tls, protocol, transport, proxy_args)
+
+    def reap(self):
+        """Close connections idle for longer than idle_timeout. Returns the
+        number of closed connections."""
+
+        now = paho.time_func()
+        with self._lock:
+            # Removed while busy is checked: _connection() cannot take one
+            # of them any more once the lock is released
+            idle = [key for key, conn in self._connections.items()
+                    if not conn.busy and now - conn.last_used > self.idle_timeout]
+            closing = [self._connections.pop(key) for key in idle]
+        for conn in closing:
+            conn.close()
+        return len(closing)
+
+    def _reap_loop(self, stop):
+        while not stop.wait(max(self.idle_timeout / 2.0, 0.1)):
+            self.reap()
+            with self._lock:
+                if not self._connections and self._reaper is stop:
+                    self._reaper = None
+                    return
+
+    def close(self):
+        """Disconnect all pooled connections."""
+
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+            if self._reaper is not None:
+                self._reaper.set()
+                self._reaper = None
+        for conn in connections:
+            conn.close()
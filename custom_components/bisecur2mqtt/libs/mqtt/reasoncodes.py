@@ -21,14 +21,109 @@ import sys
 from .packettypes import PacketTypes
 
 
+# code -> {name: [packet types]}, see ReasonCodes.names
+_NAMES = {
+    0: {"Success": [PacketTypes.CONNACK, PacketTypes.PUBACK,
+                    PacketTypes.PUBREC, PacketTypes.PUBREL, PacketTypes.PUBCOMP,
+                    PacketTypes.UNSUBACK, PacketTypes.AUTH],
+        "Normal disconnection": [PacketTypes.DISCONNECT],
+        "Granted QoS 0": [PacketTypes.SUBACK]},
+    1: {"Granted QoS 1": [PacketTypes.SUBACK]},
+    2: {"Granted QoS 2": [PacketTypes.SUBACK]},
+    4: {"Disconnect with will message": [PacketTypes.DISCONNECT]},
+    16: {"No matching subscribers":
+         [PacketTypes.PUBACK, PacketTypes.PUBREC]},
+    17: {"No subscription found": [PacketTypes.UNSUBACK]},
+    24: {"Continue authentication": [PacketTypes.AUTH]},
+    25: {"Re-authenticate": [PacketTypes.AUTH]},
+    128: {"Unspecified error": [PacketTypes.CONNACK, PacketTypes.PUBACK,
+                                PacketTypes.PUBREC, PacketTypes.SUBACK, PacketTypes.UNSUBACK,
+                                PacketTypes.DISCONNECT], },
+    129: {"Malformed packet":
+          [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+    130: {"Protocol error":
+          [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+    131: {"Implementation specific error": [PacketTypes.CONNACK,
+                                            PacketTypes.PUBACK, PacketTypes.PUBREC, PacketTypes.SUBACK,
+                                            PacketTypes.UNSUBACK, PacketTypes.DISCONNECT], },
+    132: {"Unsupported protocol version": [PacketTypes.CONNACK]},
+    133: {"Client identifier not valid": [PacketTypes.CONNACK]},
+    134: {"Bad user name or password": [PacketTypes.CONNACK]},
+    135: {"Not authorized": [PacketTypes.CONNACK, PacketTypes.PUBACK,
+                             PacketTypes.PUBREC, PacketTypes.SUBACK, PacketTypes.UNSUBACK,
+                             PacketTypes.DISCONNECT], },
+    136: {"Server unavailable": [PacketTypes.CONNACK]},
+    137: {"Server busy": [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+    138: {"Banned": [PacketTypes.CONNACK]},
+    139: {"Server shutting down": [PacketTypes.DISCONNECT]},
+    140: {"Bad authentication method":
+          [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+    141: {"Keep alive timeout": [PacketTypes.DISCONNECT]},
+    142: {"Session taken over": [PacketTypes.DISCONNECT]},
+    143: {"Topic filter invalid":
+          [PacketTypes.SUBACK, PacketTypes.UNSUBACK, PacketTypes.DISCONNECT]},
+    144: {"Topic name invalid":
+          [PacketTypes.CONNACK, PacketTypes.PUBACK,
+           PacketTypes.PUBREC, PacketTypes.DISCONNECT]},
+    145: {"Packet identifier in use":
+          [PacketTypes.PUBACK, PacketTypes.PUBREC,
+           PacketTypes.SUBACK, PacketTypes.UNSUBACK]},
+    146: {"Packet identifier not found":
+          [PacketTypes.PUBREL, PacketTypes.PUBCOMP]},
+    147: {"Receive maximum exceeded": [PacketTypes.DISCONNECT]},
+    148: {"Topic alias invalid": [PacketTypes.DISCONNECT]},
+    149: {"Packet too large": [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+    150: {"Message rate too high": [PacketTypes.DISCONNECT]},
+    151: {"Quota exceeded": [PacketTypes.CONNACK, PacketTypes.PUBACK,
+                             PacketTypes.PUBREC, PacketTypes.SUBACK, PacketTypes.DISCONNECT], },
+    152: {"Administrative action": [PacketTypes.DISCONNECT]},
+    153: {"Payload format invalid":
+          [PacketTypes.PUBACK, PacketTypes.PUBREC, PacketTypes.DISCONNECT]},
+    154: {"Retain not supported":
+          [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+    155: {"QoS not supported":
+          [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+    156: {"Use another server":
+          [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+    157: {"Server moved":
+          [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+    158: {"Shared subscription not supported":
+          [PacketTypes.SUBACK, PacketTypes.DISCONNECT]},
+    159: {"Connection rate exceeded":
+          [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
+    160: {"Maximum connect time":
+          [PacketTypes.DISCONNECT]},
+    161: {"Subscription identifiers not supported":
+          [PacketTypes.SUBACK, PacketTypes.DISCONNECT]},
+    162: {"Wildcard subscription not supported":
+          [PacketTypes.SUBACK, PacketTypes.DISCONNECT]},
+}
+
+# Lookup indexes derived from _NAMES, built once at import time
+_NAME_BY_CODE = {}  # (packetType, code) -> name
+_CODE_BY_NAME = {}  # (packetType, name) -> code
+for _code, _names in _NAMES.items():
+    for _name, _packet_types in _names.items():
+        for _packet_type in _packet_types:
+            _NAME_BY_CODE[(_packet_type, _code)] = _name
+            _CODE_BY_NAME[(_packet_type, _name)] = _code
+del _code, _names, _name, _packet_types, _packet_type
+
+
 class ReasonCodes:
     """MQTT version 5.0 reason codes class.
 
     See ReasonCodes.names for a list of possible numeric values along with their
     names and the packets to which they apply.
 
+    Instances only hold the packet type and the numeric value, names are
+    looked up in tables shared by all instances.
     """
 
+    __slots__ = ("packetType", "value")
+
+    names = _NAMES
+
     def __init__(self, packetType, aName="Success", identifier=-1):
         """
         packetType: the type of the packet, such as PacketTypes.CONNECT that
@@ -43,82 +138,6 @@ class ReasonCodes:
         """
 
         self.packetType = packetType
-        self.names = {
-            0: {"Success": [PacketTypes.CONNACK, PacketTypes.PUBACK,
-                            PacketTypes.PUBREC, PacketTypes.PUBREL, PacketTypes.PUBCOMP,
-                            PacketTypes.UNSUBACK, PacketTypes.AUTH],
-                "Normal disconnection": [PacketTypes.DISCONNECT],
-                "Granted QoS 0": [PacketTypes.SUBACK]},
-            1: {"Granted QoS 1": [PacketTypes.SUBACK]},
-            2: {"Granted QoS 2": [PacketTypes.SUBACK]},
-            4: {"Disconnect with will message": [PacketTypes.DISCONNECT]},
-            16: {"No matching subscribers":
-                 [PacketTypes.PUBACK, PacketTypes.PUBREC]},
-            17: {"No subscription found": [PacketTypes.UNSUBACK]},
-            24: {"Continue authentication": [PacketTypes.AUTH]},
-            25: {"Re-authenticate": [PacketTypes.AUTH]},
-            128: {"Unspecified error": [PacketTypes.CONNACK, PacketTypes.PUBACK,
-                                        PacketTypes.PUBREC, PacketTypes.SUBACK, PacketTypes.UNSUBACK,
-                                        PacketTypes.DISCONNECT], },
-            129: {"Malformed packet":
-                  [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
-            130: {"Protocol error":
-                  [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
-            131: {"Implementation specific error": [PacketTypes.CONNACK,
-                                                    PacketTypes.PUBACK, PacketTypes.PUBREC, PacketTypes.SUBACK,
-                                                    PacketTypes.UNSUBACK, PacketTypes.DISCONNECT], },
-            132: {"Unsupported protocol version": [PacketTypes.CONNACK]},
-            133: {"Client identifier not valid": [PacketTypes.CONNACK]},
-            134: {"Bad user name or password": [PacketTypes.CONNACK]},
-            135: {"Not authorized": [PacketTypes.CONNACK, PacketTypes.PUBACK,
-                                     PacketTypes.PUBREC, PacketTypes.SUBACK, PacketTypes.UNSUBACK,
-                                     PacketTypes.DISCONNECT], },
-            136: {"Server unavailable": [PacketTypes.CONNACK]},
-            137: {"Server busy": [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
-            138: {"Banned": [PacketTypes.CONNACK]},
-            139: {"Server shutting down": [PacketTypes.DISCONNECT]},
-            140: {"Bad authentication method":
-                  [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
-            141: {"Keep alive timeout": [PacketTypes.DISCONNECT]},
-            142: {"Session taken over": [PacketTypes.DISCONNECT]},
-            143: {"Topic filter invalid":
-                  [PacketTypes.SUBACK, PacketTypes.UNSUBACK, PacketTypes.DISCONNECT]},
-            144: {"Topic name invalid":
-                  [PacketTypes.CONNACK, PacketTypes.PUBACK,
-                   PacketTypes.PUBREC, PacketTypes.DISCONNECT]},
-            145: {"Packet identifier in use":
-                  [PacketTypes.PUBACK, PacketTypes.PUBREC,
-                   PacketTypes.SUBACK, PacketTypes.UNSUBACK]},
-            146: {"Packet identifier not found":
-                  [PacketTypes.PUBREL, PacketTypes.PUBCOMP]},
-            147: {"Receive maximum exceeded": [PacketTypes.DISCONNECT]},
-            148: {"Topic alias invalid": [PacketTypes.DISCONNECT]},
-            149: {"Packet too large": [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
-            150: {"Message rate too high": [PacketTypes.DISCONNECT]},
-            151: {"Quota exceeded": [PacketTypes.CONNACK, PacketTypes.PUBACK,
-                                     PacketTypes.PUBREC, PacketTypes.SUBACK, PacketTypes.DISCONNECT], },
-            152: {"Administrative action": [PacketTypes.DISCONNECT]},
-            153: {"Payload format invalid":
-                  [PacketTypes.PUBACK, PacketTypes.PUBREC, PacketTypes.DISCONNECT]},
-            154: {"Retain not supported":
-                  [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
-            155: {"QoS not supported":
-                  [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
-            156: {"Use another server":
-                  [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
-            157: {"Server moved":
-                  [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
-            158: {"Shared subscription not supported":
-                  [PacketTypes.SUBACK, PacketTypes.DISCONNECT]},
-            159: {"Connection rate exceeded":
-                  [PacketTypes.CONNACK, PacketTypes.DISCONNECT]},
-            160: {"Maximum connect time":
-                  [PacketTypes.DISCONNECT]},
-            161: {"Subscription identifiers not supported":
-                  [PacketTypes.SUBACK, PacketTypes.DISCONNECT]},
-            162: {"Wildcard subscription not supported":
-                  [PacketTypes.SUBACK, PacketTypes.DISCONNECT]},
-        }
         if identifier == -1:
             if packetType == PacketTypes.DISCONNECT and aName == "Success":
                 aName = "Normal disconnection"
@@ -135,11 +154,11 @@ class ReasonCodes:
 
         Used when displaying the reason code.
         """
-        assert identifier in self.names.keys(), identifier
-        names = self.names[identifier]
-        namelist = [name for name in names.keys() if packetType in names[name]]
-        assert len(namelist) == 1
-        return namelist[0]
+        name = _NAME_BY_CODE.get((packetType, identifier))
+        if name is None:
+            assert identifier in _NAMES, identifier
+            assert False, "%s is not valid for packet type %s" % (identifier, packetType)
+        return name
 
     def getId(self, name):
         """
@@ -148,12 +167,7 @@ class ReasonCodes:
         Used when setting the reason code for a packetType
         check that only valid codes for the packet are set.
         """
-        identifier = None
-        for code in self.names.keys():
-            if name in self.names[code].keys():
-                if self.packetType in self.names[code][name]:
-                    identifier = code
-                break
+        identifier = _CODE_BY_NAME.get((self.packetType, name))
         assert identifier is not None, name
         return identifier
 
@@ -164,8 +178,8 @@ class ReasonCodes:
         c = buffer[0]
         if sys.version_info[0] < 3:
             c = ord(c)
-        name = self.__getName__(self.packetType, c)
-        self.value = self.getId(name)
+        self.__getName__(self.packetType, c)  # check it's good
+        self.value = c
         return 1
 
     def getName(self):
@@ -177,7 +191,7 @@ class ReasonCodes:
         if isinstance(other, int):
             return self.value == other
         if isinstance(other, str):
-            return self.value == str(self)
+            return other == str(self)
         if isinstance(other, ReasonCodes):
             return self.value == other.value
         return False
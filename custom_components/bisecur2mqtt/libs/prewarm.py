@@ -0,0 +1,131 @@
+import time
+import threading
+from collections import deque
+
+"""
+Gateway pre-warming windows and their bookkeeping
+
+A pre-warm signal (explicit command, HA presence/dashboard topic, learned usage
+time) opens a bounded window during which the bridge keeps an authenticated
+gateway session alive, so a door command arriving in it skips connect + LOGIN.
+PrewarmWindow only tracks the window and the metrics, the bridge does the I/O:
+
+ - open() starts a window or extends the running one, never beyond max_window
+   seconds from now
+ - a window is a hit if a door command started inside it, a miss otherwise
+ - command latencies are kept separately for warm (inside a window) and cold
+   commands; saved = median(cold) - median(warm)
+
+usage_due() is the learned trigger: it looks for commands at the same time of
+day on several distinct days.
+"""
+
+
+def usage_due(command_times, now=None, lead=60.0, days=14, min_days=3):
+    """
+    True if on at least min_days of the last days days a command was sent within
+    lead seconds after the current time of day (command_times are time.time() values)
+    """
+    now = time.time() if now is None else now
+    seen = set()
+    for t in command_times:
+        age = now - t
+        if age <= 0 or age > days * 86400:
+            continue
+        if (t - now) % 86400 <= lead:
+            seen.add(int(age // 86400))
+    return len(seen) >= min_days
+
+
+def _median(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    mid = len(ordered) // 2
+    return ordered[mid] if len(ordered) % 2 else (ordered[mid - 1] + ordered[mid]) / 2
+
+
+class PrewarmWindow:
+    """
+    Thread-safe: opened from the MQTT thread and the scheduler, queried by the
+    keep-alive thread and the command threads
+    """
+
+    def __init__(self, default_window=60.0, max_window=180.0, samples=32):
+        self.default_window = default_window
+        self.max_window = max_window
+        self._lock = threading.Lock()
+        self._until = 0.0
+        self._hit = False
+        self.triggers = {}
+        self.windows = 0
+        self.hits = 0
+        self.misses = 0
+        self.warm_latency = deque(maxlen=samples)
+        self.cold_latency = deque(maxlen=samples)
+
+    def _close_expired(self, now):
+        if self._until and now >= self._until:
+            if not self._hit:
+                self.misses += 1
+            self._until = 0.0
+            self._hit = False
+
+    def open(self, reason, seconds=None, now=None):
+        """
+        Start or extend the window; returns its remaining seconds
+        """
+        now = time.monotonic() if now is None else now
+        seconds = self.default_window if seconds is None else seconds
+        with self._lock:
+            self._close_expired(now)
+            if not self._until:
+                self.windows += 1
+            self.triggers[reason] = self.triggers.get(reason, 0) + 1
+            self._until = max(self._until, now + min(max(seconds, 0.0), self.max_window))
+            return self._until - now
+
+    def remaining(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._close_expired(now)
+            return self._until - now if self._until else 0.0
+
+    def active(self, now=None):
+        return self.remaining(now) > 0
+
+    def command_started(self, now=None):
+        """
+        A door command starts now; True if it is a warm one
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._close_expired(now)
+            if not self._until:
+                return False
+            if not self._hit:
+                self._hit = True
+                self.hits += 1
+            return True
+
+    def record_latency(self, seconds, warm):
+        with self._lock:
+            (self.warm_latency if warm else self.cold_latency).append(seconds)
+
+    def stats(self):
+        with self._lock:
+            self._close_expired(time.monotonic())
+            warm = _median(self.warm_latency)
+            cold = _median(self.cold_latency)
+            return {
+                "active": bool(self._until),
+                "triggers": dict(self.triggers),
+                "windows": self.windows,
+                "hits": self.hits,
+                "misses": self.misses,
+                "warm_commands": len(self.warm_latency),
+                "cold_commands": len(self.cold_latency),
+                "warm_p50": round(warm, 3) if warm is not None else None,
+                "cold_p50": round(cold, 3) if cold is not None else None,
+                "saved_p50": round(cold - warm, 3) if warm is not None and cold is not None else None,
+            }
@@ -274,6 +274,13 @@ class MCPSetState:
     def construct(port_id):
         return MCPSetState(port_id)
 
+    @staticmethod
+    def from_bytes(data):
+        t = MCPSetState(data[0])
+        if len(data) > 1:
+            t.state = data[1]
+        return t
+
     def to_bytes(self):
         data = bytes([self.port_id, self.state])
         return data
@@ -554,6 +561,12 @@ class MCPGetTransition:
         t.port_id = port_id
         return t
 
+    @staticmethod
+    def from_bytes(data):
+        t = MCPGetTransition()
+        t.port_id = data[0]
+        return t
+
     def to_bytes(self):
         return self.port_id.to_bytes(1, byteorder='big', signed=False)
 
@@ -1357,6 +1370,8 @@ Command2MCP = {
     82: MCPWifiFound,
     83: MCPGetWifiState,
 
+    51: MCPSetState,
+
     112: MCPGetTransition,
 
     666: MCPUnknownCommand
@@ -1495,7 +1510,7 @@ class MCPDiscover:
             try:
                 cs.settimeout(1)
                 cs.bind((self.listen_ip, self.listen_port))
-                while not self.close_evt.set():
+                while not self.close_evt.is_set():
                     try:
                         data, addr = cs.recvfrom(65535)
                     except socket.timeout:
@@ -1518,6 +1533,7 @@ class MCPDiscover:
 
         self.send_broadcast()
         self.close_evt.set()
+        lt.join()
 
         if self.devices != {}:
             logging.debug('Found %d devices!' % (len(self.devices)))
@@ -0,0 +1,129 @@
+import os
+import mmap
+import time
+import struct
+import threading
+
+"""
+Binary MCP wire capture
+
+File layout:
+
++--------------------+---------------------------------------------------------------------+
+| MAGIC [8 bytes]    | RECORD ...                                                          |
++--------------------+---------------------------------------------------------------------+
+
+Record (little endian)
+
++-------------------------+------------------+------------------+------------------------+
+|  TIMESTAMP [8, double]  | DIRECTION [1]    | LENGTH [4]       | FRAME [LENGTH bytes]   |
++-------------------------+------------------+------------------+------------------------+
+
+TIMESTAMP is time.monotonic() of the capturing process (only differences are
+meaningful), DIRECTION is SENT or RECEIVED and FRAME is the raw MCP packet
+(already hex-decoded, i.e. half the size seen on the socket).
+"""
+
+MAGIC = b'MCPCAP01'
+RECORD = struct.Struct('<dBI')
+
+SENT = 0
+RECEIVED = 1
+
+
+class CaptureRecord:
+    __slots__ = ('timestamp', 'direction', 'frame')
+
+    def __init__(self, timestamp, direction, frame):
+        self.timestamp = timestamp
+        self.direction = direction
+        self.frame = frame
+
+    def wire_bytes(self):
+        """
+        The frame as seen on the socket (double hex-encoded), ready for MCPPacket.from_bytes
+        """
+        return bytes(self.frame).hex().upper().encode()
+
+    def __repr__(self):
+        return 'CaptureRecord(%.6f, %s, %d bytes)' % (
+            self.timestamp, 'SENT' if self.direction == SENT else 'RECEIVED', len(self.frame))
+
+
+class CaptureWriter:
+    """
+    Appends frames to a capture file; shared safely between threads
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.fh = open(path, 'ab')
+        if self.fh.tell() == 0:
+            self.fh.write(MAGIC)
+            self.fh.flush()
+
+    def write(self, direction, wire_frame, timestamp=None):
+        frame = bytes.fromhex(wire_frame.decode())
+        record = RECORD.pack(time.monotonic() if timestamp is None else timestamp, direction, len(frame)) + frame
+        with self._lock:
+            if self.fh is None:
+                return
+            self.fh.write(record)
+            self.fh.flush()
+
+    def close(self):
+        with self._lock:
+            if self.fh is not None:
+                self.fh.close()
+                self.fh = None
+
+
+class CaptureReader:
+    """
+    Memory-mapped, zero-copy reader: iterated record frames are memoryviews into
+    the map and must be dropped before close()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fh = open(path, 'rb')
+        self.map = None
+        self.view = memoryview(b'')
+        if os.fstat(self.fh.fileno()).st_size > 0:
+            self.map = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.map)
+        if len(self.view) and self.view[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError('%s is not an MCP capture file' % path)
+
+    def __iter__(self):
+        view = self.view
+        pos = len(MAGIC)
+        end = len(view)
+        while pos + RECORD.size <= end:
+            timestamp, direction, length = RECORD.unpack_from(view, pos)
+            pos += RECORD.size
+            if pos + length > end:
+                break  # truncated last record (capture still being written / crash)
+            yield CaptureRecord(timestamp, direction, view[pos:pos + length])
+            pos += length
+
+    def records(self):
+        """
+        Detached copies (frames as bytes), still usable after close()
+        """
+        return [CaptureRecord(r.timestamp, r.direction, bytes(r.frame)) for r in self]
+
+    def close(self):
+        self.view.release()
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,11 +1,22 @@
+import time
 import socket
 import logging
 
 from libs.pysecur3.MCP import *
+from libs.pysecur3.errors import *
+from libs.pysecur3.rtt import RTTEstimator
+from libs.pysecur3.capture import CaptureWriter, SENT, RECEIVED
+from libs.pysecur3.discovery import discover
 
 
 class MCPClient:
-    def __init__(self, ip, port, src_mac, dst_mac):
+    """
+    Every request method accepts an optional deadline: an absolute time.monotonic()
+    value. A request whose deadline already passed is not sent at all, and socket
+    timeouts never extend past it (MCPDeadlineExceeded).
+    """
+
+    def __init__(self, ip, port, src_mac, dst_mac, rtt=None, capture=None):
         self.gw_ip = ip
         self.gw_port = port
         self.src_mac = src_mac
@@ -19,20 +30,42 @@ class MCPClient:
 
         self.last_error = None
 
+        # may be shared between clients so the RTT history survives reconnects
+        self.rtt = rtt if rtt is not None else RTTEstimator()
+        # optional wire capture (CaptureWriter or file path), see libs/pysecur3/replay.py
+        self.capture = CaptureWriter(capture) if isinstance(capture, str) else capture
+
     def load_login(self, token, tag=0):
         self.tag = tag
         self.token = token
 
+    @staticmethod
+    def command_id_of(cmd):
+        if isinstance(cmd, MCPGenericCommand):
+            return cmd.command_id
+        return MCP2Command.get(cmd.__class__)
+
     def construct_packet(self, cmd):
         payload = MCP.construct(cmd, tag=self.tag, token=self.token)
         packet = MCPPacket.construct(self.src_mac, self.dst_mac, payload)
         return packet.to_bytes()
 
-    def connect(self):
-        logging.debug('Connecting to %s:%d' % (self.gw_ip, self.gw_port))
+    def connect(self, deadline=None):
+        logging.debug('Connecting to %s:%d', self.gw_ip, self.gw_port)
+        timeout = self.rtt.max_timeout  # 5 сек для медленных шлюзов
+        if deadline is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                raise MCPDeadlineExceeded('Deadline passed before connecting')
+            timeout = min(timeout, self.rtt.max_timeout)
         self.soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.soc.settimeout(5)  # Увеличен до 5 сек для медленных шлюзов
-        self.soc.connect((self.gw_ip, self.gw_port))
+        self.soc.settimeout(timeout)
+        try:
+            self.soc.connect((self.gw_ip, self.gw_port))
+        except socket.error as e:
+            self.disconnect()
+            self.last_error = transport_error(e)
+            raise self.last_error from e
 
     def is_connected(self):
         """Check if socket is still connected."""
@@ -55,11 +88,11 @@ class MCPClient:
             self.soc = None
             self.socbuff = b''
 
-    def reconnect(self):
+    def reconnect(self, deadline=None):
         """Reconnect to the gateway."""
         logging.debug('Reconnecting to gateway...')
         self.disconnect()
-        self.connect()
+        self.connect(deadline)
 
     # def recv_cmd(self, throw=True):
     #     self.last_error = None
@@ -102,14 +135,17 @@ class MCPClient:
     #             response_packet.payload.command.error_code.value, response_packet.payload.command.error_code.name))
     #     return response_packet
 
-    def recv_cmd(self,throw=True):
+    def recv_cmd(self,throw=True,deadline=None,command_id=None):
     	self.last_error = None
     	logging.debug('Switched to receive mode: Awaiting previous command response packets')
     	buff = b''
     	total_len = None
-    	timeout_count = 0
-    	MAX_TIMEOUT_COUNT = 3  # Уменьшено для быстрого выхода при ошибке
-    	while True and timeout_count < MAX_TIMEOUT_COUNT:
+    	transport_exc = None
+    	# Одно общее ожидание вместо 3 таймаутов по 5с: таймаут из RTT этой команды, не дальше deadline
+    	started = time.monotonic()
+    	timeout = self.rtt.timeout(command_id, deadline)
+    	wait_until = started + timeout
+    	while True:
     		try:
     			if not total_len:
     				if len(self.socbuff) >= 28:
@@ -122,54 +158,118 @@ class MCPClient:
     					self.socbuff = self.socbuff[total_len:]
     					break
 
+    			remaining = wait_until - time.monotonic()
+    			if remaining <= 0:
+    				raise socket.timeout('timed out after %.2fs' % timeout)
+    			self.soc.settimeout(remaining)
     			temp = self.soc.recv(4096)
     			if not temp:
+    				transport_exc = MCPConnectionLost('Connection closed by gateway')
+    				self.soc = None
     				break
 
     			self.socbuff += temp
     		except socket.error as e:
-    			timeout_count += 1
-    			logging.warn(f"MCPClient.recv_cmd() socket error ({timeout_count}/{MAX_TIMEOUT_COUNT}): {e}")
-    			self.last_error = {"value": f"Socket timeout ({timeout_count}/{MAX_TIMEOUT_COUNT})", "code": -1}
+    			logging.warn(f"MCPClient.recv_cmd() socket error: {e}")
+    			transport_exc = transport_error(e)
+    			if isinstance(transport_exc, MCPTimeout):
+    				if deadline is not None and time.monotonic() >= deadline:
+    					transport_exc = MCPDeadlineExceeded('Deadline passed while waiting for response')
+    				else:
+    					self.rtt.record(command_id, timeout)  # backoff: следующий запрос ждёт дольше
     			# При Connection reset - сразу выходим, сокет мёртв
-    			if "reset by peer" in str(e).lower() or "errno 104" in str(e).lower():
+    			elif isinstance(transport_exc, MCPConnectionLost):
     				logging.warn("Connection reset by peer - socket is dead, exiting")
     				self.soc = None  # Пометить сокет как мёртвый
-    				break
+    			break
     		except Exception as e:
     			logging.error(f"client.py exception (line 60): {e}")
+    			transport_exc = MCPTransportError(str(e))
     			break
 
     	# Проверка что данные получены
     	if not buff:
     		logging.error("No data received from gateway")
-    		return None
-
-    	logging.debug('Data received: %s' % buff)
-    	logging.debug('Data received: %s' % bytes.fromhex(buff.decode()))
+    		self.last_error = transport_exc or MCPTimeout('No data received from gateway')
+    		raise self.last_error
+
+    	self.rtt.record(command_id, time.monotonic() - started)
+    	if self.capture is not None:
+    		self.capture.write(RECEIVED, buff)
+    	if logging.getLogger().isEnabledFor(logging.DEBUG):
+    		logging.debug('Data received: %s', buff)
+    		logging.debug('Data received: %s', bytes.fromhex(buff.decode()))
     	response_packet = MCPPacket.from_bytes(buff)
 
     	if throw == True and response_packet.payload.command_id == 1:
-    		self.last_error = response_packet.payload.command.error_code
-    		raise Exception('Device responded with error! Code: %d Reason: %s' % (response_packet.payload.command.error_code.value, response_packet.payload.command.error_code.name))
+    		self.last_error = MCPDeviceError.from_code(response_packet.payload.command.error_code)
+    		raise self.last_error
 
     	return response_packet
 
-    def sr(self, cmd, throw=True):
+    def sr(self, cmd, throw=True, deadline=None):
+        if deadline is not None and time.monotonic() >= deadline:
+            self.last_error = MCPDeadlineExceeded('Deadline passed before sending')
+            raise self.last_error
         if not self.soc:
-            self.connect()
+            self.connect(deadline)
         self.last_error = None
         packet_bytes = self.construct_packet(cmd)
-        logging.debug('Sending bytes: %s' % packet_bytes)
-        self.soc.sendall(packet_bytes)
-        return self.recv_cmd(throw)
+        logging.debug('Sending bytes: %s', packet_bytes)
+        try:
+            self.soc.sendall(packet_bytes)
+        except socket.error as e:
+            self.soc = None
+            self.last_error = transport_error(e)
+            raise self.last_error from e
+        if self.capture is not None:
+            self.capture.write(SENT, packet_bytes)
+        return self.recv_cmd(throw, deadline, self.command_id_of(cmd))
+
+    def sr_many(self, cmds, deadline=None):
+        """
+        Pipelined sr(): all frames go out in one write, then the responses are
+        read in request order (the gateway answers one frame after the other).
 
-    def login(self, username, password):
+        Returns a list with the response packet, or the MCPDeviceError the
+        gateway answered with, for each command. Transport errors (and the
+        deadline) abort the whole batch: they are raised like in sr(), the
+        frames after the failing response may or may not have been executed.
+        """
+        if not cmds:
+            return []
+        if deadline is not None and time.monotonic() >= deadline:
+            self.last_error = MCPDeadlineExceeded('Deadline passed before sending')
+            raise self.last_error
+        if not self.soc:
+            self.connect(deadline)
+        self.last_error = None
+        packets = [self.construct_packet(cmd) for cmd in cmds]
+        logging.debug('Sending %d pipelined packets: %s', len(packets), packets)
+        try:
+            self.soc.sendall(b''.join(packets))
+        except socket.error as e:
+            self.soc = None
+            self.last_error = transport_error(e)
+            raise self.last_error from e
+        if self.capture is not None:
+            for packet_bytes in packets:
+                self.capture.write(SENT, packet_bytes)
+
+        results = []
+        for cmd in cmds:
+            resp = self.recv_cmd(False, deadline, self.command_id_of(cmd))
+            if resp.payload.command_id == 1:
+                resp = MCPDeviceError.from_code(resp.payload.command.error_code)
+            results.append(resp)
+        return results
+
+    def login(self, username, password, deadline=None):
         logging.debug('Login called!')
         logging.debug('Crafing packet')
         cmd = MCPLogin.construct(username, password)
 
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
 
         if isinstance(resp.payload.command, MCPLoginResponse):
@@ -177,173 +277,190 @@ class MCPClient:
             self.tag = resp.payload.command.auth_tag
 
         elif isinstance(resp.payload.command, MCPLogout):
-            resp = self.recv_cmd()
+            resp = self.recv_cmd(deadline=deadline, command_id=self.command_id_of(cmd))
             self.token = resp.payload.command.auth_token
             self.tag = resp.payload.command.auth_tag
 
         return {"token": self.token, "tag": self.tag}
 
-    def get_user_rights(self):
+    def get_user_rights(self, deadline=None):
         logging.debug('get_user_rights')
         cmd = MCPGetUserRights.construct()
 
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
         return resp
 
-    def jcmp(self, request, throw_errors=True):
+    def jcmp(self, request, throw_errors=True, deadline=None):
         """
 		request needs to be a dict
 		"""
         logging.debug('jcmp')
         cmd = JCMP.construct(request)
-        resp = self.sr(cmd, throw_errors)
+        resp = self.sr(cmd, throw_errors, deadline)
         logging.debug(resp)
         return resp
 
-    def get_wifi_state(self):
+    def get_wifi_state(self, deadline=None):
         logging.debug('get_wifi_state')
         cmd = MCPGetWifiState.construct()
 
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
         return resp
 
-    def scan_wifi(self):
+    def scan_wifi(self, deadline=None):
         logging.debug('scan_wifi')
         cmd = MCPScanWifi.construct()
 
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
 
         while resp.payload.payload != b'':
-            resp = self.recv_cmd()
+            resp = self.recv_cmd(deadline=deadline, command_id=self.command_id_of(cmd))
             logging.debug(resp)
         return resp
 
-    def wifi_found(self, data):
+    def wifi_found(self, data, deadline=None):
         logging.debug('wifi_found')
         cmd = MCPWifiFound.construct(data)
 
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
         return resp
 
-    def get_gw_version(self, throw_errors=True):
+    def get_gw_version(self, throw_errors=True, deadline=None):
         logging.debug('get_gw_version')
         cmd = MCPGETGWVersion.construct()
 
-        resp = self.sr(cmd, throw_errors)
+        resp = self.sr(cmd, throw_errors, deadline)
         logging.debug(resp)
         return resp
 
-    def generic(self, cmd, throw_errors=True):
+    def generic(self, cmd, throw_errors=True, deadline=None):
         logging.debug('generic')
-        resp = self.sr(cmd, throw_errors)
+        resp = self.sr(cmd, throw_errors, deadline)
         logging.debug(resp)
         return resp
 
-    def logout(self):
+    def logout(self, deadline=None):
         logging.debug('logout')
         cmd = MCPLogout.construct()
 
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
         return resp
 
-    def get_user_name(self, user_id):
+    def get_user_name(self, user_id, deadline=None):
         logging.debug('get_user_name')
 
         cmd = MCPGetUserName.construct(user_id)
 
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
         return resp
 
-    def add_user(self, username, password, owerflow=None):
+    def add_user(self, username, password, owerflow=None, deadline=None):
         logging.debug('add_user')
         cmd = MCPAddUser.construct(username, password, owerflow)
 
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
         return resp
 
-    def change_password_of_user(self, user_id, newpassword):
+    def change_password_of_user(self, user_id, newpassword, deadline=None):
         logging.debug('change_password_of_user')
         cmd = MCPChangePasswordOfUser.construct(user_id, newpassword)
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
         return resp
 
-    def change_password(self, newpassword):
+    def change_password(self, newpassword, deadline=None):
         logging.debug('change_password')
         cmd = MCPChangePassword.construct(newpassword)
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
         return resp
 
-    def set_name(self, name):
+    def set_name(self, name, deadline=None):
         logging.debug('set_name')
         cmd = MCPSetName.construct(name)
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
         return resp
 
-    def debug(self, data):
+    def debug(self, data, deadline=None):
         logging.debug('debug')
         cmd = MCPDebug.construct(data)
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
         return resp
 
-    def get_mac(self):
+    def get_mac(self, deadline=None):
         logging.debug('get_mac')
         cmd = MCPGetMAC.construct()
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
         return resp
 
-    def ping(self):
+    def ping(self, deadline=None):
         logging.debug('ping')
         cmd = MCPPing.construct()
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
         return resp
 
-    def set_user_rights(self, user_id, user_rights):
+    def set_user_rights(self, user_id, user_rights, deadline=None):
         logging.debug('set_user_rights')
         cmd = MCPSetUserRights.construct(user_id, user_rights)
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
         return resp
 
-    def get_user_ids(self):
+    def get_user_ids(self, deadline=None):
         logging.debug('get_user_ids')
         cmd = MCPGetUserIds.construct()
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
         return resp
 
-    def remove_user(self, user_id):
+    def remove_user(self, user_id, deadline=None):
         logging.debug('remove_user')
         cmd = MCPRemoveUser.construct(user_id)
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
         return resp
 
-    def get_transition(self, port_id):
+    def get_transition(self, port_id, deadline=None):
         logging.debug('get_transition')
         cmd = MCPGetTransition.construct(port_id)
-        resp = self.sr(cmd)
+        resp = self.sr(cmd, deadline=deadline)
         logging.debug(resp)
         return resp
 
+    def get_transitions(self, port_ids, deadline=None):
+        """
+        get_transition() for several ports in one round trip: {port_id: response or MCPDeviceError}
+        """
+        logging.debug('get_transitions %s', port_ids)
+        port_ids = list(port_ids)
+        resps = self.sr_many([MCPGetTransition.construct(port_id) for port_id in port_ids], deadline=deadline)
+        return dict(zip(port_ids, resps))
+
+    def set_states(self, port_ids, deadline=None):
+        """
+        MCPSetState (impulse) for several ports, pipelined: {port_id: response or MCPDeviceError}
+        """
+        logging.debug('set_states %s', port_ids)
+        port_ids = list(port_ids)
+        resps = self.sr_many([MCPSetState.construct(port_id) for port_id in port_ids], deadline=deadline)
+        return dict(zip(port_ids, resps))
+
     @staticmethod
-    def discover_devices(self):
-        disc = MCPDiscover()
-        disc.run()
-
-        if len(disc.devices) > 0:
-            for ip in disc.devices:
-                print('Found device of version %s on address %s' % (disc.devices[ip], ip))
-        return disc.devices
+    def discover_devices(mac=None):
+        devices = discover(mac)
+
+        if len(devices) > 0:
+            for ip in devices:
+                print('Found device of version %s on address %s' % (devices[ip], ip))
+        return devices
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import socket
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import xml.etree.ElementTree as etree
+
+from libs.pysecur3.MCP import MCPDeviceAttrs
+
+"""
+Asynchronous gateway discovery
+
+Same wire protocol as MCPDiscover (XML <Discover target="LogicBox"/> broadcast to
+UDP 4001, gateways answer on UDP 4002), but:
+ - returns as soon as the wanted MAC answered instead of always waiting 4 x 2 s
+ - re-broadcasts on a short exponential schedule (0.25, 0.5, 1, 2 s by default)
+ - DiscoveryCache keeps MAC -> IP on disk so a restart does not need to broadcast
+"""
+
+BROADCAST_PORT = 4001
+LISTEN_PORT = 4002
+DISCOVERY_SCHEDULE = (0.25, 0.5, 1.0, 2.0)  # wait after each broadcast before sending the next one
+
+
+def normalize_mac(mac):
+    """
+    'aa:bb:cc:dd:ee:ff', 'AABBCCDDEEFF' or 6 raw bytes -> 'AABBCCDDEEFF'
+    """
+    if isinstance(mac, (bytes, bytearray)):
+        return mac.hex().upper()
+    return mac.replace(':', '').replace('-', '').upper()
+
+
+class _DiscoveryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, wanted_mac):
+        self.wanted_mac = wanted_mac
+        self.devices = {}
+        self.found = asyncio.Event()
+
+    def datagram_received(self, data, addr):
+        try:
+            dev = MCPDeviceAttrs.from_xml(data.decode())
+        except Exception:
+            return  # our own broadcast or garbage
+        logging.debug('Discovery answer from %s: %s', addr[0], dev)
+        self.devices[addr[0]] = dev
+        if self.wanted_mac is not None and normalize_mac(dev.mac) == self.wanted_mac:
+            self.found.set()
+
+
+async def discover_async(mac=None, schedule=DISCOVERY_SCHEDULE, listen_ip='', broadcast_ip='255.255.255.255'):
+    """
+    Broadcasts discovery requests and returns {ip: MCPDeviceAttrs}.
+    With mac given, returns right after that gateway answered.
+    """
+    wanted = normalize_mac(mac) if mac else None
+    root = etree.Element('Discover')
+    root.attrib['target'] = 'LogicBox'
+    request = etree.tostring(root)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.bind((listen_ip, LISTEN_PORT))
+        sock.setblocking(False)
+
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(lambda: _DiscoveryProtocol(wanted), sock=sock)
+    except BaseException:
+        sock.close()  # the transport owns the socket only once created
+        raise
+    try:
+        for wait in schedule:
+            transport.sendto(request, (broadcast_ip, BROADCAST_PORT))
+            try:
+                await asyncio.wait_for(protocol.found.wait(), wait)
+                break
+            except asyncio.TimeoutError:
+                continue
+    finally:
+        transport.close()
+
+    logging.debug('Discovery found %d devices', len(protocol.devices))
+    return protocol.devices
+
+
+def discover(mac=None, schedule=DISCOVERY_SCHEDULE, listen_ip='', broadcast_ip='255.255.255.255'):
+    """
+    Blocking wrapper around discover_async. Called from a running event loop
+    (MQTT asyncio mode callbacks) it runs its own loop in a worker thread, as
+    asyncio.run() cannot be nested.
+    """
+    def run():
+        return asyncio.run(discover_async(mac, schedule, listen_ip, broadcast_ip))
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return run()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='discovery') as pool:
+        return pool.submit(run).result()
+
+
+class DiscoveryCache:
+    """
+    MAC -> IP map persisted as JSON ({"AABBCCDDEEFF": {"ip": "...", "ts": ...}})
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning('Ignoring unreadable discovery cache %s: %s', path, e)
+
+    def get(self, mac):
+        entry = self.entries.get(normalize_mac(mac))
+        return entry["ip"] if entry else None
+
+    def put(self, mac, ip):
+        with self._lock:
+            self.entries[normalize_mac(mac)] = {"ip": ip, "ts": int(time.time())}
+            if not self.path:
+                return
+            tmp = self.path + '.tmp'
+            try:
+                with open(tmp, 'w') as f:
+                    json.dump(self.entries, f)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                logging.warning('Cannot write discovery cache %s: %s', self.path, e)
+
+    def resolve(self, mac, refresh=False, **discover_kwargs):
+        """
+        IP of the gateway with this MAC: cached unless refresh, otherwise discovered (and cached)
+        """
+        mac = normalize_mac(mac)
+        if not refresh:
+            ip = self.get(mac)
+            if ip:
+                return ip
+        for ip, dev in discover(mac, **discover_kwargs).items():
+            if normalize_mac(dev.mac) == mac:
+                self.put(mac, ip)
+                return ip
+        return None
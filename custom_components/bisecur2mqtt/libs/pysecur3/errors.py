@@ -0,0 +1,194 @@
+import socket
+
+from libs.pysecur3.MCP import MCPError
+
+"""
+Typed exceptions raised by MCPClient
+
+MCPException
+ +-- MCPTransportError         socket level failures (connect/send/recv)
+ |    +-- MCPTimeout           gateway did not answer in time
+ |    |    +-- MCPDeadlineExceeded  caller's deadline passed, request abandoned
+ |    +-- MCPConnectionLost    reset by peer, broken pipe, closed socket
+ +-- MCPDeviceError            gateway answered with an MCPErrorResponse
+      +-- MCPBusyError         PORT_ERROR, GATEWAY_BUSY, ADAPTER_BUSY
+      +-- MCPAuthError         INVALID_TOKEN, PERMISSION_DENIED
+      +-- MCPCredentialsError  LOGIN_FAILED, INVALID_PASSWORD, INVALID_USERNAME
+      +-- ...                  one class per remaining MCPError code
+"""
+
+
+class MCPException(Exception):
+    pass
+
+
+class MCPTransportError(MCPException):
+    pass
+
+
+class MCPTimeout(MCPTransportError):
+    pass
+
+
+class MCPDeadlineExceeded(MCPTimeout):
+    pass
+
+
+class MCPConnectionLost(MCPTransportError):
+    pass
+
+
+class MCPDeviceError(MCPException):
+    error_code = None
+
+    def __init__(self, error_code=None):
+        if error_code is not None:
+            self.error_code = error_code
+        MCPException.__init__(self, 'Device responded with error! Code: %d Reason: %s' % (
+            self.error_code.value, self.error_code.name))
+
+    @staticmethod
+    def from_code(error_code):
+        """
+        Returns the exception instance matching an MCPError code (or raw int)
+        """
+        try:
+            error_code = MCPError(error_code)
+        except ValueError:
+            return MCPUnknownDeviceError(error_code)
+        return MCPError2Exception[error_code]()
+
+
+class MCPUnknownDeviceError(MCPDeviceError):
+    def __init__(self, error_code):
+        self.error_code = error_code
+        MCPException.__init__(self, 'Device responded with unknown error code %s' % error_code)
+
+
+class MCPBusyError(MCPDeviceError):
+    pass
+
+
+class MCPAuthError(MCPDeviceError):
+    pass
+
+
+class MCPCredentialsError(MCPDeviceError):
+    pass
+
+
+class MCPCommandNotFound(MCPDeviceError):
+    error_code = MCPError.COMMAND_NOT_FOUND
+
+
+class MCPInvalidProtocol(MCPDeviceError):
+    error_code = MCPError.INVALID_PROTOCOL
+
+
+class MCPLoginFailed(MCPCredentialsError):
+    error_code = MCPError.LOGIN_FAILED
+
+
+class MCPInvalidToken(MCPAuthError):
+    error_code = MCPError.INVALID_TOKEN
+
+
+class MCPUserAlreadyExists(MCPDeviceError):
+    error_code = MCPError.USER_ALREADY_EXISTS
+
+
+class MCPNoEmptyUserSlot(MCPDeviceError):
+    error_code = MCPError.NO_EMPTY_USER_SLOT
+
+
+class MCPInvalidPassword(MCPCredentialsError):
+    error_code = MCPError.INVALID_PASSWORD
+
+
+class MCPInvalidUsername(MCPCredentialsError):
+    error_code = MCPError.INVALID_USERNAME
+
+
+class MCPUserNotFound(MCPDeviceError):
+    error_code = MCPError.USER_NOT_FOUND
+
+
+class MCPPortNotFound(MCPDeviceError):
+    error_code = MCPError.PORT_NOT_FOUND
+
+
+class MCPPortError(MCPBusyError):
+    error_code = MCPError.PORT_ERROR
+
+
+class MCPGatewayBusy(MCPBusyError):
+    error_code = MCPError.GATEWAY_BUSY
+
+
+class MCPPermissionDenied(MCPAuthError):
+    error_code = MCPError.PERMISSION_DENIED
+
+
+class MCPNoEmptyGroupSlot(MCPDeviceError):
+    error_code = MCPError.NO_EMPTY_GROUP_SLOT
+
+
+class MCPGroupNotFound(MCPDeviceError):
+    error_code = MCPError.GROUP_NOT_FOUND
+
+
+class MCPInvalidPayload(MCPDeviceError):
+    error_code = MCPError.INVALID_PAYLOAD
+
+
+class MCPOutOfRange(MCPDeviceError):
+    error_code = MCPError.OUT_OF_RANGE
+
+
+class MCPAddPortError(MCPDeviceError):
+    error_code = MCPError.ADD_PORT_ERROR
+
+
+class MCPNoEmptyPortSlot(MCPDeviceError):
+    error_code = MCPError.NO_EMPTY_PORT_SLOT
+
+
+class MCPAdapterBusy(MCPBusyError):
+    error_code = MCPError.ADAPTER_BUSY
+
+
+MCPError2Exception = {
+    MCPError.COMMAND_NOT_FOUND: MCPCommandNotFound,
+    MCPError.INVALID_PROTOCOL: MCPInvalidProtocol,
+    MCPError.LOGIN_FAILED: MCPLoginFailed,
+    MCPError.INVALID_TOKEN: MCPInvalidToken,
+    MCPError.USER_ALREADY_EXISTS: MCPUserAlreadyExists,
+    MCPError.NO_EMPTY_USER_SLOT: MCPNoEmptyUserSlot,
+    MCPError.INVALID_PASSWORD: MCPInvalidPassword,
+    MCPError.INVALID_USERNAME: MCPInvalidUsername,
+    MCPError.USER_NOT_FOUND: MCPUserNotFound,
+    MCPError.PORT_NOT_FOUND: MCPPortNotFound,
+    MCPError.PORT_ERROR: MCPPortError,
+    MCPError.GATEWAY_BUSY: MCPGatewayBusy,
+    MCPError.PERMISSION_DENIED: MCPPermissionDenied,
+    MCPError.NO_EMPTY_GROUP_SLOT: MCPNoEmptyGroupSlot,
+    MCPError.GROUP_NOT_FOUND: MCPGroupNotFound,
+    MCPError.INVALID_PAYLOAD: MCPInvalidPayload,
+    MCPError.OUT_OF_RANGE: MCPOutOfRange,
+    MCPError.ADD_PORT_ERROR: MCPAddPortError,
+    MCPError.NO_EMPTY_PORT_SLOT: MCPNoEmptyPortSlot,
+    MCPError.ADAPTER_BUSY: MCPAdapterBusy,
+}
+
+
+def transport_error(exc):
+    """
+    Wraps a socket level exception into the matching MCPTransportError
+    """
+    if isinstance(exc, MCPException):
+        return exc
+    if isinstance(exc, socket.timeout):
+        return MCPTimeout(str(exc) or 'timed out')
+    if isinstance(exc, ConnectionError):
+        return MCPConnectionLost(str(exc))
+    return MCPTransportError(str(exc))
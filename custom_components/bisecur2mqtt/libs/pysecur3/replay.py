@@ -0,0 +1,219 @@
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+
+from libs.pysecur3.MCP import MCP, MCPPacket, MCPCommand
+from libs.pysecur3.capture import CaptureReader, SENT, RECEIVED
+
+"""
+Offline replay of MCP wire captures (MCPClient(..., capture=path) / --mcp_capture)
+
+    cd custom_components/bisecur2mqtt
+    python3 -m libs.pysecur3.replay capture.bin               # decode + latency summary
+    python3 -m libs.pysecur3.replay capture.bin --verbose     # ... and every packet
+    python3 -m libs.pysecur3.replay capture.bin --serve 4000  # scripted fake gateway on port 4000
+
+The scripted gateway answers the n-th request with the responses recorded after the
+n-th sent frame, after the recorded delay (scaled by --speed, 0 = no delay), so a
+real-world timing trace can be pointed at MCPClient as a repeatable regression test.
+"""
+
+# command id position inside the decoded frame: SRC MAC + DST MAC + LENGTH + TAG + TOKEN
+COMMAND_OFFSET = 12 + MCP.COMMAND_POS
+
+
+def command_id_of(frame):
+    return frame[COMMAND_OFFSET] & 0x7F
+
+
+def command_name(command_id):
+    try:
+        return MCPCommand(command_id).name
+    except ValueError:
+        return str(command_id)
+
+
+def decode(path, verbose=False):
+    """
+    Feeds every recorded frame through MCPPacket.from_bytes and pairs requests with
+    their responses. Returns a summary dict.
+    """
+    summary = {"records": 0, "sent": 0, "received": 0, "decode_errors": 0, "decode_us_avg": 0.0, "latency": {}}
+    decode_time = 0.0
+    first_ts = None
+    pending = None  # (command_id, timestamp) of the last unanswered request
+
+    with CaptureReader(path) as reader:
+        for record in reader:
+            if first_ts is None:
+                first_ts = record.timestamp
+            summary["records"] += 1
+            summary["sent" if record.direction == SENT else "received"] += 1
+            command_id = command_id_of(record.frame)
+
+            start = time.perf_counter()
+            try:
+                packet = MCPPacket.from_bytes(record.wire_bytes())
+            except Exception as e:
+                packet = None
+                summary["decode_errors"] += 1
+                if verbose:
+                    print('%10.3f  %s  %-20s  decode error: %s' % (
+                        record.timestamp - first_ts, '>>' if record.direction == SENT else '<<',
+                        command_name(command_id), e))
+            decode_time += time.perf_counter() - start
+
+            if record.direction == SENT:
+                pending = (command_id, record.timestamp)
+            elif pending is not None:
+                stats = summary["latency"].setdefault(command_name(pending[0]), {"n": 0, "avg": 0.0, "max": 0.0})
+                latency = record.timestamp - pending[1]
+                stats["avg"] = (stats["avg"] * stats["n"] + latency) / (stats["n"] + 1)
+                stats["max"] = max(stats["max"], latency)
+                stats["n"] += 1
+                pending = None
+
+            if verbose and packet is not None:
+                print('%10.3f  %s  %-20s  %d bytes' % (
+                    record.timestamp - first_ts, '>>' if record.direction == SENT else '<<',
+                    command_name(command_id), len(record.frame)))
+            del record
+
+    if summary["records"]:
+        summary["decode_us_avg"] = round(decode_time / summary["records"] * 1e6, 2)
+    for stats in summary["latency"].values():
+        stats["avg"] = round(stats["avg"], 4)
+        stats["max"] = round(stats["max"], 4)
+    return summary
+
+
+def split_frames(buff):
+    """
+    Splits a hex encoded socket stream into complete frames, returns (frames, rest)
+    """
+    frames = []
+    while len(buff) >= 28:
+        total_len = int.from_bytes(bytes.fromhex(buff[:28].decode())[12:14], byteorder='big', signed=False)
+        total_len = (total_len * 2) + 13 * 2
+        if len(buff) < total_len:
+            break
+        frames.append(buff[:total_len])
+        buff = buff[total_len:]
+    return frames, buff
+
+
+class ScriptedGateway:
+    """
+    Fake gateway that replays the responses of a capture, one script step per request
+    """
+
+    def __init__(self, path, host='127.0.0.1', port=0, speed=1.0):
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.script = []  # [(request command id, [(delay, wire bytes), ...]), ...]
+        self.cursor = 0
+        self.mismatches = 0
+        self.soc = None
+        self.close_evt = threading.Event()
+
+        with CaptureReader(path) as reader:
+            for record in reader.records():
+                if record.direction == SENT:
+                    self.script.append((command_id_of(record.frame), record.timestamp, []))
+                elif self.script:
+                    command_id, sent_ts, responses = self.script[-1]
+                    responses.append((record.timestamp - sent_ts, record.wire_bytes()))
+        self.script = [(command_id, responses) for command_id, _, responses in self.script]
+
+    def start(self):
+        self.soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.soc.bind((self.host, self.port))
+        self.soc.listen(1)
+        self.soc.settimeout(0.5)
+        self.port = self.soc.getsockname()[1]
+        t = threading.Thread(target=self.serve, name='mcp_scripted_gateway', daemon=True)
+        t.start()
+        return self.port
+
+    def stop(self):
+        self.close_evt.set()
+
+    def done(self):
+        return self.cursor >= len(self.script)
+
+    def serve(self):
+        with self.soc:
+            while not self.close_evt.is_set() and not self.done():
+                try:
+                    conn, addr = self.soc.accept()
+                except socket.timeout:
+                    continue
+                with conn:
+                    self.handle(conn)
+
+    def handle(self, conn):
+        conn.settimeout(0.5)
+        buff = b''
+        while not self.close_evt.is_set() and not self.done():
+            try:
+                data = conn.recv(4096)
+            except socket.timeout:
+                continue
+            if not data:
+                return
+            frames, buff = split_frames(buff + data)
+            for frame in frames:
+                command_id, responses = self.script[self.cursor]
+                self.cursor += 1
+                got = command_id_of(bytes.fromhex(frame.decode()))
+                if got != command_id:
+                    self.mismatches += 1
+                    logging.warning('ScriptedGateway: step %d expected %s, got %s',
+                                    self.cursor, command_name(command_id), command_name(got))
+                elapsed = 0.0
+                for delay, wire in responses:
+                    if self.speed:
+                        time.sleep(max(delay * self.speed - elapsed, 0))
+                        elapsed = delay * self.speed
+                    conn.sendall(wire)
+                if not responses:
+                    return  # the gateway never answered this one: drop the connection like it did
+                if self.done():
+                    return
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay an MCP wire capture')
+    parser.add_argument('capture')
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--serve', type=int, metavar='PORT', help='serve the capture as a scripted fake gateway')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--speed', type=float, default=1.0, help='delay multiplier for --serve (0 = no delays)')
+    opts = parser.parse_args(argv)
+
+    if opts.serve is None:
+        print(json.dumps(decode(opts.capture, opts.verbose), indent=2))
+        return 0
+
+    logging.basicConfig(level=logging.INFO)
+    gw = ScriptedGateway(opts.capture, opts.host, opts.serve, opts.speed)
+    port = gw.start()
+    print('Serving %d scripted requests on %s:%d' % (len(gw.script), opts.host, port))
+    try:
+        while not gw.done():
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        pass
+    gw.stop()
+    print('Served %d/%d steps, %d mismatches' % (gw.cursor, len(gw.script), gw.mismatches))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
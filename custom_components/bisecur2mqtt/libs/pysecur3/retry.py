@@ -0,0 +1,141 @@
+import time
+import random
+import threading
+from enum import Enum
+
+"""
+Declarative retry policy for MCPClient requests
+
+A policy is a table {exception class: RetryRule}. The rule is looked up along the
+MRO of the raised exception, so a rule for MCPBusyError covers PORT_ERROR,
+GATEWAY_BUSY and ADAPTER_BUSY unless one of them has its own entry.
+
+    session = policy.begin()
+    while True:
+        try:
+            return cli.get_transition(0)
+        except Exception as ex:
+            decision = session.next(ex)
+            if decision.action == RetryAction.GIVE_UP:
+                raise
+            ...  # re-login / reconnect as asked, then sleep(decision.delay)
+"""
+
+
+class RetryAction(Enum):
+    WAIT = 'wait'
+    RELOGIN = 'relogin'
+    RECONNECT = 'reconnect'
+    GIVE_UP = 'give_up'
+
+
+class RetryRule:
+    def __init__(self, action, base_delay=0.0, max_delay=None, max_attempts=None):
+        self.action = action
+        self.base_delay = base_delay
+        self.max_delay = max_delay if max_delay is not None else base_delay
+        self.max_attempts = max_attempts  # per request, on top of the policy wide limit
+
+    def delay(self, attempt, jitter=0.0):
+        """
+        Exponential backoff for the n-th attempt (1-based) with +/- jitter (fraction)
+        """
+        delay = min(self.base_delay * (2 ** (attempt - 1)), self.max_delay)
+        if jitter:
+            delay *= 1 + random.uniform(-jitter, jitter)
+        return max(delay, 0.0)
+
+    def __repr__(self):
+        return f"RetryRule({self.action.name}, base_delay={self.base_delay}, max_delay={self.max_delay})"
+
+
+class RetryDecision:
+    def __init__(self, action, delay, attempt, error):
+        self.action = action
+        self.delay = delay
+        self.attempt = attempt
+        self.error = error
+
+    def __repr__(self):
+        return f"RetryDecision({self.action.name}, delay={self.delay:.2f}, attempt={self.attempt})"
+
+
+GIVE_UP = RetryRule(RetryAction.GIVE_UP)
+
+
+class RetryPolicy:
+    def __init__(self, rules, default=GIVE_UP, max_attempts=5, budget=30.0, jitter=0.2):
+        self.rules = dict(rules)
+        self.default = default
+        self.max_attempts = max_attempts
+        self.budget = budget  # total seconds a single request may spend retrying
+        self.jitter = jitter
+
+        self._lock = threading.Lock()
+        self.error_counts = {}
+        self.action_counts = {}
+
+    def rule_for(self, exc):
+        for cls in type(exc).__mro__:
+            rule = self.rules.get(cls)
+            if rule is not None:
+                return rule
+        return self.default
+
+    def begin(self, max_attempts=None, budget=None, deadline=None):
+        return RetrySession(self,
+                            max_attempts if max_attempts is not None else self.max_attempts,
+                            budget if budget is not None else self.budget,
+                            deadline)
+
+    def record(self, exc, action):
+        with self._lock:
+            name = type(exc).__name__
+            self.error_counts[name] = self.error_counts.get(name, 0) + 1
+            self.action_counts[action.value] = self.action_counts.get(action.value, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {"errors": dict(self.error_counts), "actions": dict(self.action_counts)}
+
+
+class RetrySession:
+    """
+    Retry state of one logical request: attempt counter and time budget
+    """
+
+    def __init__(self, policy, max_attempts, budget, deadline=None):
+        self.policy = policy
+        self.max_attempts = max_attempts
+        self.started = time.monotonic()
+        self.deadline = self.started + budget if budget else None
+        if deadline is not None:
+            # the caller's deadline (time.monotonic()) caps the retry budget
+            self.deadline = deadline if self.deadline is None else min(self.deadline, deadline)
+        self.attempts = 0
+        self.rule_attempts = {}
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def next(self, exc):
+        self.attempts += 1
+        rule = self.policy.rule_for(exc)
+        action = rule.action
+        delay = 0.0
+
+        if action != RetryAction.GIVE_UP:
+            rule_attempt = self.rule_attempts.get(rule, 0) + 1
+            self.rule_attempts[rule] = rule_attempt
+            delay = rule.delay(rule_attempt, self.policy.jitter)
+            remaining = self.remaining()
+            if self.attempts > self.max_attempts \
+                    or (rule.max_attempts is not None and rule_attempt > rule.max_attempts) \
+                    or (remaining is not None and delay >= remaining):
+                action = RetryAction.GIVE_UP
+                delay = 0.0
+
+        self.policy.record(exc, action)
+        return RetryDecision(action, delay, self.attempts, exc)
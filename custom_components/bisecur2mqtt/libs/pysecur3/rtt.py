@@ -0,0 +1,72 @@
+import time
+import threading
+from collections import deque
+
+"""
+Adaptive per-command timeouts
+
+The gateway answers most commands within tens of milliseconds, yet a fixed socket
+timeout has to cover the slowest one (first request after login, GET_TRANSITION on a
+busy port). RTTEstimator keeps a window of the last round-trip times per MCP command
+id and derives the timeout from a running percentile:
+
+    timeout = clamp(percentile(rtt) * factor + margin, min_timeout, max_timeout)
+
+Commands without samples get max_timeout. A timed out request is recorded with the
+timeout it used, so a gateway that got slower pushes its own timeout up.
+"""
+
+
+class RTTEstimator:
+    def __init__(self, percentile=0.95, window=32, factor=2.0, margin=0.25, min_timeout=1.0, max_timeout=5.0):
+        self.percentile = percentile
+        self.window = window
+        self.factor = factor
+        self.margin = margin
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+
+        self._lock = threading.Lock()
+        self.samples = {}  # command_id -> deque of seconds
+
+    def record(self, command_id, rtt):
+        with self._lock:
+            samples = self.samples.get(command_id)
+            if samples is None:
+                samples = self.samples[command_id] = deque(maxlen=self.window)
+            samples.append(rtt)
+
+    def percentile_of(self, command_id, percentile=None):
+        with self._lock:
+            samples = self.samples.get(command_id)
+            if not samples:
+                return None
+            ordered = sorted(samples)
+        pos = (self.percentile if percentile is None else percentile) * (len(ordered) - 1)
+        lo = int(pos)
+        hi = min(lo + 1, len(ordered) - 1)
+        return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+    def timeout(self, command_id, deadline=None):
+        """
+        Socket timeout for command_id, never past deadline (absolute time.monotonic() value)
+        """
+        rtt = self.percentile_of(command_id)
+        if rtt is None:
+            timeout = self.max_timeout
+        else:
+            timeout = min(max(rtt * self.factor + self.margin, self.min_timeout), self.max_timeout)
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+        return timeout
+
+    def stats(self):
+        t = {}
+        for command_id in list(self.samples):
+            t[command_id] = {
+                "samples": len(self.samples[command_id]),
+                "p50": round(self.percentile_of(command_id, 0.5), 3),
+                "p95": round(self.percentile_of(command_id), 3),
+                "timeout": round(self.timeout(command_id), 3),
+            }
+        return t
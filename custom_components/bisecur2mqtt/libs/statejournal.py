@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict, deque
+
+"""
+Outbound state journal for broker outages
+
+While the MQTT connection is down the bridge records its publishes here instead
+of handing them to the client (where QoS 0 is lost and QoS > 0 piles up):
+
+ - state topics (position, state, _ts twins, attributes, heartbeat ...) are
+   coalesced: only the latest payload per topic is kept
+ - event topics (command/status, send_command/response ...) keep every message
+   in order, up to max_events; the oldest are dropped beyond that
+
+drain() hands everything over in one go (events first, then the latest states)
+so the reconnect handler can publish it as one burst without waiting on anything.
+"""
+
+
+class StateJournal:
+    """
+    Thread-safe: record() is called from trackers and the poll thread, drain()
+    from the MQTT network thread
+    """
+
+    def __init__(self, event_topics=(), max_events=50):
+        self.event_topics = frozenset(event_topics)
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._states = OrderedDict()  # topic -> (payload, qos, retain), in order of last update
+        self._events = deque()        # (topic, payload, qos, retain)
+        self.recorded = 0
+        self.coalesced = 0  # state updates replaced by a newer one before the flush
+        self.dropped = 0    # events dropped because of max_events
+        self.flushed = 0
+        self.flushes = 0
+
+    def record(self, topic, payload, qos=0, retain=False, event=None):
+        """
+        Keep a publish for the next flush. event=None decides by topic.
+        """
+        if event is None:
+            event = topic in self.event_topics
+        with self._lock:
+            self.recorded += 1
+            if event:
+                if len(self._events) >= self.max_events:
+                    self._events.popleft()
+                    self.dropped += 1
+                self._events.append((topic, payload, qos, retain))
+            else:
+                if topic in self._states:
+                    self.coalesced += 1
+                    self._states.move_to_end(topic)
+                self._states[topic] = (payload, qos, retain)
+
+    def drain(self):
+        """
+        Returns [(topic, payload, qos, retain), ...] to publish and empties the journal
+        """
+        with self._lock:
+            messages = list(self._events)
+            messages.extend((topic,) + value for topic, value in self._states.items())
+            self._events.clear()
+            self._states.clear()
+            if messages:
+                self.flushed += len(messages)
+                self.flushes += 1
+            return messages
+
+    def __len__(self):
+        with self._lock:
+            return len(self._events) + len(self._states)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending_states": len(self._states),
+                "pending_events": len(self._events),
+                "recorded": self.recorded,
+                "coalesced": self.coalesced,
+                "dropped": self.dropped,
+                "flushed": self.flushed,
+                "flushes": self.flushes,
+            }